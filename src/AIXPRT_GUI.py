@@ -39,6 +39,7 @@ from kivy.clock import Clock
 
 # backend imports
 import aixprt
+import store
 
 # Sets initial size of our Window
 Window.size = (1200, 750)
@@ -202,7 +203,10 @@ class WorkloadEditScreen(Screen):
                              self.ids.eval_step_interval.text, self.ids.train_batch_size.text,
                              self.ids.test_batch_size.text, self.ids.validation_batch_size.text,
                              self.ids.flip_left_right.text, self.ids.random_crop.text, self.ids.random_scale.text,
-                             self.ids.random_brightness.text, self.ids.command.text)
+                             self.ids.random_brightness.text, self.ids.command.text,
+                             # The pinning isn't edited on this screen, so the workload keeps it
+                             self.active_workload.cpu_set, self.active_workload.numa_node,
+                             self.active_workload.intra_op_threads, self.active_workload.inter_op_threads)
 
         if valid != 0:
             App.get_running_app().message_text = 'Failed To Edit Workload\nSee console for details.'
@@ -690,7 +694,8 @@ class SuiteEditScreen(Screen):
         # Update active workload with our selected.
         if self.ids.spin_suite_edit.text != 'Choose...':
 
-            self.active_suite = aixprt.get_suite(self.ids.spin_suite_edit.text)
+            # The suite is edited in place, so a copy of the shared, immutable suite is taken
+            self.active_suite = store.thaw(aixprt.get_suite(self.ids.spin_suite_edit.text))
             self.active_suite_name = self.ids.spin_suite_edit.text
             self.ids.edit_suite_name.text = self.active_suite_name
             App.get_running_app().wl_counter = len(self.active_suite)
@@ -121,12 +121,25 @@ from __future__ import print_function
 
 import argparse
 import collections
+import concurrent.futures
+import contextlib
 from datetime import datetime
 import hashlib
+import json
 import os.path
+import queue
 import random
 import re
+import shutil
 import sys
+import tempfile
+import threading
+import time
+
+try:
+  import fcntl
+except ImportError:  # Windows has no flock.
+  fcntl = None
 
 import numpy as np
 import tensorflow as tf
@@ -144,8 +157,36 @@ CHECKPOINT_NAME = '/tmp/_retrain_checkpoint'
 FAKE_QUANT_OPS = ('FakeQuantWithMinMaxVars',
                   'FakeQuantWithMinMaxVarsPerChannel')
 
-
-def create_image_lists(image_dir, testing_percentage, validation_percentage):
+# File names used by the memory-mapped bottleneck cache inside the per-module
+# cache folder.
+BOTTLENECK_DATA_FILE = 'bottlenecks.f32'
+BOTTLENECK_INDEX_FILE = 'index.json'
+# Manifests written by scan_image_dir with another version are scanned again.
+IMAGE_MANIFEST_VERSION = 2
+# Every run holds a shared lock on this file while it uses the cache, and
+# eviction holds an exclusive one while it deletes the cache.
+BOTTLENECK_LOCK_FILE = 'lock'
+# Without flock, caches used within this many seconds are never evicted.
+BOTTLENECK_EVICTION_GRACE_SECONDS = 3600
+
+# The tensors and operations of a training graph built by get_training_graph.
+TrainingGraph = collections.namedtuple('TrainingGraph', [
+    'graph', 'bottleneck_tensor', 'resized_image_tensor', 'wants_quantization',
+    'train_step', 'cross_entropy', 'bottleneck_input', 'ground_truth_input',
+    'final_tensor', 'jpeg_data_tensor', 'decoded_image_tensor',
+    'batch_jpeg_data_tensor', 'batch_decoded_image_tensor',
+    'distorted_jpeg_data_tensor', 'distorted_image_tensor', 'evaluation_step',
+    'merged', 'init', 'train_saver'])
+
+# Module specs and training graphs are kept for later runs in the same process.
+# Only the most recently used MAX_TRAINING_GRAPHS training graphs are kept.
+MAX_TRAINING_GRAPHS = 4
+MODULE_SPECS = {}
+TRAINING_GRAPHS = collections.OrderedDict()
+
+
+def create_image_lists(image_dir, testing_percentage, validation_percentage,
+                       manifest_dir=None):
   """Builds a list of training images from the file system.
 
   Analyzes the sub folders in the image directory, splits them into stable
@@ -156,6 +197,8 @@ def create_image_lists(image_dir, testing_percentage, validation_percentage):
     image_dir: String path to a folder containing subfolders of images.
     testing_percentage: Integer percentage of the images to reserve for tests.
     validation_percentage: Integer percentage of images reserved for validation.
+    manifest_dir: Optional folder string where a manifest of the images is kept
+    between runs, so that only changed subfolders are scanned again.
 
   Returns:
     An OrderedDict containing an entry for each label subfolder, with images
@@ -165,24 +208,12 @@ def create_image_lists(image_dir, testing_percentage, validation_percentage):
   if not tf.gfile.Exists(image_dir):
     tf.logging.error("Image directory '" + image_dir + "' not found.")
     return None
+  if manifest_dir and '://' not in image_dir:
+    image_files = scan_image_dir(image_dir, manifest_dir)
+  else:
+    image_files = walk_image_dir(image_dir)
   result = collections.OrderedDict()
-  sub_dirs = sorted(x[0] for x in tf.gfile.Walk(image_dir))
-  # The root directory comes first, so skip it.
-  is_root_dir = True
-  for sub_dir in sub_dirs:
-    if is_root_dir:
-      is_root_dir = False
-      continue
-    extensions = sorted(set(os.path.normcase(ext)  # Smash case on Windows.
-                            for ext in ['JPEG', 'JPG', 'jpeg', 'jpg']))
-    file_list = []
-    dir_name = os.path.basename(sub_dir)
-    if dir_name == image_dir:
-      continue
-    tf.logging.info("Looking for images in '" + dir_name + "'")
-    for extension in extensions:
-      file_glob = os.path.join(image_dir, dir_name, '*.' + extension)
-      file_list.extend(tf.gfile.Glob(file_glob))
+  for dir_name, file_list in image_files.items():
     if not file_list:
       tf.logging.warning('No files found')
       continue
@@ -197,25 +228,7 @@ def create_image_lists(image_dir, testing_percentage, validation_percentage):
     training_images = []
     testing_images = []
     validation_images = []
-    for file_name in file_list:
-      base_name = os.path.basename(file_name)
-      # We want to ignore anything after '_nohash_' in the file name when
-      # deciding which set to put an image in, the data set creator has a way of
-      # grouping photos that are close variations of each other. For example
-      # this is used in the plant disease data set to group multiple pictures of
-      # the same leaf.
-      hash_name = re.sub(r'_nohash_.*$', '', file_name)
-      # This looks a bit magical, but we need to decide whether this file should
-      # go into the training, testing, or validation sets, and we want to keep
-      # existing files in the same set even if more files are subsequently
-      # added.
-      # To do that, we need a stable way of deciding based on just the file name
-      # itself, so we do a hash of that and then use that to generate a
-      # probability value that we use to assign it.
-      hash_name_hashed = hashlib.sha1(tf.compat.as_bytes(hash_name)).hexdigest()
-      percentage_hash = ((int(hash_name_hashed, 16) %
-                          (MAX_NUM_IMAGES_PER_CLASS + 1)) *
-                         (100.0 / MAX_NUM_IMAGES_PER_CLASS))
+    for base_name, percentage_hash in file_list:
       if percentage_hash < validation_percentage:
         validation_images.append(base_name)
       elif percentage_hash < (testing_percentage + validation_percentage):
@@ -231,6 +244,134 @@ def create_image_lists(image_dir, testing_percentage, validation_percentage):
   return result
 
 
+def get_percentage_hash(file_name):
+  """Returns the stable value between 0 and 100 that decides an image's set.
+
+  Args:
+    file_name: Path string of the image, including the image directory.
+
+  Returns:
+    A float that is compared against the testing and validation percentages.
+  """
+  # We want to ignore anything after '_nohash_' in the file name when
+  # deciding which set to put an image in, the data set creator has a way of
+  # grouping photos that are close variations of each other. For example
+  # this is used in the plant disease data set to group multiple pictures of
+  # the same leaf.
+  hash_name = re.sub(r'_nohash_.*$', '', file_name)
+  # This looks a bit magical, but we need to decide whether this file should
+  # go into the training, testing, or validation sets, and we want to keep
+  # existing files in the same set even if more files are subsequently
+  # added.
+  # To do that, we need a stable way of deciding based on just the file name
+  # itself, so we do a hash of that and then use that to generate a
+  # probability value that we use to assign it.
+  hash_name_hashed = hashlib.sha1(tf.compat.as_bytes(hash_name)).hexdigest()
+  return ((int(hash_name_hashed, 16) % (MAX_NUM_IMAGES_PER_CLASS + 1)) *
+          (100.0 / MAX_NUM_IMAGES_PER_CLASS))
+
+
+def walk_image_dir(image_dir):
+  """Lists the images in each subfolder of image_dir using tf.gfile.
+
+  Args:
+    image_dir: String path to a folder containing subfolders of images.
+
+  Returns:
+    An OrderedDict mapping each subfolder name to a list of
+    [base_name, percentage_hash] pairs for its images.
+  """
+  result = collections.OrderedDict()
+  sub_dirs = sorted(x[0] for x in tf.gfile.Walk(image_dir))
+  # The root directory comes first, so skip it.
+  is_root_dir = True
+  for sub_dir in sub_dirs:
+    if is_root_dir:
+      is_root_dir = False
+      continue
+    extensions = sorted(set(os.path.normcase(ext)  # Smash case on Windows.
+                            for ext in ['JPEG', 'JPG', 'jpeg', 'jpg']))
+    file_list = []
+    dir_name = os.path.basename(sub_dir)
+    if dir_name == image_dir or dir_name.startswith('.'):
+      continue
+    tf.logging.info("Looking for images in '" + dir_name + "'")
+    for extension in extensions:
+      file_glob = os.path.join(image_dir, dir_name, '*.' + extension)
+      file_list.extend(tf.gfile.Glob(file_glob))
+    # Hidden files, like macOS's ._ resource forks, aren't images.
+    result[dir_name] = [[os.path.basename(file_name),
+                         get_percentage_hash(file_name)]
+                        for file_name in file_list
+                        if not os.path.basename(file_name).startswith('.')]
+  return result
+
+
+def scan_image_dir(image_dir, manifest_dir):
+  """Lists the images in each subfolder of image_dir, reusing a manifest.
+
+  The manifest records the modification time of every subfolder along with
+  the percentage hash of each of its images. Only subfolders whose
+  modification time changed, because images were added, removed or renamed,
+  are listed again with os.scandir, so unchanged datasets are never rescanned.
+  The images, and the sets they are split into, are the same as
+  walk_image_dir's: the images directly inside each top-level subfolder.
+  walk_image_dir visits nested subfolders too, but looks for their images
+  under image_dir/<nested folder name>, so they only add empty labels, which
+  create_image_lists skips. Hidden files and folders are left out.
+
+  Args:
+    image_dir: String path to a local folder containing subfolders of images.
+    manifest_dir: Folder string where the manifest is kept.
+
+  Returns:
+    An OrderedDict mapping each subfolder name to a list of
+    [base_name, percentage_hash] pairs for its images.
+  """
+  # Image paths, and therefore their hashes, include image_dir as given.
+  manifest_path = os.path.join(
+      manifest_dir, hashlib.sha1(tf.compat.as_bytes(
+          os.path.abspath(image_dir) + '\n' + image_dir)).hexdigest() + '.json')
+  cached_dirs = {}
+  if os.path.exists(manifest_path):
+    with open(manifest_path, 'r') as manifest_file:
+      manifest = json.load(manifest_file)
+    if (manifest.get('version') == IMAGE_MANIFEST_VERSION and
+        manifest['image_dir'] == image_dir):
+      cached_dirs = manifest['dirs']
+  extensions = sorted(set(os.path.normcase(ext)  # Smash case on Windows.
+                          for ext in ['JPEG', 'JPG', 'jpeg', 'jpg']))
+  result = collections.OrderedDict()
+  dirs = {}
+  is_changed = False
+  sub_dirs = sorted((entry for entry in os.scandir(image_dir)
+                     if entry.is_dir() and not entry.name.startswith('.')),
+                    key=lambda entry: entry.name)
+  for sub_dir in sub_dirs:
+    mtime_ns = sub_dir.stat().st_mtime_ns
+    cached_dir = cached_dirs.get(sub_dir.name)
+    if cached_dir is None or cached_dir['mtime_ns'] != mtime_ns:
+      tf.logging.info("Looking for images in '" + sub_dir.name + "'")
+      file_names = sorted(entry.name for entry in os.scandir(sub_dir.path)
+                          if entry.is_file() and
+                          not entry.name.startswith('.'))
+      file_list = []
+      for extension in extensions:
+        for file_name in file_names:
+          if os.path.normcase(file_name).endswith('.' + extension):
+            file_list.append([file_name, get_percentage_hash(
+                os.path.join(image_dir, sub_dir.name, file_name))])
+      cached_dir = {'mtime_ns': mtime_ns, 'files': file_list}
+      is_changed = True
+    dirs[sub_dir.name] = cached_dir
+    result[sub_dir.name] = cached_dir['files']
+  if is_changed or len(dirs) != len(cached_dirs):
+    ensure_dir_exists(manifest_dir)
+    write_json_file(manifest_path, {'version': IMAGE_MANIFEST_VERSION,
+                                    'image_dir': image_dir, 'dirs': dirs})
+  return result
+
+
 def get_image_path(image_lists, label_name, index, image_dir, category):
   """Returns a path to an image for a label at the given index.
 
@@ -281,11 +422,343 @@ def get_bottleneck_path(image_lists, label_name, index, bottleneck_dir,
   Returns:
     File system path string to an image that meets the requested parameters.
   """
-  module_name = (module_name.replace('://', '~')  # URL scheme.
-                 .replace('/', '~')  # URL and Unix paths.
-                 .replace(':', '~').replace('\\', '~'))  # Windows paths.
-  return get_image_path(image_lists, label_name, index, bottleneck_dir,
-                        category) + '_' + module_name + '.txt'
+  return (get_image_path(image_lists, label_name, index, bottleneck_dir,
+                         category) +
+          '_' + get_module_cache_name(module_name) + '.txt')
+
+
+def get_module_cache_name(module_name):
+  """Returns a version of the module name that is safe to use in file names.
+
+  Args:
+    module_name: The name of the image module being used.
+
+  Returns:
+    String with URL schemes and path separators replaced by '~'.
+  """
+  return (module_name.replace('://', '~')  # URL scheme.
+          .replace('/', '~')  # URL and Unix paths.
+          .replace(':', '~').replace('\\', '~'))  # Windows paths.
+
+
+def get_bottleneck_key(image_lists, label_name, index, image_dir, category):
+  """Returns the key of an image in the memory-mapped bottleneck cache.
+
+  Args:
+    image_lists: OrderedDict of training images for each label.
+    label_name: Label string we want to get an image for.
+    index: Integer offset of the image we want. This will be moduloed by the
+    available number of images for the label, so it can be arbitrarily large.
+    image_dir: Root folder string of the subfolders containing the training
+    images.
+    category: Name string of set to pull images from - training, testing, or
+    validation.
+
+  Returns:
+    The absolute path of the image file.
+  """
+  return os.path.abspath(get_image_path(image_lists, label_name, index,
+                                        image_dir, category))
+
+
+def get_image_signature(image_path):
+  """Returns the [size, mtime] pair used to notice that an image has changed."""
+  image_stat = os.stat(image_path)
+  return [image_stat.st_size, image_stat.st_mtime_ns]
+
+
+class MemmapBottleneckCache(object):
+  """Stores every bottleneck for a module in one contiguous float32 file.
+
+  Rows are appended to BOTTLENECK_DATA_FILE in the order they are created and
+  BOTTLENECK_INDEX_FILE maps the SHA-1 of each image's contents to its row
+  offset. Reads go through a read-only np.memmap of the data file, so a batch of
+  bottlenecks is a single fancy-index slice instead of one text file parse per
+  image.
+
+  Each module and preprocessing setup gets its own cache folder, and the cache
+  persists between runs. Image paths (see get_bottleneck_key) are mapped to
+  content hashes together with the file's size and modification time, so an
+  image that changes on disk is recalculated while identical images share a
+  row.
+
+  Rows that were appended after the last flush() (for example by a run that
+  was killed) are not in the index, and are truncated away when the cache is
+  next opened.
+
+  The cache holds a shared lock on BOTTLENECK_LOCK_FILE until it is closed, so
+  that evict_bottleneck_caches never deletes it from under a run in another
+  process.
+  """
+
+  def __init__(self, bottleneck_dir, module_name, preprocessing=None):
+    """Opens, or creates, the cache for a module.
+
+    Args:
+      bottleneck_dir: Folder string holding cached bottleneck values.
+      module_name: The name of the image module being used.
+      preprocessing: Optional dict of the image preprocessing parameters that
+      the bottlenecks depend on, e.g. the module's input size.
+    """
+    cache_name = get_module_cache_name(module_name)
+    if preprocessing:
+      cache_name += '_' + hashlib.sha1(tf.compat.as_bytes(
+          json.dumps(preprocessing, sort_keys=True))).hexdigest()[:8]
+    self.module_name = module_name
+    self.preprocessing = preprocessing
+    self.cache_dir = os.path.join(bottleneck_dir, cache_name)
+    self.data_path = os.path.join(self.cache_dir, BOTTLENECK_DATA_FILE)
+    self.index_path = os.path.join(self.cache_dir, BOTTLENECK_INDEX_FILE)
+    self.bottleneck_size = None
+    self.row_count = 0
+    self.rows = {}
+    self.images = {}
+    # Keys that is_fresh has already checked against the image on disk.
+    self._fresh = set()
+    self._data_file = None
+    self._mapped = None
+    self._dirty = False
+    self._lock_file = self._lock()
+    if os.path.exists(self.index_path):
+      with open(self.index_path, 'r') as index_file:
+        index = json.load(index_file)
+      self.bottleneck_size = index['bottleneck_size']
+      self.row_count = index['row_count']
+      self.rows = index['rows']
+      self.images = index['images']
+      # Mark the cache as recently used for evict_bottleneck_caches.
+      os.utime(self.index_path, None)
+    expected_size = self.row_count * (self.bottleneck_size or 0) * 4
+    data_size = (os.path.getsize(self.data_path)
+                 if os.path.exists(self.data_path) else 0)
+    if data_size < expected_size:
+      tf.logging.warning('Bottleneck cache %s is truncated, recreating it' %
+                         self.cache_dir)
+      self._reset()
+      expected_size = 0
+    if data_size != expected_size:
+      with open(self.data_path, 'ab') as data_file:
+        data_file.truncate(expected_size)
+
+  def _lock(self):
+    """Creates the cache folder and takes a shared lock on it.
+
+    Returns:
+      The open lock file, or None if locking isn't supported.
+    """
+    lock_path = os.path.join(self.cache_dir, BOTTLENECK_LOCK_FILE)
+    while True:
+      ensure_dir_exists(self.cache_dir)
+      if fcntl is None:
+        return None
+      lock_file = open(lock_path, 'a')
+      fcntl.flock(lock_file, fcntl.LOCK_SH)
+      # The cache may have been evicted while waiting for the lock, in which
+      # case the lock is on a deleted file and the folder is made again.
+      try:
+        if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+          return lock_file
+      except OSError:
+        pass
+      lock_file.close()
+
+  def __contains__(self, key):
+    return key in self.images
+
+  def __len__(self):
+    return len(self.images)
+
+  def _reset(self):
+    self.bottleneck_size = None
+    self.row_count = 0
+    self.rows = {}
+    self.images = {}
+    self._fresh = set()
+    self._mapped = None
+    self._dirty = True
+
+  def is_fresh(self, key):
+    """Whether an image is cached and unchanged on disk since it was added.
+
+    Stale entries are dropped, so the image will be recalculated. Each image
+    is only checked on disk once while the cache is open.
+    """
+    if key in self._fresh:
+      return True
+    if key not in self.images:
+      return False
+    try:
+      signature = get_image_signature(key)
+    except OSError:
+      signature = None
+    if signature != self.images[key][:2]:
+      del self.images[key]
+      self._dirty = True
+      return False
+    self._fresh.add(key)
+    return True
+
+  def add(self, key, bottleneck_values, content_hash=None):
+    """Adds the bottleneck values for an image to the cache.
+
+    Args:
+      key: Cache key of the image, from get_bottleneck_key.
+      bottleneck_values: Sequence of bottleneck values for the image.
+      content_hash: SHA-1 hex digest of the image's contents. The file is read
+      to calculate it if not given.
+    """
+    if content_hash is None:
+      content_hash = hashlib.sha1(read_image_file(key)).hexdigest()
+    self.images[key] = get_image_signature(key) + [content_hash]
+    self._fresh.add(key)
+    self._dirty = True
+    if content_hash in self.rows:
+      return
+    values = np.asarray(bottleneck_values, dtype=np.float32).reshape(-1)
+    if self.bottleneck_size is None:
+      self.bottleneck_size = values.shape[0]
+    elif values.shape[0] != self.bottleneck_size:
+      raise ValueError('Expected %d bottleneck values for %s, got %d' %
+                       (self.bottleneck_size, key, values.shape[0]))
+    if self._data_file is None:
+      self._data_file = open(self.data_path, 'ab')
+    self._data_file.write(values.tobytes())
+    self.rows[content_hash] = self.row_count
+    self.row_count += 1
+
+  def row(self, key):
+    """Returns the row offset holding an image's bottleneck values."""
+    return self.rows[self.images[key][2]]
+
+  def get(self, key):
+    """Returns the bottleneck values of a single cached image."""
+    return self.get_rows([self.row(key)])[0]
+
+  def lookup(self, keys):
+    """Returns a float32 array with the bottlenecks of the given images."""
+    return self.get_rows([self.row(key) for key in keys])
+
+  def get_rows(self, rows):
+    """Returns the bottleneck values stored at the given row offsets.
+
+    Args:
+      rows: Integer sequence or array of row offsets.
+
+    Returns:
+      A float32 array with one row of bottleneck values per requested offset.
+    """
+    return self._map()[rows]
+
+  def _map(self):
+    """Returns a memmap over the data file, remapping it after appends."""
+    if self._mapped is None or self._mapped.shape[0] < self.row_count:
+      if self._data_file is not None:
+        self._data_file.flush()
+      self._mapped = np.memmap(self.data_path, dtype=np.float32, mode='r',
+                               shape=(self.row_count, self.bottleneck_size))
+    return self._mapped
+
+  def clear(self):
+    """Removes every cached bottleneck, for cold-cache runs."""
+    if self._data_file is not None:
+      self._data_file.close()
+      self._data_file = None
+    self._reset()
+    with open(self.data_path, 'wb'):
+      pass
+    self.flush()
+
+  def flush(self):
+    """Writes any appended rows and the index to disk."""
+    if self._data_file is not None:
+      self._data_file.flush()
+    if not self._dirty:
+      return
+    write_json_file(self.index_path, {'module': self.module_name,
+                                      'preprocessing': self.preprocessing,
+                                      'bottleneck_size': self.bottleneck_size,
+                                      'row_count': self.row_count,
+                                      'rows': self.rows,
+                                      'images': self.images})
+    self._dirty = False
+
+  def close(self):
+    """Flushes the cache and releases its file handles and lock."""
+    try:
+      self.flush()
+    finally:
+      if self._data_file is not None:
+        self._data_file.close()
+        self._data_file = None
+      self._mapped = None
+      if self._lock_file is not None:
+        self._lock_file.close()
+        self._lock_file = None
+
+
+def clear_bottleneck_files(bottleneck_dir, module_name):
+  """Deletes the per-image text bottleneck files written for a module.
+
+  Args:
+    bottleneck_dir: Folder string holding cached files of bottleneck values.
+    module_name: The name of the image module being used.
+  """
+  suffix = '_' + get_module_cache_name(module_name) + '.txt'
+  for dir_path, _, file_names in os.walk(bottleneck_dir):
+    for file_name in file_names:
+      if file_name.endswith(suffix):
+        os.remove(os.path.join(dir_path, file_name))
+
+
+def evict_bottleneck_caches(bottleneck_dir, max_bytes, keep_dir=None):
+  """Deletes least recently used module caches until they fit in max_bytes.
+
+  Caches that another run has open are skipped, see MemmapBottleneckCache.
+
+  Args:
+    bottleneck_dir: Folder string holding cached bottleneck values.
+    max_bytes: Integer size limit for all memory-mapped caches together.
+    keep_dir: Optional cache folder that must not be evicted, usually the one
+    the current run is using.
+  """
+  if not os.path.isdir(bottleneck_dir):
+    return
+  caches = []
+  for entry in os.listdir(bottleneck_dir):
+    cache_dir = os.path.join(bottleneck_dir, entry)
+    index_path = os.path.join(cache_dir, BOTTLENECK_INDEX_FILE)
+    if not os.path.isfile(index_path):
+      continue
+    size = sum(os.path.getsize(os.path.join(cache_dir, file_name))
+               for file_name in os.listdir(cache_dir))
+    caches.append((os.path.getmtime(index_path), size, cache_dir))
+  total_size = sum(size for _, size, _ in caches)
+  for _, size, cache_dir in sorted(caches):
+    if total_size <= max_bytes:
+      break
+    if keep_dir and os.path.abspath(cache_dir) == os.path.abspath(keep_dir):
+      continue
+    if fcntl is None:
+      index_path = os.path.join(cache_dir, BOTTLENECK_INDEX_FILE)
+      if (time.time() - os.path.getmtime(index_path) <
+          BOTTLENECK_EVICTION_GRACE_SECONDS):
+        continue
+      lock_file = None
+    else:
+      lock_file = open(os.path.join(cache_dir, BOTTLENECK_LOCK_FILE), 'a')
+      try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except OSError:
+        # Another run is using the cache.
+        lock_file.close()
+        continue
+    try:
+      tf.logging.info('Evicting bottleneck cache ' + cache_dir)
+      shutil.rmtree(cache_dir, ignore_errors=True)
+    finally:
+      if lock_file is not None:
+        lock_file.close()
+    total_size -= size
 
 
 def create_module_graph(module_spec):
@@ -347,6 +820,42 @@ def ensure_dir_exists(dir_name):
     os.makedirs(dir_name)
 
 
+def write_json_file(path, data):
+  """Replaces a JSON file without ever leaving it half written.
+
+  The data goes to a uniquely named temporary file in the same folder that is
+  then renamed over the file, so runs writing the same file at the same time
+  don't write over each other's temporary file.
+
+  Args:
+    path: Path string to the JSON file.
+    data: Object to write as JSON.
+  """
+  descriptor, temp_path = tempfile.mkstemp(
+      dir=os.path.dirname(os.path.abspath(path)), prefix='.', suffix='.tmp')
+  try:
+    with os.fdopen(descriptor, 'w') as json_file:
+      json.dump(data, json_file)
+    os.replace(temp_path, path)
+  except BaseException:
+    os.remove(temp_path)
+    raise
+
+
+def calculate_bottleneck(image_path, image_data, sess, jpeg_data_tensor,
+                         decoded_image_tensor, resized_input_tensor,
+                         bottleneck_tensor):
+  """Runs an image that was read from image_path through the module."""
+  try:
+    bottleneck_values = run_bottleneck_on_image(
+        sess, image_data, jpeg_data_tensor, decoded_image_tensor,
+        resized_input_tensor, bottleneck_tensor)
+  except Exception as e:
+    raise RuntimeError('Error during processing file %s (%s)' % (image_path,
+                                                                 str(e)))
+  return bottleneck_values
+
+
 def create_bottleneck_file(bottleneck_path, image_lists, label_name, index,
                            image_dir, category, sess, jpeg_data_tensor,
                            decoded_image_tensor, resized_input_tensor,
@@ -355,16 +864,14 @@ def create_bottleneck_file(bottleneck_path, image_lists, label_name, index,
   tf.logging.info('Creating bottleneck at ' + bottleneck_path)
   image_path = get_image_path(image_lists, label_name, index,
                               image_dir, category)
-  if not tf.gfile.Exists(image_path):
-    tf.logging.fatal('File does not exist %s', image_path)
-  image_data = tf.gfile.FastGFile(image_path, 'rb').read()
-  try:
-    bottleneck_values = run_bottleneck_on_image(
-        sess, image_data, jpeg_data_tensor, decoded_image_tensor,
-        resized_input_tensor, bottleneck_tensor)
-  except Exception as e:
-    raise RuntimeError('Error during processing file %s (%s)' % (image_path,
-                                                                 str(e)))
+  bottleneck_values = calculate_bottleneck(
+      image_path, read_image_file(image_path), sess, jpeg_data_tensor,
+      decoded_image_tensor, resized_input_tensor, bottleneck_tensor)
+  write_bottleneck_file(bottleneck_path, bottleneck_values)
+
+
+def write_bottleneck_file(bottleneck_path, bottleneck_values):
+  """Writes bottleneck values to a comma separated text file."""
   bottleneck_string = ','.join(str(x) for x in bottleneck_values)
   with open(bottleneck_path, 'w') as bottleneck_file:
     bottleneck_file.write(bottleneck_string)
@@ -373,11 +880,14 @@ def create_bottleneck_file(bottleneck_path, image_lists, label_name, index,
 def get_or_create_bottleneck(sess, image_lists, label_name, index, image_dir,
                              category, bottleneck_dir, jpeg_data_tensor,
                              decoded_image_tensor, resized_input_tensor,
-                             bottleneck_tensor, module_name):
+                             bottleneck_tensor, module_name,
+                             bottleneck_cache=None):
   """Retrieves or calculates bottleneck values for an image.
 
   If a cached version of the bottleneck data exists on-disk, return that,
-  otherwise calculate the data and save it to disk for future use.
+  otherwise calculate the data and save it to disk for future use. When a
+  MemmapBottleneckCache is given it is used instead of the per-image text
+  files under bottleneck_dir.
 
   Args:
     sess: The current active TensorFlow Session.
@@ -395,10 +905,23 @@ def get_or_create_bottleneck(sess, image_lists, label_name, index, image_dir,
     resized_input_tensor: The input node of the recognition graph.
     bottleneck_tensor: The output tensor for the bottleneck values.
     module_name: The name of the image module being used.
+    bottleneck_cache: Optional MemmapBottleneckCache for the module.
 
   Returns:
     Numpy array of values produced by the bottleneck layer for the image.
   """
+  if bottleneck_cache is not None:
+    key = get_bottleneck_key(image_lists, label_name, index, image_dir,
+                             category)
+    if bottleneck_cache.is_fresh(key):
+      return bottleneck_cache.get(key)
+    image_data = read_image_file(key)
+    bottleneck_values = calculate_bottleneck(
+        key, image_data, sess, jpeg_data_tensor, decoded_image_tensor,
+        resized_input_tensor, bottleneck_tensor)
+    bottleneck_cache.add(key, bottleneck_values,
+                         hashlib.sha1(image_data).hexdigest())
+    return bottleneck_values
   label_lists = image_lists[label_name]
   sub_dir = label_lists['dir']
   sub_dir_path = os.path.join(bottleneck_dir, sub_dir)
@@ -433,7 +956,11 @@ def get_or_create_bottleneck(sess, image_lists, label_name, index, image_dir,
 
 def cache_bottlenecks(sess, image_lists, image_dir, bottleneck_dir,
                       jpeg_data_tensor, decoded_image_tensor,
-                      resized_input_tensor, bottleneck_tensor, module_name):
+                      resized_input_tensor, bottleneck_tensor, module_name,
+                      bottleneck_cache=None, batch_size=1,
+                      batch_jpeg_data_tensor=None,
+                      batch_decoded_image_tensor=None, reader_pool=None,
+                      prefetch_depth=2):
   """Ensures all the training, testing, and validation bottlenecks are cached.
 
   Because we're likely to read the same image multiple times (if there are no
@@ -443,6 +970,12 @@ def cache_bottlenecks(sess, image_lists, image_dir, bottleneck_dir,
   training. Here we go through all the images we've found, calculate those
   values, and save them off.
 
+  With a batch_size above one and the batched decoding tensors from
+  add_batch_jpeg_decoding, the images without a cached bottleneck are decoded
+  batch_size at a time and run through the module in a single call per batch.
+  Files are read on reader_pool and decoded on a background thread, up to
+  prefetch_depth batches ahead of the module.
+
   Args:
     sess: The current active TensorFlow Session.
     image_lists: OrderedDict of training images for each label.
@@ -454,12 +987,47 @@ def cache_bottlenecks(sess, image_lists, image_dir, bottleneck_dir,
     resized_input_tensor: The input node of the recognition graph.
     bottleneck_tensor: The penultimate output layer of the graph.
     module_name: The name of the image module being used.
+    bottleneck_cache: Optional MemmapBottleneckCache for the module.
+    batch_size: Integer number of images to run through the module at a time.
+    batch_jpeg_data_tensor: Input tensor for a batch of jpeg data.
+    batch_decoded_image_tensor: The output of decoding and resizing the batch.
+    reader_pool: Optional concurrent.futures.Executor to read image files on.
+    prefetch_depth: Integer number of decoded batches to keep ready.
 
   Returns:
-    Nothing.
+    The number of images processed. Images that already had a cached
+    bottleneck are skipped, rather than processed, when calculating in batches.
   """
   how_many_bottlenecks = 0
   ensure_dir_exists(bottleneck_dir)
+  if batch_size > 1 and batch_jpeg_data_tensor is not None:
+    missing = get_missing_bottlenecks(image_lists, image_dir, bottleneck_dir,
+                                      module_name, bottleneck_cache)
+    batches = [missing[start:start + batch_size]
+               for start in range(0, len(missing), batch_size)]
+    path_batches = [[get_image_path(image_lists, label_name, index, image_dir,
+                                    category)
+                     for label_name, category, index in batch]
+                    for batch in batches]
+    with BackgroundGenerator(
+        decode_image_batches(sess, path_batches, batch_jpeg_data_tensor,
+                             batch_decoded_image_tensor, reader_pool),
+        prefetch_depth) as decoded_batches:
+      for batch, (resized_input_values,
+                  content_hashes) in zip(batches, decoded_batches):
+        bottleneck_values = sess.run(
+            bottleneck_tensor, {resized_input_tensor: resized_input_values})
+        store_bottleneck_batch(batch, bottleneck_values, content_hashes,
+                               image_lists, image_dir, bottleneck_dir,
+                               module_name, bottleneck_cache)
+        previous_count = how_many_bottlenecks
+        how_many_bottlenecks += len(batch)
+        if how_many_bottlenecks // 100 > previous_count // 100:
+          tf.logging.info(
+              str(how_many_bottlenecks) + ' bottleneck files created.')
+    if bottleneck_cache is not None:
+      bottleneck_cache.flush()
+    return how_many_bottlenecks
   for label_name, label_lists in image_lists.items():
     for category in ['training', 'testing', 'validation']:
       category_list = label_lists[category]
@@ -467,23 +1035,225 @@ def cache_bottlenecks(sess, image_lists, image_dir, bottleneck_dir,
         get_or_create_bottleneck(
             sess, image_lists, label_name, index, image_dir, category,
             bottleneck_dir, jpeg_data_tensor, decoded_image_tensor,
-            resized_input_tensor, bottleneck_tensor, module_name)
+            resized_input_tensor, bottleneck_tensor, module_name,
+            bottleneck_cache)
 
         how_many_bottlenecks += 1
         if how_many_bottlenecks % 100 == 0:
           tf.logging.info(
               str(how_many_bottlenecks) + ' bottleneck files created.')
+  if bottleneck_cache is not None:
+    bottleneck_cache.flush()
+  return how_many_bottlenecks
+
+
+def get_missing_bottlenecks(image_lists, image_dir, bottleneck_dir,
+                            module_name, bottleneck_cache=None):
+  """Lists the images that do not have an up to date cached bottleneck.
+
+  Args:
+    image_lists: OrderedDict of training images for each label.
+    image_dir: Root folder string of the subfolders containing the training
+    images.
+    bottleneck_dir: Folder string holding cached files of bottleneck values.
+    module_name: The name of the image module being used.
+    bottleneck_cache: Optional MemmapBottleneckCache for the module.
+
+  Returns:
+    List of (label_name, category, index) tuples.
+  """
+  missing = []
+  for label_name, label_lists in image_lists.items():
+    if bottleneck_cache is None:
+      ensure_dir_exists(os.path.join(bottleneck_dir, label_lists['dir']))
+    for category in ['training', 'testing', 'validation']:
+      for index in range(len(label_lists[category])):
+        if bottleneck_cache is not None:
+          is_cached = bottleneck_cache.is_fresh(get_bottleneck_key(
+              image_lists, label_name, index, image_dir, category))
+        else:
+          is_cached = os.path.exists(get_bottleneck_path(
+              image_lists, label_name, index, bottleneck_dir, category,
+              module_name))
+        if not is_cached:
+          missing.append((label_name, category, index))
+  return missing
+
+
+def read_image_file(image_path):
+  """Returns the raw contents of an image file."""
+  if not tf.gfile.Exists(image_path):
+    tf.logging.fatal('File does not exist %s', image_path)
+  return tf.gfile.FastGFile(image_path, 'rb').read()
+
+
+def read_image_files(image_paths, reader_pool=None):
+  """Reads a list of image files, in parallel when given a thread pool.
+
+  Args:
+    image_paths: List of image file path strings.
+    reader_pool: Optional concurrent.futures.Executor to read the files on.
+
+  Returns:
+    List of raw image strings in the same order as image_paths.
+  """
+  if reader_pool is None:
+    return [read_image_file(image_path) for image_path in image_paths]
+  return list(reader_pool.map(read_image_file, image_paths))
+
+
+class BackgroundGenerator(object):
+  """Runs a generator on a background thread and queues up its results.
+
+  At most `depth` items are produced ahead of the consumer. Exceptions raised by
+  the generator are re-raised from the consumer's next() call. Used as a context
+  manager, the thread is stopped when the block exits, even on an exception.
+  """
+
+  def __init__(self, generator, depth):
+    self._queue = queue.Queue(maxsize=max(depth, 1))
+    self._stop = threading.Event()
+    self._finished = False
+    self._thread = threading.Thread(target=self._run, args=(generator,))
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _put(self, item):
+    while not self._stop.is_set():
+      try:
+        self._queue.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def _run(self, generator):
+    try:
+      for item in generator:
+        if not self._put((True, item)):
+          return
+    except Exception as e:  # pylint: disable=broad-except
+      self._put((False, e))
+      return
+    finally:
+      # Runs the generator's own cleanup, on the thread that was running it.
+      if hasattr(generator, 'close'):
+        generator.close()
+    self._put((False, None))
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    if self._finished:
+      raise StopIteration
+    is_item, item = self._queue.get()
+    if is_item:
+      return item
+    self._finished = True
+    if item is None:
+      raise StopIteration
+    raise item
+
+  next = __next__  # Python 2 iterator protocol.
+
+  def close(self):
+    """Stops the background thread without waiting for remaining items."""
+    self._finished = True
+    self._stop.set()
+    self._thread.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    self.close()
+
+
+def decode_image_batches(sess, path_batches, batch_jpeg_data_tensor,
+                         batch_decoded_image_tensor, reader_pool=None):
+  """Yields decoded and resized images for each batch of image paths.
+
+  The files of the next batch are read on reader_pool while the current batch
+  is being decoded.
+
+  Args:
+    sess: The current active TensorFlow Session.
+    path_batches: List of lists of image file path strings.
+    batch_jpeg_data_tensor: Input tensor for a batch of jpeg data.
+    batch_decoded_image_tensor: The output of decoding and resizing the batch.
+    reader_pool: Optional concurrent.futures.Executor to read the files on.
+
+  Yields:
+    A numpy array of preprocessed images and a list of the SHA-1 hex digests of
+    the image files, for each batch in path_batches.
+  """
+  if not path_batches:
+    return
+  owns_pool = reader_pool is None
+  if owns_pool:
+    reader_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+  try:
+    next_reads = [reader_pool.submit(read_image_file, image_path)
+                  for image_path in path_batches[0]]
+    for i, image_paths in enumerate(path_batches):
+      image_data_list = [future.result() for future in next_reads]
+      if i + 1 < len(path_batches):
+        next_reads = [reader_pool.submit(read_image_file, image_path)
+                      for image_path in path_batches[i + 1]]
+      try:
+        decoded_images = sess.run(batch_decoded_image_tensor,
+                                  {batch_jpeg_data_tensor: image_data_list})
+      except tf.errors.OpError as e:
+        raise RuntimeError('Error during processing files %s (%s)' %
+                           (', '.join(image_paths), str(e)))
+      yield decoded_images, [hashlib.sha1(image_data).hexdigest()
+                             for image_data in image_data_list]
+  finally:
+    if owns_pool:
+      reader_pool.shutdown(wait=False)
+
+
+def store_bottleneck_batch(batch, bottleneck_values, content_hashes,
+                           image_lists, image_dir, bottleneck_dir, module_name,
+                           bottleneck_cache):
+  """Caches the bottleneck values calculated for a batch of images.
+
+  Args:
+    batch: List of (label_name, category, index) tuples that were calculated.
+    bottleneck_values: Numpy array with one row of bottleneck values per image.
+    content_hashes: List of SHA-1 hex digests of the batch's image files.
+    image_lists: OrderedDict of training images for each label.
+    image_dir: Root folder string of the subfolders containing the training
+    images.
+    bottleneck_dir: Folder string holding cached files of bottleneck values.
+    module_name: The name of the image module being used.
+    bottleneck_cache: Optional MemmapBottleneckCache for the module. The
+    bottlenecks are written to text files under bottleneck_dir without one.
+  """
+  for (label_name, category, index), values, content_hash in zip(
+      batch, bottleneck_values, content_hashes):
+    if bottleneck_cache is not None:
+      bottleneck_cache.add(
+          get_bottleneck_key(image_lists, label_name, index, image_dir,
+                             category), values, content_hash)
+    else:
+      write_bottleneck_file(
+          get_bottleneck_path(image_lists, label_name, index, bottleneck_dir,
+                              category, module_name), values)
 
 
 def get_random_cached_bottlenecks(sess, image_lists, how_many, category,
                                   bottleneck_dir, image_dir, jpeg_data_tensor,
                                   decoded_image_tensor, resized_input_tensor,
-                                  bottleneck_tensor, module_name):
+                                  bottleneck_tensor, module_name,
+                                  bottleneck_cache=None):
   """Retrieves bottleneck values for cached images.
 
   If no distortions are being applied, this function can retrieve the cached
   bottleneck values directly from disk for images. It picks a random set of
-  images from the specified category.
+  images from the specified category. With a MemmapBottleneckCache the values
+  are gathered with one slice of the cache once every sampled image is in it.
 
   Args:
     sess: Current TensorFlow Session.
@@ -500,28 +1270,42 @@ def get_random_cached_bottlenecks(sess, image_lists, how_many, category,
     resized_input_tensor: The input node of the recognition graph.
     bottleneck_tensor: The bottleneck output layer of the CNN graph.
     module_name: The name of the image module being used.
+    bottleneck_cache: Optional MemmapBottleneckCache for the module.
 
   Returns:
     List of bottleneck arrays, their corresponding ground truths, and the
-    relevant filenames.
+    relevant filenames. With a bottleneck_cache the bottlenecks are returned as
+    a single float32 array instead of a list.
   """
-  class_count = len(image_lists.keys())
+  label_names = list(image_lists.keys())
+  class_count = len(label_names)
   bottlenecks = []
   ground_truths = []
   filenames = []
+  keys = []
   if how_many >= 0:
     # Retrieve a random sample of bottlenecks.
     for unused_i in range(how_many):
       label_index = random.randrange(class_count)
-      label_name = list(image_lists.keys())[label_index]
+      label_name = label_names[label_index]
       image_index = random.randrange(MAX_NUM_IMAGES_PER_CLASS + 1)
       image_name = get_image_path(image_lists, label_name, image_index,
                                   image_dir, category)
-      bottleneck = get_or_create_bottleneck(
-          sess, image_lists, label_name, image_index, image_dir, category,
-          bottleneck_dir, jpeg_data_tensor, decoded_image_tensor,
-          resized_input_tensor, bottleneck_tensor, module_name)
-      bottlenecks.append(bottleneck)
+      if bottleneck_cache is not None:
+        keys.append(get_bottleneck_key(image_lists, label_name, image_index,
+                                       image_dir, category))
+        if not bottleneck_cache.is_fresh(keys[-1]):
+          get_or_create_bottleneck(
+              sess, image_lists, label_name, image_index, image_dir, category,
+              bottleneck_dir, jpeg_data_tensor, decoded_image_tensor,
+              resized_input_tensor, bottleneck_tensor, module_name,
+              bottleneck_cache)
+      else:
+        bottleneck = get_or_create_bottleneck(
+            sess, image_lists, label_name, image_index, image_dir, category,
+            bottleneck_dir, jpeg_data_tensor, decoded_image_tensor,
+            resized_input_tensor, bottleneck_tensor, module_name)
+        bottlenecks.append(bottleneck)
       ground_truths.append(label_index)
       filenames.append(image_name)
   else:
@@ -531,26 +1315,263 @@ def get_random_cached_bottlenecks(sess, image_lists, how_many, category,
           image_lists[label_name][category]):
         image_name = get_image_path(image_lists, label_name, image_index,
                                     image_dir, category)
-        bottleneck = get_or_create_bottleneck(
-            sess, image_lists, label_name, image_index, image_dir, category,
-            bottleneck_dir, jpeg_data_tensor, decoded_image_tensor,
-            resized_input_tensor, bottleneck_tensor, module_name)
-        bottlenecks.append(bottleneck)
+        if bottleneck_cache is not None:
+          keys.append(get_bottleneck_key(image_lists, label_name, image_index,
+                                         image_dir, category))
+          if not bottleneck_cache.is_fresh(keys[-1]):
+            get_or_create_bottleneck(
+                sess, image_lists, label_name, image_index, image_dir,
+                category, bottleneck_dir, jpeg_data_tensor,
+                decoded_image_tensor, resized_input_tensor, bottleneck_tensor,
+                module_name, bottleneck_cache)
+        else:
+          bottleneck = get_or_create_bottleneck(
+              sess, image_lists, label_name, image_index, image_dir, category,
+              bottleneck_dir, jpeg_data_tensor, decoded_image_tensor,
+              resized_input_tensor, bottleneck_tensor, module_name)
+          bottlenecks.append(bottleneck)
         ground_truths.append(label_index)
         filenames.append(image_name)
+  if bottleneck_cache is not None:
+    bottlenecks = bottleneck_cache.lookup(keys)
   return bottlenecks, ground_truths, filenames
 
 
+class BottleneckSampler(object):
+  """Draws random batches of bottlenecks with vectorized index arithmetic.
+
+  For each category the sampler keeps flat arrays with the label id of every
+  image and the row holding its bottleneck, ordered by label, plus the offset
+  and image count of each label. A batch is then drawn with a couple of
+  np.random.randint calls and a single fancy index, the same way
+  get_random_cached_bottlenecks samples: a label is picked uniformly, then an
+  image within that label.
+
+  Rows index into a float32 array of bottlenecks, which is either loaded into
+  memory or the np.memmap of a MemmapBottleneckCache.
+  """
+
+  def __init__(self, class_count, get_rows):
+    """Creates a sampler without any categories.
+
+    Args:
+      class_count: Number of labels in the dataset.
+      get_rows: Function returning a float32 array of the bottlenecks stored at
+      an integer array of rows.
+    """
+    self.class_count = class_count
+    self.get_rows = get_rows
+    self.categories = {}
+
+  def add_category(self, category, rows, ground_truths, filenames):
+    """Indexes the images of a category.
+
+    Args:
+      category: Name string of the set - training, testing, or validation.
+      rows: Row holding the bottleneck of every image, ordered by label.
+      ground_truths: Label id of every image.
+      filenames: Path of every image.
+    """
+    ground_truths = np.asarray(ground_truths, dtype=np.int64)
+    label_counts = np.bincount(ground_truths, minlength=self.class_count)
+    label_starts = np.cumsum(label_counts) - label_counts
+    self.categories[category] = (
+        np.asarray(rows, dtype=np.int64), ground_truths,
+        np.asarray(filenames, dtype=object), label_starts, label_counts)
+
+  def sample(self, category, how_many):
+    """Draws a random batch of bottlenecks from a category.
+
+    Args:
+      category: Name string of which set to pull from - training, testing, or
+      validation.
+      how_many: If positive, a random sample of this size will be chosen.
+      If negative, all bottlenecks will be retrieved.
+
+    Returns:
+      A contiguous float32 array of bottlenecks, an int64 array of their ground
+      truths, and an array of the relevant filenames.
+    """
+    (rows, ground_truths, filenames, label_starts,
+     label_counts) = self.categories[category]
+    if how_many >= 0:
+      labels = np.flatnonzero(label_counts)
+      if not labels.size:
+        raise ValueError('Category %s has no images.' % category)
+      labels = labels[np.random.randint(labels.size, size=how_many)]
+      indices = label_starts[labels] + (
+          np.random.randint(MAX_NUM_IMAGES_PER_CLASS + 1, size=how_many) %
+          label_counts[labels])
+      rows = rows[indices]
+      ground_truths = ground_truths[indices]
+      filenames = filenames[indices]
+    return (np.ascontiguousarray(self.get_rows(rows)), ground_truths,
+            filenames)
+
+  def iterate(self, category, chunk_size):
+    """Yields every bottleneck of a category, a chunk at a time.
+
+    Args:
+      category: Name string of which set to pull from - training, testing, or
+      validation.
+      chunk_size: Integer number of images in each chunk.
+
+    Yields:
+      A contiguous float32 array of bottlenecks, an int64 array of their ground
+      truths, and an array of the relevant filenames for up to chunk_size
+      images.
+    """
+    rows, ground_truths, filenames, _, _ = self.categories[category]
+    for start in range(0, len(rows), chunk_size):
+      end = start + chunk_size
+      yield (np.ascontiguousarray(self.get_rows(rows[start:end])),
+             ground_truths[start:end], filenames[start:end])
+
+
+def iterate_cached_bottlenecks(sess, image_lists, category, chunk_size,
+                               bottleneck_dir, image_dir, jpeg_data_tensor,
+                               decoded_image_tensor, resized_input_tensor,
+                               bottleneck_tensor, module_name,
+                               bottleneck_cache=None):
+  """Yields the bottlenecks of every image in a category, a chunk at a time.
+
+  Args:
+    sess: Current TensorFlow Session.
+    image_lists: OrderedDict of training images for each label.
+    category: Name string of which set to pull from - training, testing, or
+    validation.
+    chunk_size: Integer number of images in each chunk.
+    bottleneck_dir: Folder string holding cached files of bottleneck values.
+    image_dir: Root folder string of the subfolders containing the training
+    images.
+    jpeg_data_tensor: The layer to feed jpeg image data into.
+    decoded_image_tensor: The output of decoding and resizing the image.
+    resized_input_tensor: The input node of the recognition graph.
+    bottleneck_tensor: The bottleneck output layer of the CNN graph.
+    module_name: The name of the image module being used.
+    bottleneck_cache: Optional MemmapBottleneckCache for the module.
+
+  Yields:
+    A float32 array of bottlenecks, their ground truths, and the relevant
+    filenames for up to chunk_size images.
+  """
+  bottlenecks = []
+  ground_truths = []
+  filenames = []
+  for label_index, label_name in enumerate(image_lists.keys()):
+    for image_index in range(len(image_lists[label_name][category])):
+      bottlenecks.append(get_or_create_bottleneck(
+          sess, image_lists, label_name, image_index, image_dir, category,
+          bottleneck_dir, jpeg_data_tensor, decoded_image_tensor,
+          resized_input_tensor, bottleneck_tensor, module_name,
+          bottleneck_cache))
+      ground_truths.append(label_index)
+      filenames.append(get_image_path(image_lists, label_name, image_index,
+                                      image_dir, category))
+      if len(ground_truths) == chunk_size:
+        yield np.array(bottlenecks, dtype=np.float32), ground_truths, filenames
+        bottlenecks = []
+        ground_truths = []
+        filenames = []
+  if ground_truths:
+    yield np.array(bottlenecks, dtype=np.float32), ground_truths, filenames
+
+
+def create_bottleneck_sampler(sess, image_lists, bottleneck_dir, image_dir,
+                              jpeg_data_tensor, decoded_image_tensor,
+                              resized_input_tensor, bottleneck_tensor,
+                              module_name, bottleneck_cache=None,
+                              in_memory=False):
+  """Indexes the cached bottlenecks of every image in a BottleneckSampler.
+
+  With a MemmapBottleneckCache the sampler reads rows of the cache directly.
+  With in_memory set, every bottleneck is first copied into one float32
+  array, which is the only option for per-image text bottleneck files.
+
+  Args:
+    sess: Current TensorFlow Session.
+    image_lists: OrderedDict of training images for each label.
+    bottleneck_dir: Folder string holding cached files of bottleneck values.
+    image_dir: Root folder string of the subfolders containing the training
+    images.
+    jpeg_data_tensor: The layer to feed jpeg image data into.
+    decoded_image_tensor: The output of decoding and resizing the image.
+    resized_input_tensor: The input node of the recognition graph.
+    bottleneck_tensor: The bottleneck output layer of the CNN graph.
+    module_name: The name of the image module being used.
+    bottleneck_cache: Optional MemmapBottleneckCache for the module.
+    in_memory: Whether to load all bottlenecks into memory.
+
+  Returns:
+    A BottleneckSampler with the training, testing and validation sets.
+  """
+  categories = []
+  for category in ['training', 'testing', 'validation']:
+    ground_truths = []
+    filenames = []
+    keys = []
+    for label_index, label_name in enumerate(image_lists.keys()):
+      for image_index in range(len(image_lists[label_name][category])):
+        ground_truths.append(label_index)
+        filenames.append(get_image_path(image_lists, label_name, image_index,
+                                        image_dir, category))
+        if bottleneck_cache is not None:
+          keys.append(get_bottleneck_key(image_lists, label_name, image_index,
+                                         image_dir, category))
+          if not bottleneck_cache.is_fresh(keys[-1]):
+            get_or_create_bottleneck(
+                sess, image_lists, label_name, image_index, image_dir,
+                category, bottleneck_dir, jpeg_data_tensor,
+                decoded_image_tensor, resized_input_tensor, bottleneck_tensor,
+                module_name, bottleneck_cache)
+    if bottleneck_cache is not None:
+      rows = np.array([bottleneck_cache.row(key) for key in keys],
+                      dtype=np.int64)
+    else:
+      rows = None
+    categories.append((category, rows, ground_truths, filenames))
+  if not in_memory:
+    sampler = BottleneckSampler(len(image_lists), bottleneck_cache.get_rows)
+    for category, rows, ground_truths, filenames in categories:
+      sampler.add_category(category, rows, ground_truths, filenames)
+    return sampler
+
+  category_bottlenecks = []
+  for category, rows, _, _ in categories:
+    if rows is not None:
+      category_bottlenecks.append(bottleneck_cache.get_rows(rows))
+    else:
+      category_bottlenecks.append(get_random_cached_bottlenecks(
+          sess, image_lists, -1, category, bottleneck_dir, image_dir,
+          jpeg_data_tensor, decoded_image_tensor, resized_input_tensor,
+          bottleneck_tensor, module_name)[0])
+  bottlenecks = np.concatenate(
+      [np.asarray(values, dtype=np.float32).reshape(
+          -1, bottleneck_tensor.get_shape().as_list()[1])
+       for values in category_bottlenecks])
+  tf.logging.info('Loaded bottlenecks into memory (%.1f MB)' %
+                  (bottlenecks.nbytes / (1024.0 ** 2)))
+  sampler = BottleneckSampler(len(image_lists), bottlenecks.__getitem__)
+  offset = 0
+  for category, _, ground_truths, filenames in categories:
+    sampler.add_category(category,
+                         np.arange(offset, offset + len(ground_truths)),
+                         ground_truths, filenames)
+    offset += len(ground_truths)
+  return sampler
+
+
 def get_random_distorted_bottlenecks(
     sess, image_lists, how_many, category, image_dir, input_jpeg_tensor,
-    distorted_image, resized_input_tensor, bottleneck_tensor):
+    distorted_image, resized_input_tensor, bottleneck_tensor,
+    reader_pool=None):
   """Retrieves bottleneck values for training images, after distortions.
 
   If we're training with distortions like crops, scales, or flips, we have to
   recalculate the full model for every image, and so we can't use cached
   bottleneck values. Instead we find random images for the requested category,
-  run them through the distortion graph, and then the full graph to get the
-  bottleneck results for each.
+  run them through the distortion graph as one batch, and then the full graph
+  over that batch to get the bottleneck results for each.
 
   Args:
     sess: Current TensorFlow Session.
@@ -560,39 +1581,62 @@ def get_random_distorted_bottlenecks(
     or validation.
     image_dir: Root folder string of the subfolders containing the training
     images.
-    input_jpeg_tensor: The input layer we feed the image data to.
-    distorted_image: The output node of the distortion graph.
+    input_jpeg_tensor: The input layer we feed a batch of image data to.
+    distorted_image: The batched output node of the distortion graph.
     resized_input_tensor: The input node of the recognition graph.
     bottleneck_tensor: The bottleneck output layer of the CNN graph.
+    reader_pool: Optional concurrent.futures.Executor to read image files on.
 
   Returns:
-    List of bottleneck arrays and their corresponding ground truths.
+    Array of bottleneck values and a list of their corresponding ground truths.
   """
   class_count = len(image_lists.keys())
-  bottlenecks = []
   ground_truths = []
+  image_paths = []
   for unused_i in range(how_many):
     label_index = random.randrange(class_count)
     label_name = list(image_lists.keys())[label_index]
     image_index = random.randrange(MAX_NUM_IMAGES_PER_CLASS + 1)
-    image_path = get_image_path(image_lists, label_name, image_index, image_dir,
-                                category)
-    if not tf.gfile.Exists(image_path):
-      tf.logging.fatal('File does not exist %s', image_path)
-    jpeg_data = tf.gfile.FastGFile(image_path, 'rb').read()
-    # Note that we materialize the distorted_image_data as a numpy array before
-    # sending running inference on the image. This involves 2 memory copies and
-    # might be optimized in other implementations.
-    distorted_image_data = sess.run(distorted_image,
-                                    {input_jpeg_tensor: jpeg_data})
-    bottleneck_values = sess.run(bottleneck_tensor,
-                                 {resized_input_tensor: distorted_image_data})
-    bottleneck_values = np.squeeze(bottleneck_values)
-    bottlenecks.append(bottleneck_values)
+    image_paths.append(get_image_path(image_lists, label_name, image_index,
+                                      image_dir, category))
     ground_truths.append(label_index)
+  # Read all the files for the batch up front, in parallel if possible.
+  image_data_list = read_image_files(image_paths, reader_pool)
+  # Note that we materialize the distorted_image_data as a numpy array before
+  # sending running inference on the batch. This involves 2 memory copies and
+  # might be optimized in other implementations.
+  distorted_image_data = sess.run(distorted_image,
+                                  {input_jpeg_tensor: image_data_list})
+  bottlenecks = sess.run(bottleneck_tensor,
+                         {resized_input_tensor: distorted_image_data})
   return bottlenecks, ground_truths
 
 
+def generate_training_batches(get_train_batch, get_validation_batch,
+                              how_many_training_steps, eval_step_interval):
+  """Yields the input batches for every step of the training loop.
+
+  Args:
+    get_train_batch: Function returning the bottlenecks and ground truths of a
+    training batch.
+    get_validation_batch: Function returning the bottlenecks and ground truths
+    of a validation batch.
+    how_many_training_steps: Integer number of training steps.
+    eval_step_interval: How often to evaluate the training results.
+
+  Yields:
+    A training batch, and a validation batch on the steps that are evaluated or
+    None on the others.
+  """
+  for i in range(how_many_training_steps):
+    train_batch = get_train_batch()
+    is_last_step = (i + 1 == how_many_training_steps)
+    if (i % eval_step_interval) == 0 or is_last_step:
+      yield train_batch, get_validation_batch()
+    else:
+      yield train_batch, None
+
+
 def should_distort_images(flip_left_right, random_crop, random_scale,
                           random_brightness):
   """Whether any distortions are enabled, from the input flags.
@@ -619,7 +1663,9 @@ def add_input_distortions(flip_left_right, random_crop, random_scale,
   through simple distortions like crops, scales, and flips. These reflect the
   kind of variations we expect in the real world, and so can help train the
   model to cope with natural data more effectively. Here we take the supplied
-  parameters and construct a network of operations to apply them to an image.
+  parameters and construct a network of operations to apply them to a batch of
+  images. Each image in the batch gets its own random crop, scale, flip and
+  brightness values.
 
   Cropping
   ~~~~~~~~
@@ -663,43 +1709,50 @@ def add_input_distortions(flip_left_right, random_crop, random_scale,
     module_spec: The hub.ModuleSpec for the image module being used.
 
   Returns:
-    The jpeg input layer and the distorted result tensor.
+    The jpeg input layer, which takes a list of JPEG strings, and the distorted
+    result tensor with one image per input string.
   """
   input_height, input_width = hub.get_expected_image_size(module_spec)
   input_depth = hub.get_num_image_channels(module_spec)
-  jpeg_data = tf.placeholder(tf.string, name='DistortJPGInput')
-  decoded_image = tf.image.decode_jpeg(jpeg_data, channels=input_depth)
-  # Convert from full range of uint8 to range [0,1] of float32.
-  decoded_image_as_float = tf.image.convert_image_dtype(decoded_image,
-                                                        tf.float32)
-  decoded_image_4d = tf.expand_dims(decoded_image_as_float, 0)
+  jpeg_data = tf.placeholder(tf.string, [None], name='DistortJPGInput')
   margin_scale = 1.0 + (random_crop / 100.0)
   resize_scale = 1.0 + (random_scale / 100.0)
-  margin_scale_value = tf.constant(margin_scale)
-  resize_scale_value = tf.random_uniform(shape=[],
-                                         minval=1.0,
-                                         maxval=resize_scale)
-  scale_value = tf.multiply(margin_scale_value, resize_scale_value)
-  precrop_width = tf.multiply(scale_value, input_width)
-  precrop_height = tf.multiply(scale_value, input_height)
-  precrop_shape = tf.stack([precrop_height, precrop_width])
-  precrop_shape_as_int = tf.cast(precrop_shape, dtype=tf.int32)
-  precropped_image = tf.image.resize_bilinear(decoded_image_4d,
-                                              precrop_shape_as_int)
-  precropped_image_3d = tf.squeeze(precropped_image, axis=[0])
-  cropped_image = tf.random_crop(precropped_image_3d,
-                                 [input_height, input_width, input_depth])
-  if flip_left_right:
-    flipped_image = tf.image.random_flip_left_right(cropped_image)
-  else:
-    flipped_image = cropped_image
   brightness_min = 1.0 - (random_brightness / 100.0)
   brightness_max = 1.0 + (random_brightness / 100.0)
-  brightness_value = tf.random_uniform(shape=[],
-                                       minval=brightness_min,
-                                       maxval=brightness_max)
-  brightened_image = tf.multiply(flipped_image, brightness_value)
-  distort_result = tf.expand_dims(brightened_image, 0, name='DistortResult')
+
+  def distort_image(single_jpeg_data):
+    decoded_image = tf.image.decode_jpeg(single_jpeg_data,
+                                         channels=input_depth)
+    # Convert from full range of uint8 to range [0,1] of float32.
+    decoded_image_as_float = tf.image.convert_image_dtype(decoded_image,
+                                                          tf.float32)
+    decoded_image_4d = tf.expand_dims(decoded_image_as_float, 0)
+    margin_scale_value = tf.constant(margin_scale)
+    resize_scale_value = tf.random_uniform(shape=[],
+                                           minval=1.0,
+                                           maxval=resize_scale)
+    scale_value = tf.multiply(margin_scale_value, resize_scale_value)
+    precrop_width = tf.multiply(scale_value, input_width)
+    precrop_height = tf.multiply(scale_value, input_height)
+    precrop_shape = tf.stack([precrop_height, precrop_width])
+    precrop_shape_as_int = tf.cast(precrop_shape, dtype=tf.int32)
+    precropped_image = tf.image.resize_bilinear(decoded_image_4d,
+                                                precrop_shape_as_int)
+    precropped_image_3d = tf.squeeze(precropped_image, axis=[0])
+    cropped_image = tf.random_crop(precropped_image_3d,
+                                   [input_height, input_width, input_depth])
+    if flip_left_right:
+      flipped_image = tf.image.random_flip_left_right(cropped_image)
+    else:
+      flipped_image = cropped_image
+    brightness_value = tf.random_uniform(shape=[],
+                                         minval=brightness_min,
+                                         maxval=brightness_max)
+    return tf.multiply(flipped_image, brightness_value)
+
+  distorted_images = tf.map_fn(distort_image, jpeg_data, dtype=tf.float32,
+                               back_prop=False)
+  distort_result = tf.identity(distorted_images, name='DistortResult')
   return jpeg_data, distort_result
 
 
@@ -824,7 +1877,8 @@ def add_evaluation_step(result_tensor, ground_truth_tensor):
 
 def run_final_eval(train_session, module_spec, class_count, image_lists,
                    jpeg_data_tensor, decoded_image_tensor,
-                   resized_image_tensor, bottleneck_tensor):
+                   resized_image_tensor, bottleneck_tensor,
+                   bottleneck_cache=None, bottleneck_sampler=None):
   """Runs a final evaluation on an eval graph using the test data set.
 
   Args:
@@ -836,32 +1890,79 @@ def run_final_eval(train_session, module_spec, class_count, image_lists,
     decoded_image_tensor: The output of decoding and resizing the image.
     resized_image_tensor: The input node of the recognition graph.
     bottleneck_tensor: The bottleneck output layer of the CNN graph.
+    bottleneck_cache: Optional MemmapBottleneckCache for the module.
+    bottleneck_sampler: Optional BottleneckSampler to draw the test set from.
+
+  Returns:
+    The number of test images evaluated.
   """
-  test_bottlenecks, test_ground_truth, test_filenames = (
-      get_random_cached_bottlenecks(train_session, image_lists,
-                                    FLAGS.test_batch_size,
-                                    'testing', FLAGS.bottleneck_dir,
-                                    FLAGS.image_dir, jpeg_data_tensor,
-                                    decoded_image_tensor, resized_image_tensor,
-                                    bottleneck_tensor, FLAGS.tfhub_module))
-
-  (eval_session, _, bottleneck_input, ground_truth_input, evaluation_step,
+  chunk_size = max(FLAGS.eval_chunk_size, 1)
+  if FLAGS.test_batch_size >= 0:
+    if bottleneck_sampler is not None:
+      test_bottlenecks, test_ground_truth, test_filenames = (
+          bottleneck_sampler.sample('testing', FLAGS.test_batch_size))
+    else:
+      test_bottlenecks, test_ground_truth, test_filenames = (
+          get_random_cached_bottlenecks(train_session, image_lists,
+                                        FLAGS.test_batch_size,
+                                        'testing', FLAGS.bottleneck_dir,
+                                        FLAGS.image_dir, jpeg_data_tensor,
+                                        decoded_image_tensor,
+                                        resized_image_tensor,
+                                        bottleneck_tensor, FLAGS.tfhub_module,
+                                        bottleneck_cache))
+    test_chunks = ((test_bottlenecks[start:start + chunk_size],
+                    test_ground_truth[start:start + chunk_size],
+                    test_filenames[start:start + chunk_size])
+                   for start in range(0, len(test_ground_truth), chunk_size))
+  elif bottleneck_sampler is not None:
+    test_chunks = bottleneck_sampler.iterate('testing', chunk_size)
+  else:
+    test_chunks = iterate_cached_bottlenecks(
+        train_session, image_lists, 'testing', chunk_size,
+        FLAGS.bottleneck_dir, FLAGS.image_dir, jpeg_data_tensor,
+        decoded_image_tensor, resized_image_tensor, bottleneck_tensor,
+        FLAGS.tfhub_module, bottleneck_cache)
+
+  # The test set is evaluated a chunk at a time, so memory use doesn't grow
+  # with its size.
+  (eval_session, _, bottleneck_input, _, _,
    prediction) = build_eval_session(module_spec, class_count)
-  test_accuracy, predictions = eval_session.run(
-      [evaluation_step, prediction],
-      feed_dict={
-          bottleneck_input: test_bottlenecks,
-          ground_truth_input: test_ground_truth
-      })
+  label_names = list(image_lists.keys())
+  test_count = 0
+  correct_count = 0
+  misclassified = []
+  for chunk_bottlenecks, chunk_ground_truth, chunk_filenames in test_chunks:
+    predictions = eval_session.run(
+        prediction, feed_dict={bottleneck_input: chunk_bottlenecks})
+    is_correct = predictions == np.asarray(chunk_ground_truth)
+    test_count += len(predictions)
+    correct_count += int(np.sum(is_correct))
+    if FLAGS.print_misclassified_test_images:
+      for i in np.flatnonzero(~is_correct):
+        misclassified.append((chunk_filenames[i], label_names[predictions[i]]))
+  eval_session.close()
+  test_accuracy = float(correct_count) / test_count if test_count else 0.0
   tf.logging.info('Final test accuracy = %.1f%% (N=%d)' %
-                  (test_accuracy * 100, len(test_bottlenecks)))
+                  (test_accuracy * 100, test_count))
 
   if FLAGS.print_misclassified_test_images:
     tf.logging.info('=== MISCLASSIFIED TEST IMAGES ===')
-    for i, test_filename in enumerate(test_filenames):
-      if predictions[i] != test_ground_truth[i]:
-        tf.logging.info('%70s  %s' % (test_filename,
-                                      list(image_lists.keys())[predictions[i]]))
+    for test_filename, predicted_label in misclassified:
+      tf.logging.info('%70s  %s' % (test_filename, predicted_label))
+  return test_count
+
+
+def create_session_config():
+  """Creates the config of the sessions that train and evaluate the model.
+
+  Returns:
+    A tf.ConfigProto with the thread counts from --intra_op_parallelism_threads
+    and --inter_op_parallelism_threads.
+  """
+  return tf.ConfigProto(
+      intra_op_parallelism_threads=FLAGS.intra_op_parallelism_threads,
+      inter_op_parallelism_threads=FLAGS.inter_op_parallelism_threads)
 
 
 def build_eval_session(module_spec, class_count):
@@ -879,7 +1980,7 @@ def build_eval_session(module_spec, class_count):
   eval_graph, bottleneck_tensor, resized_input_tensor, wants_quantization = (
       create_module_graph(module_spec))
 
-  eval_sess = tf.Session(graph=eval_graph)
+  eval_sess = tf.Session(graph=eval_graph, config=create_session_config())
   with eval_graph.as_default():
     # Add the new layer for exporting.
     (_, _, bottleneck_input,
@@ -908,6 +2009,7 @@ def save_graph_to_file(graph_file_name, module_spec, class_count):
 
   with tf.gfile.FastGFile(graph_file_name, 'wb') as f:
     f.write(output_graph_def.SerializeToString())
+  sess.close()
 
 
 def prepare_file_system():
@@ -945,6 +2047,217 @@ def add_jpeg_decoding(module_spec):
   return jpeg_data, resized_image
 
 
+def add_batch_jpeg_decoding(module_spec):
+  """Adds operations that decode and resize a batch of JPEGs to the graph.
+
+  Args:
+    module_spec: The hub.ModuleSpec for the image module being used.
+
+  Returns:
+    Tensors for the node to feed a list of JPEG strings into, and the stacked
+      output of the preprocessing steps.
+  """
+  input_height, input_width = hub.get_expected_image_size(module_spec)
+  input_depth = hub.get_num_image_channels(module_spec)
+  jpeg_data = tf.placeholder(tf.string, [None], name='DecodeJPGBatchInput')
+
+  def decode_and_resize(single_jpeg_data):
+    decoded_image = tf.image.decode_jpeg(single_jpeg_data,
+                                         channels=input_depth)
+    # Convert from full range of uint8 to range [0,1] of float32.
+    decoded_image_as_float = tf.image.convert_image_dtype(decoded_image,
+                                                          tf.float32)
+    decoded_image_4d = tf.expand_dims(decoded_image_as_float, 0)
+    resized_image = tf.image.resize_bilinear(decoded_image_4d,
+                                             [input_height, input_width])
+    return tf.squeeze(resized_image, axis=[0])
+
+  resized_images = tf.map_fn(decode_and_resize, jpeg_data, dtype=tf.float32,
+                             back_prop=False)
+  return jpeg_data, resized_images
+
+
+class PhaseTimer(object):
+  """Times the phases of a training run with time.perf_counter_ns.
+
+  Phases run one after another: starting a phase ends the previous one.
+  Training and validation step latencies are kept separately, so that they can
+  be summarized as histograms, and phases that process images can record how
+  many so that a throughput is reported for them.
+  """
+
+  def __init__(self):
+    self.start_ns = time.perf_counter_ns()
+    self.phases = collections.OrderedDict()
+    self.image_counts = {}
+    self.step_latencies = collections.OrderedDict()
+    self._phase = None
+    self._phase_start_ns = None
+
+  def start_phase(self, name):
+    """Ends the current phase, if any, and starts timing the named one."""
+    self.stop()
+    self._phase = name
+    self._phase_start_ns = time.perf_counter_ns()
+
+  def stop(self):
+    """Ends the current phase."""
+    if self._phase is not None:
+      self.phases[self._phase] = (self.phases.get(self._phase, 0) +
+                                  time.perf_counter_ns() - self._phase_start_ns)
+      self._phase = None
+
+  def add_images(self, phase, image_count):
+    """Records that a phase processed image_count images."""
+    self.image_counts[phase] = self.image_counts.get(phase, 0) + image_count
+
+  def add_step(self, kind, latency_ns, image_count):
+    """Records the latency of a training or validation step.
+
+    Args:
+      kind: Name string of the kind of step, e.g. 'train' or 'validation'.
+      latency_ns: Integer nanoseconds the step took.
+      image_count: Number of images in the step's batch.
+    """
+    self.step_latencies.setdefault(kind, []).append(latency_ns)
+    self.add_images(kind, image_count)
+
+  def record(self):
+    """Returns a JSON-serializable dict with every timing recorded so far."""
+    total_ns = time.perf_counter_ns() - self.start_ns
+    step_totals = dict((kind, sum(latencies))
+                       for kind, latencies in self.step_latencies.items())
+    images_per_sec = {}
+    for name, image_count in self.image_counts.items():
+      elapsed_ns = step_totals.get(name, self.phases.get(name))
+      if elapsed_ns:
+        images_per_sec[name] = image_count * 1e9 / elapsed_ns
+    return {
+        'total_ns': total_ns,
+        'phases_ns': self.phases,
+        'steps': collections.OrderedDict(
+            (kind, summarize_latencies(latencies))
+            for kind, latencies in self.step_latencies.items()),
+        'images_per_sec': images_per_sec,
+    }
+
+
+def summarize_latencies(latencies_ns):
+  """Summarizes step latencies with percentiles and a histogram.
+
+  Args:
+    latencies_ns: List of integer latencies in nanoseconds.
+
+  Returns:
+    A dict with the count, total, mean, min, median, 90th and 99th percentile
+    and max latencies, and a histogram of [upper bound in microseconds, count]
+    pairs with power of two bounds.
+  """
+  latencies = np.array(latencies_ns, dtype=np.int64)
+  buckets = np.ceil(np.log2(np.maximum(latencies / 1000.0, 1))).astype(np.int64)
+  p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+  return {
+      'count': int(latencies.size),
+      'total_ns': int(latencies.sum()),
+      'mean_ns': int(latencies.mean()),
+      'min_ns': int(latencies.min()),
+      'p50_ns': int(p50),
+      'p90_ns': int(p90),
+      'p99_ns': int(p99),
+      'max_ns': int(latencies.max()),
+      'histogram_us': [[2 ** int(bucket), int(count)]
+                       for bucket, count in enumerate(np.bincount(buckets))
+                       if count],
+  }
+
+
+def load_module_spec(module_name):
+  """Returns the hub.ModuleSpec of a module, loading it only once per process.
+
+  Args:
+    module_name: The name of the image module being used.
+
+  Returns:
+    The hub.ModuleSpec for the image module.
+  """
+  if module_name not in MODULE_SPECS:
+    MODULE_SPECS[module_name] = hub.load_module_spec(module_name)
+  return MODULE_SPECS[module_name]
+
+
+def get_training_graph(module_spec, class_count, do_distort_images):
+  """Builds the training graph, or returns the one an earlier run built.
+
+  Everything the training run needs is added to the graph up front, so that a
+  process running several trainings, like retrain_worker.py, can reuse it.
+  The graph is cached on the flags that change its structure or constants, and
+  the least recently used graph is dropped once more than MAX_TRAINING_GRAPHS
+  are cached.
+
+  Args:
+    module_spec: The hub.ModuleSpec for the image module being used.
+    class_count: Integer of how many categories of things we're trying to
+    recognize.
+    do_distort_images: Whether to add the image distortion operations.
+
+  Returns:
+    A TrainingGraph tuple with the graph and its tensors and operations.
+  """
+  graph_key = (FLAGS.tfhub_module, class_count, FLAGS.final_tensor_name,
+               FLAGS.learning_rate, do_distort_images, FLAGS.flip_left_right,
+               FLAGS.random_crop, FLAGS.random_scale, FLAGS.random_brightness)
+  if graph_key in TRAINING_GRAPHS:
+    TRAINING_GRAPHS.move_to_end(graph_key)
+    return TRAINING_GRAPHS[graph_key]
+
+  graph, bottleneck_tensor, resized_image_tensor, wants_quantization = (
+      create_module_graph(module_spec))
+
+  with graph.as_default():
+    # Add the new layer that we'll be training.
+    (train_step, cross_entropy, bottleneck_input,
+     ground_truth_input, final_tensor) = add_final_retrain_ops(
+         class_count, FLAGS.final_tensor_name, bottleneck_tensor,
+         wants_quantization, is_training=True)
+
+    # Set up the image decoding sub-graphs.
+    jpeg_data_tensor, decoded_image_tensor = add_jpeg_decoding(module_spec)
+    (batch_jpeg_data_tensor,
+     batch_decoded_image_tensor) = add_batch_jpeg_decoding(module_spec)
+
+    distorted_jpeg_data_tensor = None
+    distorted_image_tensor = None
+    if do_distort_images:
+      # We will be applying distortions, so set up the operations we'll need.
+      (distorted_jpeg_data_tensor,
+       distorted_image_tensor) = add_input_distortions(
+           FLAGS.flip_left_right, FLAGS.random_crop, FLAGS.random_scale,
+           FLAGS.random_brightness, module_spec)
+
+    # Create the operations we need to evaluate the accuracy of our new layer.
+    evaluation_step, _ = add_evaluation_step(final_tensor, ground_truth_input)
+
+    # Merge all the summaries.
+    merged = tf.summary.merge_all()
+
+    init = tf.global_variables_initializer()
+
+    # Create a train saver that is used to restore values into an eval graph
+    # when exporting models.
+    train_saver = tf.train.Saver()
+
+  TRAINING_GRAPHS[graph_key] = TrainingGraph(
+      graph, bottleneck_tensor, resized_image_tensor, wants_quantization,
+      train_step, cross_entropy, bottleneck_input, ground_truth_input,
+      final_tensor, jpeg_data_tensor, decoded_image_tensor,
+      batch_jpeg_data_tensor, batch_decoded_image_tensor,
+      distorted_jpeg_data_tensor, distorted_image_tensor, evaluation_step,
+      merged, init, train_saver)
+  while len(TRAINING_GRAPHS) > MAX_TRAINING_GRAPHS:
+    TRAINING_GRAPHS.popitem(last=False)
+  return TRAINING_GRAPHS[graph_key]
+
+
 def export_model(module_spec, class_count, saved_model_dir):
   """Exports model for serving.
 
@@ -963,23 +2276,28 @@ def export_model(module_spec, class_count, saved_model_dir):
         outputs={'prediction': graph.get_tensor_by_name('final_result:0')},
         legacy_init_op=tf.group(tf.tables_initializer(), name='legacy_init_op')
     )
+  sess.close()
 
 
 def main(_):
   # Needed to make sure the logging output is visible.
   # See https://github.com/tensorflow/tensorflow/issues/3047
   tf.logging.set_verbosity(tf.logging.INFO)
+  timer = PhaseTimer()
 
   if not FLAGS.image_dir:
     tf.logging.error('Must set flag --image_dir.')
     return -1
 
   # Prepare necessary directories that can be used during training
+  timer.start_phase('prepare_file_system')
   prepare_file_system()
 
   # Look at the folder structure, and create lists of all the images.
+  timer.start_phase('image_lists')
   image_lists = create_image_lists(FLAGS.image_dir, FLAGS.testing_percentage,
-                                   FLAGS.validation_percentage)
+                                   FLAGS.validation_percentage,
+                                   FLAGS.image_manifest_dir)
   class_count = len(image_lists.keys())
   if class_count == 0:
     tf.logging.error('No valid folders of images found at ' + FLAGS.image_dir)
@@ -995,84 +2313,147 @@ def main(_):
       FLAGS.flip_left_right, FLAGS.random_crop, FLAGS.random_scale,
       FLAGS.random_brightness)
 
-  # Set up the pre-trained graph.
-  module_spec = hub.load_module_spec(FLAGS.tfhub_module)
-  graph, bottleneck_tensor, resized_image_tensor, wants_quantization = (
-      create_module_graph(module_spec))
-
-  # Add the new layer that we'll be training.
-  with graph.as_default():
-    (train_step, cross_entropy, bottleneck_input,
-     ground_truth_input, final_tensor) = add_final_retrain_ops(
-         class_count, FLAGS.final_tensor_name, bottleneck_tensor,
-         wants_quantization, is_training=True)
+  # Set up the pre-trained graph, with the new layer that we'll be training.
+  # Both are kept loaded for the next run in the same process.
+  timer.start_phase('module_load')
+  module_spec = load_module_spec(FLAGS.tfhub_module)
+  (graph, bottleneck_tensor, resized_image_tensor, wants_quantization,
+   train_step, cross_entropy, bottleneck_input, ground_truth_input,
+   final_tensor, jpeg_data_tensor, decoded_image_tensor,
+   batch_jpeg_data_tensor, batch_decoded_image_tensor,
+   distorted_jpeg_data_tensor, distorted_image_tensor, evaluation_step, merged,
+   init, train_saver) = get_training_graph(module_spec, class_count,
+                                           do_distort_images)
+
+  # What the run opens is released when it ends, even if it fails, since the
+  # warm worker (retrain_worker.py) keeps running after a failed run.
+  cleanup = contextlib.ExitStack()
+
+  # Open the memory-mapped bottleneck cache, unless the per-image text files
+  # were asked for.
+  bottleneck_cache = None
+  if FLAGS.bottleneck_format == 'memmap':
+    input_height, input_width = hub.get_expected_image_size(module_spec)
+    bottleneck_cache = MemmapBottleneckCache(
+        FLAGS.bottleneck_dir, FLAGS.tfhub_module,
+        {'height': input_height, 'width': input_width,
+         'depth': hub.get_num_image_channels(module_spec)})
+    cleanup.callback(bottleneck_cache.close)
+
+  # Image files are read on a pool of threads so that file I/O overlaps with
+  # decoding and the module's forward pass.
+  reader_pool = concurrent.futures.ThreadPoolExecutor(
+      max_workers=max(FLAGS.num_image_readers, 1))
+  cleanup.callback(reader_pool.shutdown)
+
+  with cleanup, tf.Session(graph=graph,
+                           config=create_session_config()) as sess:
+    # A cold-cache run recalculates every bottleneck for the module.
+    if FLAGS.bottleneck_cache_mode == 'cold':
+      if bottleneck_cache is not None:
+        bottleneck_cache.clear()
+      else:
+        clear_bottleneck_files(FLAGS.bottleneck_dir, FLAGS.tfhub_module)
 
-  with tf.Session(graph=graph) as sess:
     # Initialize all weights: for the module to their pretrained values,
     # and for the newly added retraining layer to random initial values.
-    init = tf.global_variables_initializer()
+    timer.start_phase('variable_init')
     sess.run(init)
 
-    # Set up the image decoding sub-graph.
-    jpeg_data_tensor, decoded_image_tensor = add_jpeg_decoding(module_spec)
-
-    if do_distort_images:
-      # We will be applying distortions, so set up the operations we'll need.
-      (distorted_jpeg_data_tensor,
-       distorted_image_tensor) = add_input_distortions(
-           FLAGS.flip_left_right, FLAGS.random_crop, FLAGS.random_scale,
-           FLAGS.random_brightness, module_spec)
-    else:
+    timer.start_phase('bottleneck_cache')
+    if not do_distort_images:
       # We'll make sure we've calculated the 'bottleneck' image summaries and
       # cached them on disk.
-      cache_bottlenecks(sess, image_lists, FLAGS.image_dir,
-                        FLAGS.bottleneck_dir, jpeg_data_tensor,
-                        decoded_image_tensor, resized_image_tensor,
-                        bottleneck_tensor, FLAGS.tfhub_module)
-
-    # Create the operations we need to evaluate the accuracy of our new layer.
-    evaluation_step, _ = add_evaluation_step(final_tensor, ground_truth_input)
-
-    # Merge all the summaries and write them out to the summaries_dir
-    merged = tf.summary.merge_all()
+      timer.add_images('bottleneck_cache', cache_bottlenecks(
+          sess, image_lists, FLAGS.image_dir, FLAGS.bottleneck_dir,
+          jpeg_data_tensor, decoded_image_tensor, resized_image_tensor,
+          bottleneck_tensor, FLAGS.tfhub_module, bottleneck_cache,
+          FLAGS.bottleneck_batch_size, batch_jpeg_data_tensor,
+          batch_decoded_image_tensor, reader_pool,
+          FLAGS.image_prefetch_depth))
+
+    # Batches are drawn with vectorized indexing from the memory-mapped cache,
+    # or from memory if every bottleneck fits there.
+    bottleneck_sampler = None
+    if not do_distort_images:
+      image_count = sum(
+          len(label_lists[category]) for label_lists in image_lists.values()
+          for category in ['training', 'testing', 'validation'])
+      bottleneck_size = bottleneck_tensor.get_shape().as_list()[1]
+      in_memory = (image_count * bottleneck_size * 4 <=
+                   FLAGS.bottleneck_in_memory_max_mb * (1024 ** 2))
+      if in_memory or bottleneck_cache is not None:
+        bottleneck_sampler = create_bottleneck_sampler(
+            sess, image_lists, FLAGS.bottleneck_dir, FLAGS.image_dir,
+            jpeg_data_tensor, decoded_image_tensor, resized_image_tensor,
+            bottleneck_tensor, FLAGS.tfhub_module, bottleneck_cache,
+            in_memory)
+
+    # Write the summaries out to the summaries_dir
     train_writer = tf.summary.FileWriter(FLAGS.summaries_dir + '/train',
                                          sess.graph)
 
     validation_writer = tf.summary.FileWriter(
         FLAGS.summaries_dir + '/validation')
 
-    # Create a train saver that is used to restore values into an eval graph
-    # when exporting models.
-    train_saver = tf.train.Saver()
-
-    # Run the training for as many cycles as requested on the command line.
-    for i in range(FLAGS.how_many_training_steps):
+    def get_train_batch():
+      """Returns the bottlenecks and ground truths for one training step."""
       # Get a batch of input bottleneck values, either calculated fresh every
       # time with distortions applied, or from the cache stored on disk.
       if do_distort_images:
-        (train_bottlenecks,
-         train_ground_truth) = get_random_distorted_bottlenecks(
-             sess, image_lists, FLAGS.train_batch_size, 'training',
-             FLAGS.image_dir, distorted_jpeg_data_tensor,
-             distorted_image_tensor, resized_image_tensor, bottleneck_tensor)
-      else:
-        (train_bottlenecks,
-         train_ground_truth, _) = get_random_cached_bottlenecks(
-             sess, image_lists, FLAGS.train_batch_size, 'training',
-             FLAGS.bottleneck_dir, FLAGS.image_dir, jpeg_data_tensor,
-             decoded_image_tensor, resized_image_tensor, bottleneck_tensor,
-             FLAGS.tfhub_module)
+        return get_random_distorted_bottlenecks(
+            sess, image_lists, FLAGS.train_batch_size, 'training',
+            FLAGS.image_dir, distorted_jpeg_data_tensor,
+            distorted_image_tensor, resized_image_tensor, bottleneck_tensor,
+            reader_pool)
+      if bottleneck_sampler is not None:
+        return bottleneck_sampler.sample('training',
+                                         FLAGS.train_batch_size)[:2]
+      return get_random_cached_bottlenecks(
+          sess, image_lists, FLAGS.train_batch_size, 'training',
+          FLAGS.bottleneck_dir, FLAGS.image_dir, jpeg_data_tensor,
+          decoded_image_tensor, resized_image_tensor, bottleneck_tensor,
+          FLAGS.tfhub_module, bottleneck_cache)[:2]
+
+    def get_validation_batch():
+      """Returns the bottlenecks and ground truths for one validation step."""
+      if bottleneck_sampler is not None:
+        return bottleneck_sampler.sample('validation',
+                                         FLAGS.validation_batch_size)[:2]
+      return get_random_cached_bottlenecks(
+          sess, image_lists, FLAGS.validation_batch_size, 'validation',
+          FLAGS.bottleneck_dir, FLAGS.image_dir, jpeg_data_tensor,
+          decoded_image_tensor, resized_image_tensor, bottleneck_tensor,
+          FLAGS.tfhub_module, bottleneck_cache)[:2]
+
+    # The batches for the next steps are prepared on a background thread while
+    # the current step runs.
+    training_batches = generate_training_batches(
+        get_train_batch, get_validation_batch, FLAGS.how_many_training_steps,
+        FLAGS.eval_step_interval)
+    if FLAGS.prefetch_batches > 0:
+      training_batches = BackgroundGenerator(training_batches,
+                                             FLAGS.prefetch_batches)
+      cleanup.callback(training_batches.close)
+
+    # Run the training for as many cycles as requested on the command line.
+    # A training step's latency includes waiting for its batch.
+    timer.start_phase('training')
+    step_start_ns = time.perf_counter_ns()
+    for i, (train_batch, validation_batch) in enumerate(training_batches):
+      train_bottlenecks, train_ground_truth = train_batch
       # Feed the bottlenecks and ground truth into the graph, and run a training
       # step. Capture training summaries for TensorBoard with the `merged` op.
       train_summary, _ = sess.run(
           [merged, train_step],
           feed_dict={bottleneck_input: train_bottlenecks,
                      ground_truth_input: train_ground_truth})
+      timer.add_step('train', time.perf_counter_ns() - step_start_ns,
+                     len(train_ground_truth))
       train_writer.add_summary(train_summary, i)
 
       # Every so often, print out how well the graph is training.
-      is_last_step = (i + 1 == FLAGS.how_many_training_steps)
-      if (i % FLAGS.eval_step_interval) == 0 or is_last_step:
+      if validation_batch is not None:
         train_accuracy, cross_entropy_value = sess.run(
             [evaluation_step, cross_entropy],
             feed_dict={bottleneck_input: train_bottlenecks,
@@ -1084,18 +2465,17 @@ def main(_):
         # TODO: Make this use an eval graph, to avoid quantization
         # moving averages being updated by the validation set, though in
         # practice this makes a negligable difference.
-        validation_bottlenecks, validation_ground_truth, _ = (
-            get_random_cached_bottlenecks(
-                sess, image_lists, FLAGS.validation_batch_size, 'validation',
-                FLAGS.bottleneck_dir, FLAGS.image_dir, jpeg_data_tensor,
-                decoded_image_tensor, resized_image_tensor, bottleneck_tensor,
-                FLAGS.tfhub_module))
+        validation_bottlenecks, validation_ground_truth = validation_batch
         # Run a validation step and capture training summaries for TensorBoard
         # with the `merged` op.
+        validation_start_ns = time.perf_counter_ns()
         validation_summary, validation_accuracy = sess.run(
             [merged, evaluation_step],
             feed_dict={bottleneck_input: validation_bottlenecks,
                        ground_truth_input: validation_ground_truth})
+        timer.add_step('validation',
+                       time.perf_counter_ns() - validation_start_ns,
+                       len(validation_ground_truth))
         validation_writer.add_summary(validation_summary, i)
         tf.logging.info('%s: Step %d: Validation accuracy = %.1f%% (N=%d)' %
                         (datetime.now(), i, validation_accuracy * 100,
@@ -1115,18 +2495,36 @@ def main(_):
                         intermediate_file_name)
         save_graph_to_file(intermediate_file_name, module_spec,
                            class_count)
+      step_start_ns = time.perf_counter_ns()
+
+    if FLAGS.prefetch_batches > 0:
+      training_batches.close()
+    train_writer.close()
+    validation_writer.close()
 
     # After training is complete, force one last save of the train checkpoint.
     train_saver.save(sess, CHECKPOINT_NAME)
 
     # We've completed all our training, so run a final test evaluation on
     # some new images we haven't used before.
-    run_final_eval(sess, module_spec, class_count, image_lists,
-                   jpeg_data_tensor, decoded_image_tensor, resized_image_tensor,
-                   bottleneck_tensor)
+    timer.start_phase('final_eval')
+    timer.add_images('final_eval', run_final_eval(
+        sess, module_spec, class_count, image_lists, jpeg_data_tensor,
+        decoded_image_tensor, resized_image_tensor, bottleneck_tensor,
+        bottleneck_cache, bottleneck_sampler))
+    timer.start_phase('bottleneck_cache_close')
+    if bottleneck_cache is not None:
+      bottleneck_cache.close()
+      if FLAGS.bottleneck_cache_max_gb > 0:
+        evict_bottleneck_caches(
+            FLAGS.bottleneck_dir,
+            int(FLAGS.bottleneck_cache_max_gb * (1024 ** 3)),
+            bottleneck_cache.cache_dir)
+    reader_pool.shutdown()
 
     # Write out the trained graph and labels with the weights stored as
     # constants.
+    timer.start_phase('save_graph')
     tf.logging.info('Save final result to : ' + FLAGS.output_graph)
     if wants_quantization:
       tf.logging.info('The model is instrumented for quantization with TF-Lite')
@@ -1135,10 +2533,17 @@ def main(_):
       f.write('\n'.join(image_lists.keys()) + '\n')
 
     if FLAGS.saved_model_dir:
+      timer.start_phase('export_model')
       export_model(module_spec, class_count, FLAGS.saved_model_dir)
+    timer.stop()
 
+  if FLAGS.timing_output:
+    with open(FLAGS.timing_output, 'w') as timing_file:
+      json.dump(timer.record(), timing_file, indent=2)
 
-if __name__ == '__main__':
+
+def create_parser():
+  """Returns the argparse.ArgumentParser for the command line flags."""
   parser = argparse.ArgumentParser()
   parser.add_argument(
       '--image_dir',
@@ -1146,6 +2551,15 @@ if __name__ == '__main__':
       default='',
       help='Path to folders of labeled images.'
   )
+  parser.add_argument(
+      '--image_manifest_dir',
+      type=str,
+      default='/tmp/image_manifest',
+      help="""\
+      Where to keep the list of images found in --image_dir between runs, so
+      that only changed folders are scanned. Set to '' to scan every run.\
+      """
+  )
   parser.add_argument(
       '--output_graph',
       type=str,
@@ -1226,6 +2640,35 @@ if __name__ == '__main__':
       stable results across runs.\
       """
   )
+  parser.add_argument(
+      '--intra_op_parallelism_threads',
+      type=int,
+      default=0,
+      help="""\
+      Number of threads a single TensorFlow op, like a convolution, may use.
+      0 lets TensorFlow choose, one per core the process may run on.\
+      """
+  )
+  parser.add_argument(
+      '--inter_op_parallelism_threads',
+      type=int,
+      default=0,
+      help="""\
+      Number of TensorFlow ops that may run at the same time. 0 lets
+      TensorFlow choose. TensorFlow shares this thread pool across the
+      sessions of a process, so only the first session's setting is used.\
+      """
+  )
+  parser.add_argument(
+      '--eval_chunk_size',
+      type=int,
+      default=1000,
+      help="""\
+      How many test images to evaluate per session run in the final evaluation.
+      With a --test_batch_size of -1 the test set is also loaded a chunk at a
+      time.\
+      """
+  )
   parser.add_argument(
       '--validation_batch_size',
       type=int,
@@ -1253,6 +2696,90 @@ if __name__ == '__main__':
       default='/tmp/bottleneck',
       help='Path to cache bottleneck layer values as files.'
   )
+  parser.add_argument(
+      '--bottleneck_format',
+      type=str,
+      default='memmap',
+      choices=['memmap', 'text'],
+      help="""\
+      How to cache bottleneck values under --bottleneck_dir. 'memmap' packs
+      every bottleneck for a module into one float32 file read through
+      np.memmap, 'text' writes one comma separated text file per image.\
+      """
+  )
+  parser.add_argument(
+      '--bottleneck_cache_mode',
+      type=str,
+      default='warm',
+      choices=['warm', 'cold'],
+      help="""\
+      'warm' reuses bottlenecks cached by earlier runs, 'cold' deletes the
+      module's cached bottlenecks first so that every one is recalculated.\
+      """
+  )
+  parser.add_argument(
+      '--bottleneck_cache_max_gb',
+      type=float,
+      default=10.0,
+      help="""\
+      Size limit for the memory-mapped bottleneck caches under
+      --bottleneck_dir. The least recently used modules are evicted once it is
+      exceeded. A value of 0 disables eviction.\
+      """
+  )
+  parser.add_argument(
+      '--bottleneck_in_memory_max_mb',
+      type=float,
+      default=2048,
+      help="""\
+      If all bottlenecks fit in this many megabytes they are loaded into memory
+      once, and training batches are sampled from there. A value of 0 always
+      reads them from the bottleneck cache.\
+      """
+  )
+  parser.add_argument(
+      '--prefetch_batches',
+      type=int,
+      default=2,
+      help="""\
+      How many training steps' batches to prepare on a background thread ahead
+      of the step that is running. 0 prepares each batch in the training loop.\
+      """
+  )
+  parser.add_argument(
+      '--timing_output',
+      type=str,
+      default='',
+      help="""\
+      Where to write a JSON record of how long each phase of the run took, with
+      training and validation step latency histograms and images per second.\
+      """
+  )
+  parser.add_argument(
+      '--bottleneck_batch_size',
+      type=int,
+      default=32,
+      help="""\
+      How many images to decode and run through the module at a time when
+      filling the bottleneck cache. A value of 1 calculates one image at a
+      time.\
+      """
+  )
+  parser.add_argument(
+      '--num_image_readers',
+      type=int,
+      default=8,
+      help='How many threads to read image files from disk with.'
+  )
+  parser.add_argument(
+      '--image_prefetch_depth',
+      type=int,
+      default=2,
+      help="""\
+      How many batches of decoded images to keep ready ahead of the module
+      while filling the bottleneck cache.\
+      """
+  )
   parser.add_argument(
       '--final_tensor_name',
       type=str,
@@ -1311,5 +2838,9 @@ if __name__ == '__main__':
       type=str,
       default='',
       help='Where to save the exported graph.')
-  FLAGS, unparsed = parser.parse_known_args()
+  return parser
+
+
+if __name__ == '__main__':
+  FLAGS, unparsed = create_parser().parse_known_args()
   tf.app.run(main=main, argv=[sys.argv[0]] + unparsed)
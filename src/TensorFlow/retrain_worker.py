@@ -0,0 +1,79 @@
+r"""Runs retrain.py trainings in a long-lived process.
+
+Starting `python retrain.py` for every training pays for Python startup, the
+TensorFlow import, loading the TensorFlow Hub module and building the graph
+before any training happens. This worker imports TensorFlow once and keeps
+module specs and the most recently used training graphs loaded (see
+retrain.load_module_spec and retrain.get_training_graph), then runs one
+training per request.
+
+Requests are read from stdin, one JSON object per line:
+
+  {"args": ["--image_dir", "flower_photos", "--how_many_training_steps", "200"]}
+
+and each gets a single JSON line in reply on stdout:
+
+  {"status": 0}
+
+where status is 0 if the training succeeded. A failed training also has an
+"error" message. Anything the training prints to stdout goes to stderr
+instead, so it can't be mistaken for a reply. The worker exits at the end of
+stdin.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import sys
+import traceback
+
+import retrain
+
+
+def run_training(args):
+  """Runs retrain.main with the given command line arguments.
+
+  Args:
+    args: List of retrain.py command line argument strings.
+
+  Returns:
+    A reply dict with the exit status of the training.
+  """
+  try:
+    retrain.FLAGS, _ = retrain.create_parser().parse_known_args(args)
+    status = retrain.main(None)
+  except SystemExit as e:
+    # argparse and tf.app exit on bad arguments, which must not end the worker.
+    return {'status': e.code if isinstance(e.code, int) and e.code else 1,
+            'error': 'Training exited with status %s' % e.code}
+  except Exception:  # pylint: disable=broad-except
+    traceback.print_exc()
+    return {'status': 1, 'error': traceback.format_exc().splitlines()[-1]}
+  return {'status': status or 0}
+
+
+def main():
+  # Replies are written to the original stdout, everything else to stderr.
+  replies = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+  os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+  sys.stdout = sys.stderr
+
+  for line in sys.stdin:
+    if not line.strip():
+      continue
+    try:
+      request = json.loads(line)
+      args = [str(arg) for arg in request['args']]
+    except (ValueError, KeyError, TypeError) as e:
+      reply = {'status': 1, 'error': 'Invalid request: %s' % e}
+    else:
+      reply = run_training(args)
+    replies.write(json.dumps(reply) + '\n')
+    replies.flush()
+
+
+if __name__ == '__main__':
+  main()
@@ -25,25 +25,63 @@ Class Documentation
 
 """
 
+import copy
 import json
 import time
+import math
+import random
+import hashlib
 import datetime
 import subprocess
 import platform
 import psutil
 import os
-import shutil
+import sys
 from workload import Workload
+import runner
+import scheduler
+import store
+import uploader
+from collections import deque
 from pathlib import Path
 
+# File that retrain.py writes the per-phase timings of a workload run to, named with the process id
+TIMING_FILE = "timing.json"
 
-def record_data(file_path, start_time, runtime_data):
+# Directory where machine and environment fingerprints are stored, by content hash
+FINGERPRINT_DIR = "fingerprints"
+
+# The fingerprint collected by this session, with the conda-meta modification time it is valid for
+fingerprint_cache = None
+
+# Append-only log of every workload run, one JSON object per line
+RUN_LOG = "runs.jsonl"
+
+# Statistics file written by earlier versions, whose totals are counted along with the run log
+LEGACY_STATISTICS_FILE = "statistics.json"
+
+# Most recent runs kept in memory for recent run queries
+MAX_RECENT_RUNS = 1000
+
+# Runtimes sampled per workload for its percentiles. Up to this many runs the percentiles are exact
+RUNTIME_SAMPLE_SIZE = 1000
+
+# The statistics of the run log read so far
+run_statistics = None
+
+
+def record_data(file_path, start_time, runtime_data, cache_mode=None, run_mode=None, phase_timings=None,
+                pinning=None):
     """
     Calculates workload runtime, records machine specifications, outputs runtime to a file, and posts recorded data to the specified webpage
 
     :param file_path: path to where the output file will be stored\n
     :param start_time: when the workload began running\n
     :param runtime_data: a list that contains information about the run\n
+    :param cache_mode: the bottleneck cache mode ("warm" or "cold") the workload was run with, if any\n
+    :param run_mode: whether the run included Tensorflow startup ("startup") or used the warm worker ("warm"), if any\n
+    :param phase_timings: the timing record written by retrain.py's --timing_output, if any\n
+    :param pinning: the CPU cores, NUMA node and Tensorflow thread counts the workload ran with, see Workload.get_pinning\n
     """
     # initializing variables for runtime
     end_time = datetime.datetime.now()
@@ -51,48 +89,31 @@ def record_data(file_path, start_time, runtime_data):
     run_time = run_time.total_seconds() * 1000000000
     run_time = int(run_time)
 
-    # Records the workload being ran for the workload statistics
-    record_workload(runtime_data[0], run_time, start_time)
-
-    # URL where the recorded runtime data is sent to
-    url = "http://127.0.0.1:8000/entries/"
-
-    # Preparing/retrieving runtime data to be sent
-    processor = platform.processor()
-    memory = float(round((psutil.virtual_memory().total / (1024.0 ** 3)), 2))
-    os_version = platform.platform()
-    disk_storage = float(round((psutil.disk_usage('/').total / (1024.0 ** 3)), 2))
-
-    # Writing all of the installed packages through Anaconda to a json file
-    package_versions = ""
-    try:
-        subprocess.call("conda list --json > versions.json", shell=True)
-    except:
-        package_versions = "Not Available"
-
-    json_path = Path("versions.json")
-    if (not json_path.is_file()):
-        versions = "Not Available"
-
-    # Reads the data from the newly created json file, and deletes the file
-    if (not (package_versions == "Not Available")):
-        data = {}
-        with open('versions.json') as json_file:
-            data = json.load(json_file)
-            json_file.close()
-        os.remove("versions.json")
+    phase_timings = json.dumps(phase_timings) if phase_timings is not None else "Not Available"
+    pinning = json.dumps(pinning) if pinning is not None else "Not Available"
 
-        # Formats the data to be sent to the database
-        for x in data:
-            package_versions += f"{x['name']} {x['version']}, "
+    # Records the workload being ran for the workload statistics
+    record_workload(runtime_data[0], run_time, start_time, cache_mode, run_mode)
 
-        if package_versions.endswith(', '):
-            package_versions = package_versions[:-2]
+    # Machine specifications and installed packages, only collected again when the Anaconda environment changes
+    fingerprint = get_fingerprint()
+    processor = fingerprint['processor']
+    memory = fingerprint['memory']
+    os_version = fingerprint['os_version']
+    disk_storage = fingerprint['disk_storage']
+    package_versions = fingerprint['package_versions']
 
     file_name = (
         f"{start_time.year}-{start_time.month}-{start_time.day}_{start_time.hour}-{start_time.minute}-{start_time.second}")
-    # outputting metric data to output.txt
-    output_file = open(f"{file_path}{file_name}", "w")
+    # outputting metric data to output.txt. Workloads run in parallel can start in the same second, so the file is
+    # only created if it doesn't exist yet, and otherwise a number is added to the name
+    suffix = 0
+    while True:
+        try:
+            output_file = open(f"{file_path}{file_name}{f'_{suffix}' if suffix else ''}", "x")
+            break
+        except FileExistsError:
+            suffix += 1
     output_file.write(f"Ran at: {str(start_time)}\n")
     output_file.write(f"Runtime (in nanoseconds): {run_time}\n")
     output_file.write(f"Start Time: {start_time.hour}:{start_time.minute}:{start_time.second}\n")
@@ -105,60 +126,329 @@ def record_data(file_path, start_time, runtime_data):
     output_file.write(f"Workload Name: {runtime_data[0]}\n")
     output_file.write(f"Comments: {runtime_data[1]}\n")
     output_file.write(f"Command Line: {runtime_data[2]}\n")
+    if cache_mode is not None:
+        output_file.write(f"Cache Mode: {cache_mode}\n")
+    if run_mode is not None:
+        output_file.write(f"Run Mode: {run_mode}\n")
+    output_file.write(f"Phase Timings: {phase_timings}\n")
+    output_file.write(f"Pinning: {pinning}\n")
+    output_file.write(f"Fingerprint ID: {fingerprint['id']}\n")
     output_file.write("\n")  # blank new line for easier reading
     output_file.close()
 
-    # Uses the "curl" command to make a POST to the Django webpage, which is then stored in the Postgresql database
-    subprocess.call(
-        ["curl", "-d",
-         f"workload_model={runtime_data[3]}&command={runtime_data[2]}&runtime={run_time}&processor={processor}&memory={memory}&os_version={os_version}&disk_storage={disk_storage}&package_versions={package_versions}",
-         "-X", "POST", url])
+    # Queues the data to be posted to the Django webpage, which then stores it in the Postgresql database. The upload
+    # happens in the background, so the next iteration doesn't wait for it
+    uploader.upload({
+        'workload_model': runtime_data[3],
+        'command': runtime_data[2],
+        'runtime': run_time,
+        'processor': processor,
+        'memory': memory,
+        'os_version': os_version,
+        'disk_storage': disk_storage,
+        'package_versions': package_versions,
+        'phase_timings': phase_timings,
+        'pinning': pinning
+    })
 
 
-def record_workload(workload_name, runtime, start_time):
+def get_conda_meta_mtime():
     """
-    Creates or adds to a statistics json file that keeps statistics on workloads that have been run
+    Returns the modification time of the Anaconda environment's conda-meta directory, which changes whenever a
+    package is installed, updated or removed
 
-    :param workload_name: workload whose run metrics will be added to the statistics\n
-    :param runtime: amount of time in nanoseconds that it took the workload to run\n
-    :param start_time: time when the workload was initially run\n
+    :return: the modification time in nanoseconds, or None if there is no conda-meta directory
     """
-    # Checks if a statistics file has been created/started
-    json_path = Path("statistics.json")
-    data = {}
-    if json_path.is_file():
-        with open('statistics.json') as json_file:
+    conda_meta = Path(os.environ.get("CONDA_PREFIX", sys.prefix)) / "conda-meta"
+    try:
+        return conda_meta.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def collect_fingerprint():
+    """
+    Records the machine specifications and the packages installed through Anaconda
+
+    :return: A dictionary with the keys processor, memory, os_version, disk_storage and package_versions. The
+        package versions are "Not Available" if conda couldn't list them
+    """
+    package_versions = "Not Available"
+    try:
+        conda_list = subprocess.run(["conda", "list", "--json"], stdout=subprocess.PIPE, universal_newlines=True)
+        if conda_list.returncode == 0:
+            packages = json.loads(conda_list.stdout)
+            # Formats the data to be sent to the database
+            package_versions = ", ".join(f"{x['name']} {x['version']}" for x in packages)
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    return {
+        'processor': platform.processor(),
+        'memory': float(round((psutil.virtual_memory().total / (1024.0 ** 3)), 2)),
+        'os_version': platform.platform(),
+        'disk_storage': float(round((psutil.disk_usage('/').total / (1024.0 ** 3)), 2)),
+        'package_versions': package_versions
+    }
+
+
+def get_fingerprint():
+    """
+    Returns the fingerprint of this machine and environment. It is collected once and reused, by this session and
+    later ones, until the Anaconda environment's conda-meta directory changes. Each fingerprint is stored in
+    FINGERPRINT_DIR under the SHA-1 of its contents, which is also its id
+
+    :return: A dictionary with the keys id, processor, memory, os_version, disk_storage and package_versions
+    """
+    global fingerprint_cache
+    conda_meta_mtime = get_conda_meta_mtime()
+    if fingerprint_cache is not None and fingerprint_cache[0] == conda_meta_mtime:
+        return fingerprint_cache[1]
+
+    fingerprint = None
+    current_path = Path(FINGERPRINT_DIR) / "current.json"
+    # Reuses the fingerprint stored by an earlier session if the environment hasn't changed since
+    if current_path.is_file() and conda_meta_mtime is not None:
+        with open(current_path) as json_file:
+            current = json.load(json_file)
+        fingerprint_path = Path(FINGERPRINT_DIR) / f"{current['id']}.json"
+        if current['conda_meta_mtime'] == conda_meta_mtime and fingerprint_path.is_file():
+            with open(fingerprint_path) as json_file:
+                fingerprint = json.load(json_file)
+
+    if fingerprint is None:
+        fingerprint = collect_fingerprint()
+        fingerprint['id'] = hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+        # A fingerprint without package versions isn't stored or reused, so the next run asks conda again
+        if fingerprint['package_versions'] == "Not Available":
+            return fingerprint
+        os.makedirs(FINGERPRINT_DIR, exist_ok=True)
+        with open(Path(FINGERPRINT_DIR) / f"{fingerprint['id']}.json", 'w') as json_file:
+            json.dump(fingerprint, json_file, indent=4)
+        with open(current_path, 'w') as json_file:
+            json.dump({'id': fingerprint['id'], 'conda_meta_mtime': conda_meta_mtime}, json_file, indent=4)
+
+    fingerprint_cache = (conda_meta_mtime, fingerprint)
+    return fingerprint
+
+
+class RunStatistics(object):
+    """
+    Running statistics of the workload runs in a run log. Each update only reads the runs appended since the last
+    one, so the log is never read twice or rewritten. Totals of a statistics.json file left by earlier versions are
+    counted as well
+
+    :param path: path to the run log\n
+    """
+
+    def __init__(self, path):
+        """
+        Documented above.
+        """
+        self.path = path
+        self.reset()
+
+    def reset(self):
+        """
+        Clears the statistics so the run log is read again from the start
+        """
+        self.offset = 0
+        self.count = 0
+        self.total = 0
+        self.longest = None
+        self.shortest = None
+        # Running summary of each workload's runtimes, see RuntimeSummary
+        self.workloads = {}
+        self.recent = deque(maxlen=MAX_RECENT_RUNS)
+        self.load_legacy_statistics()
+
+    def load_legacy_statistics(self):
+        """
+        Counts the totals and recent workloads of a statistics.json file next to the run log
+        """
+        legacy_path = Path(self.path).with_name(LEGACY_STATISTICS_FILE)
+        if not legacy_path.is_file():
+            return
+        with open(legacy_path) as json_file:
             data = json.load(json_file)
-            json_file.close()
-    # If a statistics file doesn't exists, a new dictionary for one is started
-    else:
-        data['workload_count'] = 0
-        data['total_workload_runtime'] = 0
-        data['longest_workload_runtime'] = runtime
-        data['shortest_workload_runtime'] = runtime
-        data['recent_workloads'] = []
+        if data.get('workload_count', 0) == 0:
+            return
+        self.count = data['workload_count']
+        self.total = data['total_workload_runtime']
+        self.longest = data['longest_workload_runtime']
+        self.shortest = data['shortest_workload_runtime']
+        self.recent.extend(data['recent_workloads'])
+
+    def update(self):
+        """
+        Adds the runs appended to the run log since the last update
+        """
+        try:
+            size = os.stat(self.path).st_size
+        except FileNotFoundError:
+            size = 0
+        if size < self.offset:
+            # The log was replaced or truncated, so it is read again from the start
+            self.reset()
+        if size == self.offset:
+            return
+
+        with open(self.path, 'rb') as run_log:
+            run_log.seek(self.offset)
+            data = run_log.read(size - self.offset)
+        # A run that is still being written is left for the next update
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        for line in data[:end].splitlines():
+            if line.strip():
+                self.add(json.loads(line))
+
+    def add(self, run):
+        """
+        Adds a run to the statistics
+
+        :param run: dictionary with the keys name, runtime, date/time, cache mode and run mode\n
+        """
+        runtime = run['runtime']
+        self.count += 1
+        self.total += runtime
+        if self.longest is None or runtime > self.longest:
+            self.longest = runtime
+        if self.shortest is None or runtime < self.shortest:
+            self.shortest = runtime
+        if run['name'] not in self.workloads:
+            self.workloads[run['name']] = RuntimeSummary(run['name'])
+        self.workloads[run['name']].add(runtime)
+        self.recent.append(run)
+
+    def workload_statistics(self, workload_name):
+        """
+        :param workload_name: name of a workload\n
+        :return: A dictionary with the keys count, average_runtime, stddev_runtime, shortest_runtime,
+        longest_runtime and p50_runtime, p90_runtime and p99_runtime, or None if the workload hasn't been run
+        """
+        summary = self.workloads.get(workload_name)
+        if summary is None:
+            return None
+        return summary.statistics()
+
+    def recent_runs(self, count, workload_name=None):
+        """
+        :param count: how many runs to return, at most MAX_RECENT_RUNS\n
+        :param workload_name: only return runs of this workload, if given\n
+        :return: A list of the most recent runs, oldest first
+        """
+        runs = [run for run in reversed(self.recent) if workload_name is None or run['name'] == workload_name]
+        return list(reversed(runs[:count]))
+
+
+class RuntimeSummary(object):
+    """
+    Summary of a workload's runtimes that takes constant memory and constant time per run. The count, mean,
+    variance (Welford's method), shortest and longest runtimes are exact. Percentiles come from a uniform sample of
+    at most RUNTIME_SAMPLE_SIZE runtimes (reservoir sampling), so they are exact until the workload has run more
+    times than that
+
+    :param name: name of the workload, which seeds the sampling so the same run log always gives the same sample\n
+    """
 
-    data['workload_count'] += 1
-    data['total_workload_runtime'] += runtime
+    def __init__(self, name):
+        """
+        Documented above.
+        """
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.shortest = None
+        self.longest = None
+        self.sample = []
+        self.random = random.Random(name)
+
+    def add(self, runtime):
+        """
+        :param runtime: runtime of a run in nanoseconds\n
+        """
+        self.count += 1
+        delta = runtime - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (runtime - self.mean)
+        if self.shortest is None or runtime < self.shortest:
+            self.shortest = runtime
+        if self.longest is None or runtime > self.longest:
+            self.longest = runtime
+        if len(self.sample) < RUNTIME_SAMPLE_SIZE:
+            self.sample.append(runtime)
+        else:
+            index = self.random.randrange(self.count)
+            if index < RUNTIME_SAMPLE_SIZE:
+                self.sample[index] = runtime
+
+    def statistics(self):
+        """
+        :return: A dictionary with the keys count, average_runtime, stddev_runtime, shortest_runtime,
+        longest_runtime and p50_runtime, p90_runtime and p99_runtime
+        """
+        stats = {
+            'count': self.count,
+            'average_runtime': self.mean,
+            'stddev_runtime': math.sqrt(self.m2 / self.count),
+            'shortest_runtime': self.shortest,
+            'longest_runtime': self.longest
+        }
+        sample = sorted(self.sample)
+        for percent in (50, 90, 99):
+            stats[f'p{percent}_runtime'] = get_percentile(sample, percent / 100)
+        return stats
 
-    if runtime > data['longest_workload_runtime']:
-        data['longest_workload_runtime'] = runtime
-    if runtime < data['shortest_workload_runtime']:
-        data['shortest_workload_runtime'] = runtime
 
-    # Only the most recent ten workloads are displayed, if another workload is run the oldest of the most recent is replaced
-    if len(data['recent_workloads']) >= 10:
-        data['recent_workloads'].pop(0)
+def get_percentile(values, fraction):
+    """
+    Returns a percentile of sorted values, interpolating between the values on either side of it
 
-    data['recent_workloads'].append({
+    :param values: sorted list of numbers\n
+    :param fraction: the percentile as a fraction, like 0.9\n
+    :return: the percentile of the values
+    """
+    position = fraction * (len(values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def get_run_statistics():
+    """
+    Returns the statistics of the run log, brought up to date with the runs appended since they were last read
+
+    :return: a RunStatistics object
+    """
+    global run_statistics
+    path = os.path.abspath(RUN_LOG)
+    if run_statistics is None or run_statistics.path != path:
+        run_statistics = RunStatistics(path)
+    run_statistics.update()
+    return run_statistics
+
+
+def record_workload(workload_name, runtime, start_time, cache_mode=None, run_mode=None):
+    """
+    Appends a workload run to the run log that statistics on workloads are computed from
+
+    :param workload_name: workload whose run metrics will be added to the statistics\n
+    :param runtime: amount of time in nanoseconds that it took the workload to run\n
+    :param start_time: time when the workload was initially run\n
+    :param cache_mode: the bottleneck cache mode the workload was run with, if any\n
+    :param run_mode: whether the run included Tensorflow startup or used the warm worker, if any\n
+    """
+    run = {
         'name': workload_name,
         'runtime': runtime,
-        'date/time': f"{start_time.month}/{start_time.day}/{start_time.year} {start_time.hour}:{start_time.minute}:{start_time.second}"
-    })
-
-    with open('statistics.json', 'w') as json_file:
-        json.dump(data, json_file, indent=4)
-        json_file.close()
+        'date/time': f"{start_time.month}/{start_time.day}/{start_time.year} {start_time.hour}:{start_time.minute}:{start_time.second}",
+        'cache mode': cache_mode,
+        'run mode': run_mode
+    }
+    # Each run is appended with a single write, so runs recorded at the same time don't overwrite each other
+    with open(RUN_LOG, 'a') as run_log:
+        run_log.write(json.dumps(run) + "\n")
 
 
 def get_statistics():
@@ -166,40 +456,51 @@ def get_statistics():
     Returns A dictionary with all of the needed statistics for the GUI home screen
 
     :return: A dictionary with the keys average_workload_runtime (float), longest_workload_runtime (int),
-    shortest_workload_runtime (int), and recent_workloads (list).  The recent_workloads key corresponds to a list of the most recent ten workloads run, in dictionary form. These workloads have the keys: name, runtime, and date/time
+    shortest_workload_runtime (int), recent_workloads (list) and workloads (dict).  The recent_workloads key corresponds to a list of the most recent ten workloads run, in dictionary form. These workloads have the keys: name, runtime, and date/time. The workloads key maps the name of each workload run to its statistics, see RunStatistics.workload_statistics
     """
-    # The dictionary to be returned is created with default values incase a statistics file hasn't been started
+    # The dictionary to be returned is created with default values incase no workloads have been run
     stats = {
         'average_workload_runtime': "Not Available",
         'longest_workload_runtime': "Not Available",
         'shortest_workload_runtime': "Not Available",
-        'recent_workloads': []
+        'recent_workloads': [],
+        'workloads': {}
     }
 
-    json_path = Path("statistics.json")
-    data = {}
-    if json_path.is_file():
-        with open('statistics.json') as json_file:
-            data = json.load(json_file)
-            json_file.close()
-    else:
+    statistics = get_run_statistics()
+    if statistics.count == 0:
         return stats
 
-    if not (data['workload_count'] == 0):
-        stats['average_workload_runtime'] = data['total_workload_runtime'] / data['workload_count']
-    stats['longest_workload_runtime'] = data['longest_workload_runtime']
-    stats['shortest_workload_runtime'] = data['shortest_workload_runtime']
-    stats['recent_workloads'] = data['recent_workloads']
+    stats['average_workload_runtime'] = statistics.total / statistics.count
+    stats['longest_workload_runtime'] = statistics.longest
+    stats['shortest_workload_runtime'] = statistics.shortest
+    stats['recent_workloads'] = statistics.recent_runs(10)
+    stats['workloads'] = {name: statistics.workload_statistics(name) for name in statistics.workloads}
 
     return stats
 
 
-def run_workload(iterations, workload_name):
+def run_workload(iterations, workload_name, cache_mode="warm", run_mode="warm", cpu_set=None):
     """
     Runs a workload. It gets the workload object and then calls run on the workload
 
+    Bottlenecks are cached under /tmp/bottleneck and kept between iterations and runs. A "cold" run recalculates
+    them on every iteration, so cold and warm runtimes are recorded separately
+
+    retrain.py's per-phase timings are collected from TIMING_FILE and recorded alongside the total runtime
+
+    In the "warm" run mode, iterations run in a long-lived Tensorflow worker that is started before the first
+    iteration is timed, so the runtimes leave out Python and Tensorflow startup. The "startup" run mode starts a new
+    retrain.py process for every iteration and includes it
+
+    The workload's process is pinned to its CPU set and NUMA node, if it has them, and the pinning is recorded with
+    each iteration
+
     :param iterations: how many times should the workload run\n
     :param workload_name: name of the workload to run\n
+    :param cache_mode: "warm" to reuse cached bottlenecks, "cold" to recalculate them every iteration\n
+    :param run_mode: "warm" to run in the long-lived Tensorflow worker, "startup" to start retrain.py every iteration\n
+    :param cpu_set: optional CPU cores to pin the workload to instead of its own CPU set, like "0-3,8"\n
     :return: 1 if there was a failure, 0 if a workload run successfully\n
     """
     # Validate workload iterations
@@ -215,23 +516,72 @@ def run_workload(iterations, workload_name):
     # If valid, set to count
     count = iterations
 
+    if cache_mode not in ("warm", "cold"):
+        print("invalid cache mode")
+        return 1
+
+    if run_mode not in ("warm", "startup"):
+        print("invalid run mode")
+        return 1
+
     workloads = get_workloads()
     wl = workloads.get(workload_name, None)
     if wl is None:
         print(f"No workload with the name {workload_name} exists")
         return 1
+    # Running a workload changes its command, so a copy is run instead of the shared Workload object
+    wl = copy.copy(wl)
+    if cpu_set is not None:
+        wl.cpu_set = cpu_set
 
-    while count > 0:
-        start_time = datetime.datetime.now()
-
-        wl.run()
-        record_data("../results/", start_time,
-                    [workload_name, wl.comment, wl.command, wl.tfhub_model])
+    # The CPU cores are checked before anything runs, since the NUMA node may not exist on this machine
+    try:
+        cpus = wl.get_cpu_set()
+    except ValueError as error:
+        print(error)
+        return 1
 
-        if (wl.command is None or wl.command == ""):
-            shutil.rmtree("/tmp/bottleneck")
+    # Custom commands don't use the bottleneck cache or the worker, so no modes are recorded for them
+    if wl.command is None or wl.command == "":
+        recorded_cache_mode = cache_mode
+        recorded_run_mode = run_mode
+        # The worker is started, pinned, before the first iteration is timed
+        if run_mode == "warm":
+            runner.get_worker(cpus, wl.inter_op_threads)
+    else:
+        recorded_cache_mode = None
+        recorded_run_mode = None
 
-        count -= 1
+    # Each process has its own timing file, so workloads run in parallel don't read each other's timings
+    # The path is passed to retrain.py but isn't part of the recorded command, see Workload.run
+    timing_path = os.path.abspath(f"{Path(TIMING_FILE).stem}_{os.getpid()}{Path(TIMING_FILE).suffix}")
+    try:
+        while count > 0:
+            # Removes the timings of the previous iteration so they are never recorded twice
+            if os.path.isfile(timing_path):
+                os.remove(timing_path)
+
+            start_time = datetime.datetime.now()
+
+            wl.run(cache_mode, run_mode, timing_path)
+            phase_timings = None
+            if os.path.isfile(timing_path):
+                try:
+                    with open(timing_path) as timing_file:
+                        phase_timings = json.load(timing_file)
+                except ValueError:
+                    # A run that failed may leave the timings half written
+                    phase_timings = None
+                os.remove(timing_path)
+            record_data("../results/", start_time,
+                        [workload_name, wl.comment, wl.command, wl.tfhub_model], recorded_cache_mode,
+                        recorded_run_mode, phase_timings, wl.get_pinning())
+
+            count -= 1
+    finally:
+        # The timing file isn't left behind, even when a run raises
+        if os.path.isfile(timing_path):
+            os.remove(timing_path)
 
     # Return sucess
     return 0
@@ -240,46 +590,82 @@ def run_workload(iterations, workload_name):
 def get_workloads():
     """
     Retrieves the current workloads in the workloads.json file and returns them as a dictionary of paired
-    workload names and Workload objects
+    workload names and Workload objects. The objects are shared by every caller until the workloads change
 
-    :return: A dictionary with each workload name being used as keys to access the related workload objects
+    :return: An immutable dictionary with each workload name being used as keys to access the related workload objects
     """
     data = {}
-    json_path = Path("workloads.json")
-    if (not json_path.is_file()):
-        return data
+    if not store.get_backend().has_workloads():
+        return store.FrozenDict(data)
+
+    # The Workload objects are only built again after the workloads change
+    return store.get_backend().get_derived_workloads(build_workloads)
+
+
+def build_workloads(data):
+    """
+    Builds the Workload objects of the workloads in the workloads.json file
 
-    data = load_workloads()
+    :param data: the parsed contents of workloads.json\n
+    :return: An immutable dictionary with each workload name being used as keys to access the related workload objects
+    """
     workloads_dict = {}
 
     for x in data['workloads']:
         wl = Workload(x['name'], x['comment'], x['tfhub model'], x['training steps'], x['learning rate'],
                       x['testing percentage'], x['validation percentage'], x['eval step interval'],
                       x['train batch size'], x['test batch size'], x['validation batch size'], x['flip left/right'],
-                      x['random crop'], x['random scale'], x['random brightness'], x['command'])
+                      x['random crop'], x['random scale'], x['random brightness'], x['command'],
+                      **get_pinning_parameters(x))
         workloads_dict[x['name']] = wl
 
-    return workloads_dict
+    return store.FrozenDict(workloads_dict)
 
 
-def load_workloads():
+def get_pinning_parameters(entry):
+    """
+    :param entry: a workload from the workloads store\n
+    :return: a dictionary of the workload's pinning parameters, as Workload keyword arguments
     """
-    Opens the workloads.json file and returns a dictionary containing the current workloads in the system
+    return {
+        'cpu_set': entry.get('cpu set'),
+        'numa_node': entry.get('numa node'),
+        'intra_op_threads': entry.get('intra op threads'),
+        'inter_op_threads': entry.get('inter op threads')
+    }
+
 
-    :return: A dictionary containing the current workloads in the system
+def get_pinning_entry(wl):
     """
+    :param wl: a validated Workload object\n
+    :return: a dictionary of the pinning parameters the workload has, to be stored with it. Workloads that aren't
+        pinned are stored as before
+    """
+    entry = {
+        'cpu set': wl.cpu_set,
+        'numa node': wl.numa_node,
+        'intra op threads': wl.intra_op_threads,
+        'inter op threads': wl.inter_op_threads
+    }
+    return {key: value for key, value in entry.items() if value is not None}
 
-    with open('workloads.json') as json_file:
-        data = json.load(json_file)
-        json_file.close()
-        return data
+
+def load_workloads():
+    """
+    Returns a dictionary containing the current workloads in the system, from the workloads.json file or the store
+    selected with AIXPRT_STORE. The file is only parsed again after it changes
+
+    :return: An immutable dictionary containing the current workloads in the system, see store.thaw for a copy that can be changed
+    """
+    return store.get_backend().load_workloads()
 
 
 def add_workload(name, comment, tfhub_model, training_steps, learning_rate, testing_percentage, validation_percentage,
                  eval_step_interval, train_batch_size, test_batch_size,
-                 validation_batch_size, flip_left_right, random_crop, random_scale, random_brightness, command=None):
+                 validation_batch_size, flip_left_right, random_crop, random_scale, random_brightness, command=None,
+                 cpu_set=None, numa_node=None, intra_op_threads=None, inter_op_threads=None):
     """
-    Adds a new workload entry to the workloads.json file
+    Adds a new workload entry to the workloads store
 
     :param name: Name of the new workload\n
     :param comment: Optional workload comment/description of the workload\n
@@ -297,32 +683,25 @@ def add_workload(name, comment, tfhub_model, training_steps, learning_rate, test
     :param random_scale: Percentage determining how much to randomly scale the size of the training images by\n
     :param random_brightness: Percentage determining how much to randomly multiply the training image input pixels up or down by\n
     :param command: Optional console command to be run upon running this workload\n
+    :param cpu_set: Optional CPU cores to pin the workload to, like "0-3,8"\n
+    :param numa_node: Optional NUMA node to pin the workload to\n
+    :param intra_op_threads: Optional number of threads a single Tensorflow op may use\n
+    :param inter_op_threads: Optional number of Tensorflow ops that may run at the same time\n
     :return: A list of invalid parameters if an error has occured. A 0 is returned on success\n
     """
     # Creating a new workload to validate parameters
     new_WL = Workload(name, comment, tfhub_model, training_steps, learning_rate, testing_percentage,
                       validation_percentage,
                       eval_step_interval, train_batch_size, test_batch_size,
-                      validation_batch_size, flip_left_right, random_crop, random_scale, random_brightness, command)
+                      validation_batch_size, flip_left_right, random_crop, random_scale, random_brightness, command,
+                      cpu_set, numa_node, intra_op_threads, inter_op_threads)
 
     invalid_params = ""
     invalid_params = new_WL.validate_parameters()
 
-    # If parameters are valid, then try to open workloads.json
+    # If parameters are valid, then add the workload to the store
     if len(invalid_params) == 0:
-        json_path = Path("workloads.json")
-        if json_path.is_file():
-            data = load_workloads()
-            for x in data['workloads']:
-                # Check if a workload with the same name already exists; if so, don't add this new one
-                if (x['name'] == name):
-                    print(f"Workload {name} already exists.")
-                    return 1
-        # If workloads.json exists and the workload is acceptable, then add it to the workloads dictionary
-        else:
-            data = {}
-            data['workloads'] = []
-        data['workloads'].append({
+        new_entry = {
             'name': new_WL.name,
             'comment': new_WL.comment,
             'tfhub model': new_WL.tfhub_model,
@@ -339,11 +718,12 @@ def add_workload(name, comment, tfhub_model, training_steps, learning_rate, test
             'random scale': new_WL.random_scale,
             'random brightness': new_WL.random_brightness,
             'command': new_WL.command
-        })
-        # Put updated dictionary into workloads.json 
-        with open('workloads.json', 'w') as json_file:
-            json.dump(data, json_file, indent=4)
-            json_file.close()
+        }
+        new_entry.update(get_pinning_entry(new_WL))
+        # Check if a workload with the same name already exists; if so, don't add this new one
+        if not store.get_backend().add_workload(new_entry):
+            print(f"Workload {name} already exists.")
+            return 1
         # Success
         return 0
     else:
@@ -352,9 +732,10 @@ def add_workload(name, comment, tfhub_model, training_steps, learning_rate, test
 
 def edit_workload(original_name, new_name, comment, tfhub_model, training_steps, learning_rate, testing_percentage,
                   validation_percentage, eval_step_interval, train_batch_size, test_batch_size,
-                  validation_batch_size, flip_left_right, random_crop, random_scale, random_brightness, command=None):
+                  validation_batch_size, flip_left_right, random_crop, random_scale, random_brightness, command=None,
+                  cpu_set=None, numa_node=None, intra_op_threads=None, inter_op_threads=None):
     """
-    Edits an existing workload in the workloads.json file
+    Edits an existing workload in the workloads store
 
     :param original_name: Name of the workload to be edited\n
     :param new_name: Name of the new workload\n
@@ -373,50 +754,52 @@ def edit_workload(original_name, new_name, comment, tfhub_model, training_steps,
     :param random_scale: Percentage determining how much to randomly scale the size of the training images by\n
     :param random_brightness: Percentage determining how much to randomly multiply the training image input pixels up or down by\n
     :param command: Optional console command to be run upon running this workload\n
+    :param cpu_set: Optional CPU cores to pin the workload to, like "0-3,8"\n
+    :param numa_node: Optional NUMA node to pin the workload to\n
+    :param intra_op_threads: Optional number of threads a single Tensorflow op may use\n
+    :param inter_op_threads: Optional number of Tensorflow ops that may run at the same time\n
     :return: A list of invalid parameters if an error has occured\n
     """
     # Creating a updated workload to validate parameters
     new_WL = Workload(new_name, comment, tfhub_model, training_steps, learning_rate, testing_percentage,
                       validation_percentage,
                       eval_step_interval, train_batch_size, test_batch_size,
-                      validation_batch_size, flip_left_right, random_crop, random_scale, random_brightness, command)
+                      validation_batch_size, flip_left_right, random_crop, random_scale, random_brightness, command,
+                      cpu_set, numa_node, intra_op_threads, inter_op_threads)
 
     invalid_params = ""
     invalid_params = new_WL.validate_parameters()
 
-    # If parameters are valid, then try to open workloads.json
+    # If parameters are valid, then edit the workload in the store
     if len(invalid_params) == 0:
-        data = {}
-        json_path = Path("workloads.json")
-        # Check if the workloads file exists in order to edit it
-        if (not json_path.is_file()):
+        # Check if there are workloads to edit
+        if not store.get_backend().has_workloads():
             print("There are currently no workloads to edit.")
             return
-        # If it exists, then load the workloads from it    
-        data = load_workloads()
         # Edit the parameters of the workload corresponding to the original name
-        for x in data['workloads']:
-            if x['name'] == original_name:
-                x['name'] = new_WL.name
-                x['comment'] = new_WL.comment
-                x['tfhub model'] = new_WL.tfhub_model
-                x['training steps'] = new_WL.training_steps
-                x['learning rate'] = new_WL.learning_rate
-                x['testing percentage'] = new_WL.testing_percentage
-                x['validation percentage'] = new_WL.validation_percentage
-                x['eval step interval'] = new_WL.eval_step_interval
-                x['train batch size'] = new_WL.train_batch_size
-                x['test batch size'] = new_WL.test_batch_size
-                x['validation batch size'] = new_WL.validation_batch_size
-                x['flip left/right'] = new_WL.flip_left_right
-                x['random crop'] = new_WL.random_crop
-                x['random scale'] = new_WL.random_scale
-                x['random brightness'] = new_WL.random_brightness
-                x['command'] = new_WL.command
-        # Put updated dictionary into workloads.json
-        with open('workloads.json', 'w') as json_file:
-            json.dump(data, json_file, indent=4)
-            json_file.close()
+        updated_entry = {
+            'name': new_WL.name,
+            'comment': new_WL.comment,
+            'tfhub model': new_WL.tfhub_model,
+            'training steps': new_WL.training_steps,
+            'learning rate': new_WL.learning_rate,
+            'testing percentage': new_WL.testing_percentage,
+            'validation percentage': new_WL.validation_percentage,
+            'eval step interval': new_WL.eval_step_interval,
+            'train batch size': new_WL.train_batch_size,
+            'test batch size': new_WL.test_batch_size,
+            'validation batch size': new_WL.validation_batch_size,
+            'flip left/right': new_WL.flip_left_right,
+            'random crop': new_WL.random_crop,
+            'random scale': new_WL.random_scale,
+            'random brightness': new_WL.random_brightness,
+            'command': new_WL.command
+        }
+        updated_entry.update(get_pinning_entry(new_WL))
+        # A workload can't be renamed to the name of another workload
+        if not store.get_backend().update_workload(original_name, updated_entry):
+            print(f"Workload {new_WL.name} already exists.")
+            return 1
 
         return 0
     else:
@@ -425,41 +808,20 @@ def edit_workload(original_name, new_name, comment, tfhub_model, training_steps,
 
 def remove_workload(workload_name):
     """
-    Removes a workload from the workloads.json
+    Removes a workload from the workloads store
 
     :param workload_name: name of the workload being removed\n
     :return: the removed workload, if it was sucessfuly removed from the list; else, it returns 0\n
     """
-    # Opening workloads.json into data
     data = {}
-    json_path = Path("workloads.json")
-    if (not json_path.is_file()):
+    if not store.get_backend().has_workloads():
         return data
-    data = load_workloads()
 
-    removed_WL = {}
-    index = 0
-    # Traverses through the list of workloads until it finds a matching name,
-    # then it removes the workload from the list and saves it to removed_WL
-    for x in data['workloads']:
-        if x['name'] == workload_name:
-            removed_WL = data['workloads'].pop(index)
-        index += 1
-        # If a workload was removed, then update the json and return the removed workload
+    # Removes the workload with a matching name from the store and from every suite it is in, in one change, and
+    # saves it to removed_WL
+    removed_WL = store.get_backend().remove_workload(workload_name, cascade=True)
+    # If a workload was removed, then return the removed workload
     if removed_WL:
-        with open('workloads.json', 'w') as json_file:
-            json.dump(data, json_file, indent=4)
-            json_file.close()
-
-        # Check if that workload was in any suites
-        suite_appearances = is_workload_in_suites(workload_name)
-        # If so, then remove them from the suites
-        if not suite_appearances == 1:
-            count = len(suite_appearances) - 1
-            while count >= 0:
-                remove_workload_from_suite(suite_appearances[count][1], suite_appearances[count][0])
-                count -= 1
-
         # Create an actual workload object with removed_WL
         removed_WL = Workload(removed_WL['name'], removed_WL['comment'], removed_WL['tfhub model'],
                               removed_WL['training steps'], removed_WL['learning rate'],
@@ -467,7 +829,8 @@ def remove_workload(workload_name):
                               removed_WL['eval step interval'], removed_WL['train batch size'],
                               removed_WL['test batch size'], removed_WL['validation batch size'],
                               removed_WL['flip left/right'], removed_WL['random crop'], removed_WL['random scale'],
-                              removed_WL['random brightness'], removed_WL['command'])
+                              removed_WL['random brightness'], removed_WL['command'],
+                              **get_pinning_parameters(removed_WL))
         return removed_WL
     # Else, return 0
     return 0
@@ -477,11 +840,21 @@ def remove_workload(workload_name):
 ##################### SUITES CODE #####################
 #######################################################
 
-def run_suite(suite_name):
+def run_suite(suite_name, parallel=False, cpu_budget=None, memory_budget_gb=None, exclusive=False):
     """
     Runs a suite of workloads
 
+    By default the workloads run one after another. In parallel, they run concurrently in a pool of processes, see
+    scheduler.py. A suite entry may then give the CPU cores ("cpus") and GB of memory ("memory") the workload needs,
+    and whether it must run on its own ("exclusive"). Workloads that aren't pinned to a CPU set or NUMA node of their
+    own are pinned to cores that no other running workload is using. The iterations of each workload still run in
+    order, and every iteration is recorded the same way either way
+
     :param suite_name: name of suite to run\n
+    :param parallel: True to run the workloads concurrently\n
+    :param cpu_budget: CPU cores that workloads running in parallel may use in total, all of them by default\n
+    :param memory_budget_gb: GB of memory that workloads running in parallel may use in total\n
+    :param exclusive: True to run every workload on its own, even in parallel\n
     :return: 1 if the suite specificed could not be found, 0 if the suite is ran successfully\n
     """
     # Check if the suite exists 
@@ -491,30 +864,43 @@ def run_suite(suite_name):
 
     # Loads the dictionary of suites in from the suites.json file
     suites_dict = load_suites()
-    # Runs each workload in the suite
-    for x in suites_dict[suite_name]:
-        run_workload(int(x['iterations']), x['name'])
+    if not parallel:
+        # Runs each workload in the suite
+        for x in suites_dict[suite_name]:
+            run_workload(int(x['iterations']), x['name'])
+        return 0
 
+    # The fingerprint is collected before the pool starts, so the pool processes reuse it
+    get_fingerprint()
+    workloads = get_workloads()
+    jobs = []
+    for index, x in enumerate(suites_dict[suite_name]):
+        wl = workloads.get(x['name'])
+        # Workloads with the same model share its bottleneck cache, so they don't run at the same time
+        conflict = wl.tfhub_model if wl is not None and not wl.command else None
+        # A workload pinned to its own cores only runs while no other workload uses them. If its NUMA node doesn't
+        # exist, run_workload reports it
+        try:
+            cpu_set = wl.get_cpu_set() if wl is not None else None
+        except ValueError:
+            cpu_set = None
+        jobs.append(scheduler.Job(index, (int(x['iterations']), x['name']),
+                                  x.get('cpus', scheduler.DEFAULT_WORKLOAD_CPUS),
+                                  x.get('memory', scheduler.DEFAULT_WORKLOAD_MEMORY_GB),
+                                  x.get('exclusive', False), conflict, cpu_set))
+    scheduler.SuiteScheduler(run_workload, cpu_budget, memory_budget_gb, exclusive, pin=True).run(jobs)
     return 0
 
 
 def load_suites():
     """
-    Opens the suites.json file and returns a dictionary containing the current suites in the system
+    Returns a dictionary containing the current suites in the system, from the suites.json file or the store
+    selected with AIXPRT_STORE. The file is only parsed again after it changes
 
-    :return: a dictionary containing the suites or an empty dictionary if suites.json does not exist
+    :return: an immutable dictionary containing the suites or an empty dictionary if suites.json does not exist, see
+        store.thaw for a copy that can be changed
     """
-    # Checking to see if the suites.json file exists
-    suites_dict = {}
-    json_path = Path("suites.json")
-    if (not json_path.is_file()):
-        print("suites.json does not exist")
-        return suites_dict
-    # If it does exist, then open it and save its contents into a dictionary
-    with open('suites.json') as json_file:
-        suites_dict = json.load(json_file)
-        json_file.close()
-        return suites_dict
+    return store.get_backend().load_suites()
 
 
 def get_suite(suite_name):
@@ -534,7 +920,7 @@ def get_suite(suite_name):
 
 def add_suite(new_suite):
     """
-    Adds a suite into the system through the suites.json
+    Adds a suite into the system through the suites store
 
     :param new_suite: suite being added - this is a dictionary containing a name (key) and a list of workloads (pair)\n
     :return: 1 if an error occurs, 0 if the new suite is added successfully\n
@@ -547,26 +933,17 @@ def add_suite(new_suite):
         print("Invalid suite name")
         return 1
 
-    suites_dict = load_suites()
-    # Checks to see if a suite of the same name already exists
-    for x in suites_dict.keys():
-        if x == new_suite_name:
-            # A suite of this name already exists
-            print("A suite of this name already exists")
-            return 1
-            # If not, then add it to the dictionary of suites
-    suites_dict.update(new_suite)
-    # Then update the suites.json
-    with open('suites.json', "w") as json_file:
-        json.dump(suites_dict, json_file, indent=4)
-        json_file.close()
+    # Adds the suite, unless a suite of the same name already exists
+    if not store.get_backend().add_suite(new_suite_name, new_suite[new_suite_name]):
+        print("A suite of this name already exists")
+        return 1
     # Successful add
     return 0
 
 
 def edit_suite(original_name, updated_suite):
     """
-    Edits a suite in the system through the suites.json
+    Edits a suite in the system through the suites store
 
     :param original_name: name of suite being added (original if the name was changed)\n
     :param updated_suite: suite being edited - this is a dictionary containing a name (key) and a list of workloads (pair)\n
@@ -586,21 +963,9 @@ def edit_suite(original_name, updated_suite):
         print("Invalid suite name")
         return 1
 
-    suites_dict = load_suites()
-    did_edit = False
-    # Checks to see if that suite exists in the system
-    for x in suites_dict.keys():
-        if x == original_name:
-            # A suite of this name exists so edit/update it 
-            suites_dict.pop(x)
-            suites_dict.update(updated_suite)
-            did_edit = True
-    if did_edit:
-        # Then update the suites.json
-        with open('suites.json', "w") as json_file:
-            json.dump(suites_dict, json_file, indent=4)
-            json_file.close()
-            return 0
+    # If a suite of this name exists then edit/update it
+    if store.get_backend().replace_suite(original_name, updated_suite_name, updated_suite[updated_suite_name]):
+        return 0
     else:
         print("No suite of this name exists to edit")
         return 1
@@ -608,7 +973,7 @@ def edit_suite(original_name, updated_suite):
 
 def remove_suite(suite):
     """
-    Removed a suite from the system through the suites.json
+    Removed a suite from the system through the suites store
 
     :param suite: suite being removed\n
     :return: the suite removed from the system, this is null if no suite was removed\n
@@ -622,13 +987,8 @@ def remove_suite(suite):
         print("No suite of this name exists to remove")
         return 1
 
-    suites_dict = load_suites()
     # If it can be removed, then remove it
-    removed_suite = suites_dict.pop(suite_name)
-    # Then update the suites.json
-    with open('suites.json', "w") as json_file:
-        json.dump(suites_dict, json_file, indent=4)
-        json_file.close()
+    removed_suite = store.get_backend().remove_suite(suite_name)
     # Return the removed suite
     return removed_suite
 
@@ -660,12 +1020,7 @@ def edit_workload_in_suite(workload_index, workload_iterations, suite_name):
 
     # Check to ensure that the workload_index is within bounds
     if workload_index < len(suites_dict[suite_name]) and workload_index >= 0:
-        suites_dict[suite_name][workload_index]['iterations'] = workload_iterations
-        # int(SU_data["Small_Suite"][0]['iterations'])
-        # Then update the suites.json
-        with open('suites.json', "w") as json_file:
-            json.dump(suites_dict, json_file, indent=4)
-            json_file.close()
+        store.get_backend().set_suite_workload_iterations(suite_name, workload_index, workload_iterations)
     else:
         print("Invalid workload index")
         return 1
@@ -693,11 +1048,7 @@ def remove_workload_from_suite(workload_index, suite_name):
         # Check to ensure that the workload_index is within bounds
     if workload_index < len(suites_dict[suite_name]) and workload_index >= 0:
         # Remove that workload from the suite
-        removed_WL = suites_dict[suite_name].pop(workload_index)
-        # Then update the suites.json
-        with open('suites.json', "w") as json_file:
-            json.dump(suites_dict, json_file, indent=4)
-            json_file.close()
+        removed_WL = store.get_backend().remove_suite_workload(suite_name, workload_index)
         # Return the removed workload
         return removed_WL
 
@@ -708,7 +1059,7 @@ def remove_workload_from_suite(workload_index, suite_name):
 
 def is_workload_in_suites(workload_name):
     """
-    Checks to see if a workload is in suites
+    Checks to see if a workload is in suites. Only workloads with exactly this name are matched
 
     :param workload_name: name of workload to search for\n
     :return: a list of the suites that contain the workload and the index in that suite where the workload occurs,
@@ -719,21 +1070,9 @@ def is_workload_in_suites(workload_name):
         with the differet/respective indexes
 
     """
-    suites_dict = load_suites()
-    suites_list = []
-    suite_index = 0
-    workload_index = 0
-    # Traverses the suites dictionary
-    for suite in suites_dict:
-        for workload in suites_dict[suite]:
-            # Checking to see if the workload is in any of the suites
-            if workload_name in workload['name']:
-                # If so, then add it to the list at its index
-                suite_name = list(suites_dict.keys())[suite_index]
-                suites_list.append([suite_name, workload_index])
-            workload_index += 1
-        suite_index += 1
-        workload_index = 0
+    # Looks the workload up in the reverse index of the workloads in suites
+    suites_list = [[suite_name, workload_index]
+                   for suite_name, workload_index in store.get_backend().find_suite_workloads(workload_name)]
 
         # If the suites list is empty, return 1
     if len(suites_list) <= 0:
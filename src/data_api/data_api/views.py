@@ -18,4 +18,8 @@ def api_root(request, format=None):
     """
     return Response({
        'entries': reverse('entries:entry-list', request=request, format=format),
+       'bulk entries': reverse('entries:entry-bulk', request=request, format=format),
+       'entry stats': reverse('entries:entry-stats', request=request, format=format),
+       'csv export': reverse('entries:entry-export', kwargs={'export_format': 'csv'}, request=request),
+       'ndjson export': reverse('entries:entry-export', kwargs={'export_format': 'ndjson'}, request=request),
 })
\ No newline at end of file
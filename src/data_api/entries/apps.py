@@ -3,7 +3,14 @@ Generated by 'python manage.py startapp entries' using Django 2.1.3.
 """
 
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class EntriesConfig(AppConfig):
     name = 'entries'
+
+    def ready(self):
+        from entries import stats
+        entry = self.get_model('Entry')
+        post_save.connect(stats.invalidate, sender=entry, dispatch_uid='entries_stats_save')
+        post_delete.connect(stats.invalidate, sender=entry, dispatch_uid='entries_stats_delete')
@@ -0,0 +1,119 @@
+"""
+Streams entries as CSV or NDJSON, optionally gzip compressed, reading them from the database in chunks so that
+exports of any size run in constant memory.
+
+.. moduleauthor:: Will James
+"""
+
+import csv
+import json
+import zlib
+from django.core.serializers.json import DjangoJSONEncoder
+
+# Columns of the export, and the entry field each is read from
+COLUMNS = (
+    ('id', 'id'),
+    ('date_time', 'date_time'),
+    ('workload_model', 'workload_model'),
+    ('command', 'command'),
+    ('runtime', 'runtime'),
+    ('processor', 'processor'),
+    ('memory', 'memory'),
+    ('os_version', 'os_version'),
+    ('disk_storage', 'disk_storage'),
+    ('environment_hash', 'environment__content_hash'),
+    ('phase_timings', 'phase_timings'),
+    ('pinning', 'pinning'),
+)
+
+# Rows fetched from the database at a time
+CHUNK_SIZE = 2000
+
+# Bytes of output gathered before they are sent
+BLOCK_SIZE = 64 * 1024
+
+
+class Echo(object):
+    """
+    Echo class. File-like object that returns what is written to it, so that csv.writer can format one row at a
+    time.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    """
+    :param rows: Iterable of tuples with the values of COLUMNS
+    :return: Generator of CSV lines, starting with the header
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow([name for name, field in COLUMNS])
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows):
+    """
+    :param rows: Iterable of tuples with the values of COLUMNS
+    :return: Generator of JSON objects, one per line
+    """
+    names = [name for name, field in COLUMNS]
+    for row in rows:
+        yield json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+# Line formatters of each export format, and the content type of the output
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
+
+
+def blocks(lines):
+    """
+    Gathers lines into blocks of about BLOCK_SIZE bytes, so the response isn't sent a line at a time.
+    :param lines: Iterable of strings
+    :return: Generator of UTF-8 encoded blocks
+    """
+    block = []
+    size = 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= BLOCK_SIZE:
+            yield ''.join(block).encode('utf-8')
+            block = []
+            size = 0
+    if block:
+        yield ''.join(block).encode('utf-8')
+
+
+def gzip_blocks(data):
+    """
+    :param data: Iterable of bytes
+    :return: Generator of the data compressed as a gzip stream
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for block in data:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_entries(queryset, export_format, compress=False):
+    """
+    Streams entries in an export format.
+    :param queryset: Entries to export
+    :param export_format: Name of the export format, one of FORMATS
+    :param compress: Whether to gzip compress the output
+    :return: Generator of the bytes of the export
+    """
+    format_lines, content_type = FORMATS[export_format]
+    rows = queryset.values_list(*[field for name, field in COLUMNS]).iterator(chunk_size=CHUNK_SIZE)
+    output = blocks(format_lines(rows))
+    if compress:
+        output = gzip_blocks(output)
+    return output
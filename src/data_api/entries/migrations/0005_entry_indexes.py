@@ -0,0 +1,25 @@
+# Generated by Django 2.1.3 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entries', '0004_entry_phase_timings'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['workload_model', 'date_time'], name='entry_model_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['processor', 'date_time'], name='entry_processor_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['command'], name='entry_command_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.1.3 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entries', '0005_entry_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Environment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=40, unique=True)),
+                ('package_versions', models.TextField(default='Not Available')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='environment',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='entries.Environment'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 2.1.3 on 2026-10-18 12:00
+
+import hashlib
+from django.db import migrations
+
+# Entries updated per UPDATE statement
+BATCH_SIZE = 1000
+
+
+def link_environments(apps, schema_editor):
+    """
+    Creates an Environment for each distinct package_versions text and points the entries at it, reading the
+    entries once in id order.
+    """
+    Entry = apps.get_model('entries', 'Entry')
+    Environment = apps.get_model('entries', 'Environment')
+    environment_ids = {}
+    pending = {}
+
+    def flush(environment_id):
+        Entry.objects.filter(id__in=pending.pop(environment_id)).update(environment_id=environment_id)
+
+    rows = Entry.objects.order_by('id').values_list('id', 'package_versions').iterator(chunk_size=BATCH_SIZE)
+    for entry_id, package_versions in rows:
+        content_hash = hashlib.sha1(package_versions.encode('utf-8')).hexdigest()
+        if content_hash not in environment_ids:
+            environment, created = Environment.objects.get_or_create(
+                content_hash=content_hash, defaults={'package_versions': package_versions})
+            environment_ids[content_hash] = environment.id
+        environment_id = environment_ids[content_hash]
+        pending.setdefault(environment_id, []).append(entry_id)
+        if len(pending[environment_id]) >= BATCH_SIZE:
+            flush(environment_id)
+    for environment_id in list(pending):
+        flush(environment_id)
+
+
+def unlink_environments(apps, schema_editor):
+    """
+    Copies each environment's package_versions back onto its entries.
+    """
+    Entry = apps.get_model('entries', 'Entry')
+    Environment = apps.get_model('entries', 'Environment')
+    for environment in Environment.objects.iterator():
+        Entry.objects.filter(environment_id=environment.id).update(package_versions=environment.package_versions)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entries', '0006_environment'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_environments, unlink_environments),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.1.3 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entries', '0007_entry_environment_data'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='entry',
+            name='package_versions',
+        ),
+        migrations.AlterField(
+            model_name='entry',
+            name='environment',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='entries.Environment'),
+        ),
+    ]
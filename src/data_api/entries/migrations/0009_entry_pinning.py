@@ -0,0 +1,18 @@
+# Generated by Django 2.1.3 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entries', '0008_remove_entry_package_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='pinning',
+            field=models.TextField(default='Not Available'),
+        ),
+    ]
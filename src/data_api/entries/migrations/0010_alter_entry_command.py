@@ -0,0 +1,18 @@
+# Generated by Django 2.1.3 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entries', '0009_entry_pinning'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='entry',
+            name='command',
+            field=models.CharField(default='Not Available', max_length=1000),
+        ),
+    ]
@@ -1,12 +1,39 @@
 """
+.. class:: Environment
+    :synopsis: Model representation of the installed packages of a machine's environment
+
 .. class:: Entry
     :synopsis: Model representation of a AIXPRT data entry
 
 .. moduleauthor:: Will James
 """
 
+import hashlib
 from django.db import models
 
+class Environment(models.Model):
+    """
+    Environment class. Every entry run on the same environment shares one Environment, instead of each entry
+    storing its own copy of the package versions.
+
+    Args:
+
+        - **content_hash** (string): SHA-1 of the package versions, which identifies the environment
+        - **package_versions** (string): A string contatining every installed package on the environment
+        
+    """
+    content_hash = models.CharField(max_length=40, unique=True, blank=False, null=False)
+    package_versions = models.TextField(blank=False, null=False, default="Not Available")
+
+    @staticmethod
+    def hash_package_versions(package_versions):
+        """
+        :param package_versions: A string contatining every installed package on an environment
+        :return: The content hash of the environment with those package versions
+        """
+        return hashlib.sha1(package_versions.encode('utf-8')).hexdigest()
+
+
 class Entry(models.Model):
     """
     Entry class.
@@ -21,18 +48,28 @@ class Entry(models.Model):
         - **memory** (float): The amount of memory in GB for the machine that the workload was ran on
         - **os_version** (string): Name of the operating system for the machine that the workload was ran on
         - **disk_storage** (float): The amount of disk storage in GB for the machine that the workload was ran on
-        - **package_versions** (string): A string contatining every installed package on the environment that the workload was ran on
+        - **environment** (Environment): The environment that the workload was ran on, with its installed packages
+        - **phase_timings** (string): JSON record of how long each phase of the workload run took, with step latency histograms and images per second
+        - **pinning** (string): JSON record of the CPU cores, NUMA node and Tensorflow thread counts the workload run was pinned to
         
     """
     date_time = models.DateTimeField(auto_now_add=True)
     workload_model = models.CharField(max_length=100, blank=False, null=False, default="Not Available")
-    command = models.CharField(max_length=400, blank=False, null=False, default="Not Available")
+    command = models.CharField(max_length=1000, blank=False, null=False, default="Not Available")
     runtime = models.BigIntegerField(blank=False, null=False, default=0)
     processor = models.CharField(max_length=100, blank=False, null=False, default="Not Available")
     memory = models.DecimalField(max_digits=10, decimal_places=2, blank=False, null=False, default=0)
     os_version = models.CharField(max_length=100, blank=False, null=False, default="Not Available")
     disk_storage = models.DecimalField(max_digits=10, decimal_places=2, blank=False, null=False, default=0)
-    package_versions = models.TextField(blank=False, null=False, default="Not Available")
+    environment = models.ForeignKey(Environment, on_delete=models.PROTECT, related_name='entries')
+    phase_timings = models.TextField(blank=False, null=False, default="Not Available")
+    pinning = models.TextField(blank=False, null=False, default="Not Available")
 
     class Meta:
-        ordering = ('date_time',)
\ No newline at end of file
+        ordering = ('date_time',)
+        indexes = [
+            models.Index(fields=['workload_model', 'date_time'], name='entry_model_date_idx'),
+            models.Index(fields=['processor', 'date_time'], name='entry_processor_date_idx'),
+            models.Index(fields=['command'], name='entry_command_idx'),
+            models.Index(fields=['-date_time', '-id'], name='entry_date_id_idx'),
+        ]
\ No newline at end of file
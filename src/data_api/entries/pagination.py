@@ -0,0 +1,21 @@
+"""
+.. class:: EntryCursorPagination
+    :synopsis: Cursor pagination for the entry list
+
+.. moduleauthor:: Will James
+"""
+
+from rest_framework.pagination import CursorPagination
+
+class EntryCursorPagination(CursorPagination):
+    """
+    EntryCursorPagination class. Pages through entries newest first, by date/time with the id breaking ties so the
+    order is the same on every request. The cursor holds the date/time of the last entry on the page, plus an offset
+    past the entries that share it, so fetching a page starts from that date/time in entry_date_id_idx (or the
+    model and processor indexes when the list is filtered by them) no matter how deep into the list it is, unlike
+    offset pagination.
+    """
+    ordering = ('-date_time', '-id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,39 @@
+"""
+.. class:: NDJSONParser
+    :synopsis: Parser for newline-delimited JSON request bodies
+
+.. moduleauthor:: Will James
+"""
+
+import json
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+class NDJSONParser(BaseParser):
+    """
+    NDJSONParser class. Parses a request body with one JSON object per line into a list of objects, reading the
+    stream a line at a time.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """
+        Parses the incoming bytestream.
+        :param stream: Stream of the request body
+        :param media_type: Media type of the request
+        :param parser_context: Context of the view and request
+        :return: A list with the object on each non-blank line
+        """
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        rows = []
+        for line_number, line in enumerate(stream, start=1):
+            line = line.decode(encoding).strip()
+            if not line:
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError as e:
+                raise ParseError('NDJSON parse error on line %d - %s' % (line_number, e))
+        return rows
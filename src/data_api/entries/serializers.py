@@ -6,18 +6,111 @@
 """
 
 from rest_framework import serializers
-from entries.models import Entry
+from entries.models import Entry, Environment
 
-class EntrySerializer(serializers.HyperlinkedModelSerializer):
+class EnvironmentFieldsMixin(serializers.Serializer):
+    """
+    EnvironmentFieldsMixin class. Shows an entry's environment as its package_versions and environment_hash, and
+    finds the shared environment of the ones that are sent. Once the server has an environment, entries can send
+    only its environment_hash instead of the full package versions.
+    """
+    environment_hash = serializers.CharField(source='environment.content_hash', max_length=40, required=False)
+    package_versions = serializers.CharField(source='environment.package_versions', required=False,
+                                             trim_whitespace=False)
+
+    def validate(self, attrs):
+        """
+        Replaces the sent package_versions and environment_hash with the environment they belong to. An
+        environment that isn't saved yet is left unsaved, see save_environment.
+        """
+        environment = attrs.pop('environment', {})
+        package_versions = environment.get('package_versions')
+        content_hash = environment.get('content_hash')
+        if package_versions is None and content_hash is None:
+            if self.partial:
+                return attrs
+            package_versions = Environment._meta.get_field('package_versions').default
+
+        if package_versions is not None:
+            actual_hash = Environment.hash_package_versions(package_versions)
+            if content_hash is not None and content_hash != actual_hash:
+                raise serializers.ValidationError({'environment_hash': 'Does not match package_versions.'})
+            known = self.context.get('environments', {})
+            attrs['environment'] = known.get(actual_hash) or Environment(content_hash=actual_hash,
+                                                                          package_versions=package_versions)
+            return attrs
+
+        # Views that validate many entries look their environments up beforehand
+        if 'environments' in self.context:
+            attrs['environment'] = self.context['environments'].get(content_hash)
+        else:
+            attrs['environment'] = Environment.objects.filter(content_hash=content_hash).first()
+        if attrs['environment'] is None:
+            raise serializers.ValidationError({'environment_hash': 'Unknown environment, send package_versions.'})
+        return attrs
+
+    def save_environment(self, validated_data):
+        """
+        Saves the entry's environment, if it is a new one, or uses the existing one with the same hash.
+        """
+        environment = validated_data.get('environment')
+        if environment is not None and environment.pk is None:
+            validated_data['environment'], created = Environment.objects.get_or_create(
+                content_hash=environment.content_hash, defaults={'package_versions': environment.package_versions})
+        return validated_data
+
+    def create(self, validated_data):
+        """
+        Saves a new entry with its environment.
+        """
+        return self.Meta.model.objects.create(**self.save_environment(validated_data))
+
+    def update(self, instance, validated_data):
+        """
+        Saves the changes to an entry, and its environment if that has changed.
+        """
+        for attr, value in self.save_environment(validated_data).items():
+            setattr(instance, attr, value)
+        instance.save()
+        return instance
+
+
+class EntrySerializer(EnvironmentFieldsMixin, serializers.HyperlinkedModelSerializer):
     """
     EntrySerializer class.
     """
 
     class Meta:
         model = Entry
-        fields = ('url','id', 'date_time', 'workload_model', 'command', 'runtime', 'processor', 'memory', 'os_version', 'disk_storage', 'package_versions')
+        fields = ('url','id', 'date_time', 'workload_model', 'command', 'runtime', 'processor', 'memory', 'os_version', 'disk_storage', 'environment_hash', 'package_versions', 'phase_timings', 'pinning')
+        extra_kwargs = {
+            'url': {
+                'view_name': 'entries:entry-detail',
+            }
+        }
+
+
+class EntryListSerializer(serializers.HyperlinkedModelSerializer):
+    """
+    EntryListSerializer class. Leaves out the package versions, which are only shown on the detailed view.
+    """
+    environment_hash = serializers.CharField(source='environment.content_hash', read_only=True)
+
+    class Meta:
+        model = Entry
+        fields = ('url','id', 'date_time', 'workload_model', 'command', 'runtime', 'processor', 'memory', 'os_version', 'disk_storage', 'environment_hash', 'phase_timings', 'pinning')
         extra_kwargs = {
             'url': {
                 'view_name': 'entries:entry-detail',
             }
-        }
\ No newline at end of file
+        }
+
+
+class EntryBulkSerializer(EnvironmentFieldsMixin, serializers.ModelSerializer):
+    """
+    EntryBulkSerializer class. Validates the rows sent to the bulk ingestion endpoint.
+    """
+
+    class Meta:
+        model = Entry
+        fields = ('workload_model', 'command', 'runtime', 'processor', 'memory', 'os_version', 'disk_storage', 'environment_hash', 'package_versions', 'phase_timings', 'pinning')
@@ -0,0 +1,144 @@
+"""
+Computes aggregate statistics of entry runtimes, grouped by workload, machine and time, and caches them until
+entries change.
+
+.. moduleauthor:: Will James
+"""
+
+import hashlib
+import math
+from itertools import groupby
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Aggregate, Avg, Count, FloatField, Max, Min, StdDev
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+# Query parameter names of the fields that statistics can be grouped by
+GROUP_FIELDS = {
+    'model': 'workload_model',
+    'command': 'command',
+    'processor': 'processor',
+    'os': 'os_version',
+}
+
+# Time buckets that statistics can be grouped by
+BUCKETS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+# Percentiles of the runtime reported for each group
+PERCENTILES = (0.5, 0.9, 0.99)
+
+# Cache key of the version number that is bumped whenever entries change, so older cached statistics are not used
+VERSION_KEY = 'entries:stats:version'
+
+# Seconds that cached statistics are kept for
+CACHE_TIMEOUT = 24 * 60 * 60
+
+
+class PercentileCont(Aggregate):
+    """
+    PercentileCont class. PostgreSQL's percentile_cont ordered-set aggregate, interpolating between the values on
+    either side of the percentile.
+    """
+    function = 'PERCENTILE_CONT'
+    name = 'PercentileCont'
+    template = '%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = FloatField()
+
+    def __init__(self, expression, percentile, **extra):
+        super().__init__(expression, percentile=float(percentile), **extra)
+
+
+def percentile_name(percentile):
+    """
+    :param percentile: Percentile as a fraction, like 0.9
+    :return: Name of the percentile in the statistics, like p90
+    """
+    return 'p%g' % (percentile * 100)
+
+
+def percentile_cont(values, percentile):
+    """
+    Computes a percentile the same way as PostgreSQL's percentile_cont.
+    :param values: Sorted list of values
+    :param percentile: Percentile as a fraction, like 0.9
+    :return: The percentile of the values
+    """
+    position = percentile * (len(values) - 1)
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def compute_stats(queryset, group_by, bucket=None):
+    """
+    Computes count, mean, min, max, standard deviation and percentiles of the runtime for each group of entries.
+    On PostgreSQL everything is computed in the database. Other databases, like SQLite, don't have stddev or
+    percentile_cont, so those are computed from the runtimes of each group, streamed in sorted order.
+    :param queryset: Entries to compute statistics of
+    :param group_by: List of model field names to group by
+    :param bucket: Name of the time bucket to group by, one of BUCKETS, or None
+    :return: List of dictionaries with the group's field values and its statistics
+    """
+    group_by = list(group_by)
+    if bucket:
+        queryset = queryset.annotate(bucket=BUCKETS[bucket]('date_time'))
+        group_by.append('bucket')
+
+    aggregates = {
+        'count': Count('id'),
+        'mean': Avg('runtime'),
+        'min': Min('runtime'),
+        'max': Max('runtime'),
+    }
+    in_database = connection.vendor == 'postgresql'
+    if in_database:
+        aggregates['stddev'] = StdDev('runtime')
+        for percentile in PERCENTILES:
+            aggregates[percentile_name(percentile)] = PercentileCont('runtime', percentile)
+
+    groups = list(queryset.values(*group_by).annotate(**aggregates).order_by(*group_by))
+    if in_database:
+        return groups
+
+    runtimes = queryset.order_by(*group_by, 'runtime').values_list(*group_by, 'runtime').iterator()
+    by_key = {tuple(group[field] for field in group_by): group for group in groups}
+    for key, rows in groupby(runtimes, key=lambda row: row[:-1]):
+        values = [row[-1] for row in rows]
+        group = by_key[key]
+        group['stddev'] = math.sqrt(sum((value - group['mean']) ** 2 for value in values) / len(values))
+        for percentile in PERCENTILES:
+            group[percentile_name(percentile)] = percentile_cont(values, percentile)
+    return groups
+
+
+def get_stats(queryset, group_by, bucket, cache_key):
+    """
+    Returns cached statistics, computing and caching them if they aren't cached or entries have changed since.
+    :param queryset: Entries to compute statistics of
+    :param group_by: List of model field names to group by
+    :param bucket: Name of the time bucket to group by, one of BUCKETS, or None
+    :param cache_key: String identifying the request for these statistics
+    :return: List of dictionaries with the group's field values and its statistics
+    """
+    version = cache.get_or_set(VERSION_KEY, 1, None)
+    key = 'entries:stats:%s:%s' % (version, hashlib.sha1(cache_key.encode('utf-8')).hexdigest())
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_stats(queryset, group_by, bucket)
+        cache.set(key, stats, CACHE_TIMEOUT)
+    return stats
+
+
+def invalidate(**kwargs):
+    """
+    Stops the currently cached statistics from being used, after entries have been added, changed or deleted.
+    Connected to the entry model's save and delete signals, and called after bulk inserts, which don't send them.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
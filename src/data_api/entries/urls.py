@@ -13,5 +13,8 @@ from entries import views
 
 urlpatterns = [
     url(r'^entries/$', views.EntryList.as_view(), name='entry-list'),
+    url(r'^entries/bulk/$', views.EntryBulkCreate.as_view(), name='entry-bulk'),
+    url(r'^entries/stats/$', views.EntryStats.as_view(), name='entry-stats'),
+    url(r'^entries/export/(?P<export_format>csv|ndjson)/$', views.EntryExport.as_view(), name='entry-export'),
     url(r'^entries/(?P<pk>[0-9]+)/$', views.EntryDetail.as_view(), name='entry-detail'),
 ]
\ No newline at end of file
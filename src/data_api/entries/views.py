@@ -5,20 +5,96 @@ Referenced tutorial at: https://codeburst.io/building-an-api-with-django-rest-fr
 @author Will james
 """
 
+from datetime import datetime, time
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
-from entries.models import Entry
-from rest_framework import generics
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from entries.models import Entry, Environment
+from rest_framework import generics, status
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
-from entries.serializers import EntrySerializer
+from entries import export, stats
+from entries.pagination import EntryCursorPagination
+from entries.parsers import NDJSONParser
+from entries.serializers import EntrySerializer, EntryListSerializer, EntryBulkSerializer
 from django.contrib.auth.decorators import login_required
 
+# Query parameters that filter entries on an exact field value
+FIELD_FILTERS = {
+    'model': 'workload_model',
+    'processor': 'processor',
+    'os': 'os_version',
+}
+
+
+def parse_date_filter(name, value, end_of_day=False):
+    """
+    Parses a date or date/time query parameter.
+    :param name: Name of the query parameter
+    :param value: Value of the query parameter, as YYYY-MM-DD or an ISO 8601 date/time
+    :param end_of_day: Whether a plain date means the end of that day instead of the start
+    :return: An aware datetime
+    """
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError
+            parsed = datetime.combine(day, time.max if end_of_day else time.min)
+    except ValueError:
+        raise ValidationError({name: 'Expected a date (YYYY-MM-DD) or an ISO 8601 date/time.'})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def filter_entries(queryset, params):
+    """
+    Filters entries with the query parameters model, processor, os, date_from and date_to.
+    :param queryset: Entries to filter
+    :param params: Query parameters of the request
+    :return: The filtered entries
+    """
+    filters = {field: params[name] for name, field in FIELD_FILTERS.items() if name in params}
+    if 'date_from' in params:
+        filters['date_time__gte'] = parse_date_filter('date_from', params['date_from'])
+    if 'date_to' in params:
+        filters['date_time__lte'] = parse_date_filter('date_to', params['date_to'], end_of_day=True)
+    return queryset.filter(**filters)
+
+
 class EntryList(generics.ListCreateAPIView):
     """
     EntryList class. Uses DjangoRestFramework generics class to create/save a list view of entry data objects.
+    The list is paginated with a cursor, newest entries first, and leaves out the package versions. It can be
+    filtered with the query parameters model, processor, os, date_from and date_to.
     """
     queryset = Entry.objects.all()
     serializer_class = EntrySerializer
+    pagination_class = EntryCursorPagination
+
+    def get_serializer_class(self):
+        """
+        Uses the list serializer, without the package versions, for listing entries.
+        """
+        if self.request.method == 'GET':
+            return EntryListSerializer
+        return EntrySerializer
+
+    def get_queryset(self):
+        """
+        Filters the entries with the query parameters of the request.
+        """
+        queryset = super().get_queryset()
+        if self.request.method != 'GET':
+            return queryset
+        queryset = queryset.select_related('environment').defer('environment__package_versions')
+        return filter_entries(queryset, self.request.query_params)
 
     def perform_create(self, serializer):
         """
@@ -27,6 +103,149 @@ class EntryList(generics.ListCreateAPIView):
         serializer.save()
 
 
+class EntryBulkCreate(generics.GenericAPIView):
+    """
+    EntryBulkCreate class. Creates many entry data objects from one request, sent as a JSON array or as NDJSON with
+    one entry per line. Every row is validated, and the valid ones are saved with a single bulk insert in one
+    transaction. The response has the status of each row, in the order they were sent. Environments are looked up
+    for all the rows at once, and only the ones the server doesn't have yet are created.
+    """
+    serializer_class = EntryBulkSerializer
+    parser_classes = (JSONParser, NDJSONParser)
+
+    # Rows inserted per INSERT statement
+    batch_size = 1000
+
+    def post(self, request, format=None):
+        """
+        Validates and saves the posted entries.
+        :param request: HTTP Request with a list of entries
+        :param format: Option request format
+        :return: HTTP response with the number of created and invalid rows, and the status of each row
+        """
+        rows = request.data
+        if not isinstance(rows, list):
+            raise ParseError('Expected a JSON array or NDJSON of entries.')
+
+        serializer = self.get_serializer()
+        serializer.context['environments'] = Environment.objects.in_bulk(self.get_environment_hashes(rows),
+                                                                         field_name='content_hash')
+        entries = []
+        results = []
+        for index, row in enumerate(rows):
+            try:
+                entries.append(Entry(**serializer.run_validation(row)))
+                results.append({'index': index, 'status': 'created'})
+            except ValidationError as e:
+                results.append({'index': index, 'status': 'invalid', 'errors': e.detail})
+
+        with transaction.atomic():
+            environments = serializer.context['environments']
+            for entry in entries:
+                content_hash = entry.environment.content_hash
+                if content_hash not in environments:
+                    environments[content_hash], new = Environment.objects.get_or_create(
+                        content_hash=content_hash,
+                        defaults={'package_versions': entry.environment.package_versions})
+                entry.environment = environments[content_hash]
+            created = Entry.objects.bulk_create(entries, batch_size=self.batch_size)
+        if created:
+            stats.invalidate()
+
+        # Backends that return the new ids, like PostgreSQL, have them set on the created entries
+        created_results = (result for result in results if result['status'] == 'created')
+        for result, entry in zip(created_results, created):
+            result['id'] = entry.pk
+            result['environment_hash'] = entry.environment.content_hash
+
+        if not entries and rows:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif len(entries) < len(rows):
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response({'created': len(entries), 'invalid': len(rows) - len(entries), 'results': results},
+                        status=response_status)
+
+    def get_environment_hashes(self, rows):
+        """
+        Finds the environments that the rows belong to.
+        :param rows: List of entries sent to the endpoint
+        :return: Set of the rows' environment hashes
+        """
+        hashes = set()
+        for row in rows:
+            if not isinstance(row, dict):
+                continue
+            if isinstance(row.get('package_versions'), str):
+                hashes.add(Environment.hash_package_versions(row['package_versions']))
+            elif isinstance(row.get('environment_hash'), str):
+                hashes.add(row['environment_hash'])
+        return hashes
+
+
+class EntryStats(generics.GenericAPIView):
+    """
+    EntryStats class. Returns the count, mean, min, max, standard deviation and 50th, 90th and 99th percentiles of
+    the runtime for groups of entries. The query parameter group_by is a comma separated list of model, command,
+    processor and os (by default model,processor), and bucket groups by day, week or month as well. Entries can be
+    filtered with the same query parameters as the list. Statistics are cached until entries change.
+    """
+    queryset = Entry.objects.all()
+
+    def get(self, request, format=None):
+        """
+        Retrieves the runtime statistics.
+        :param request: HTTP Request
+        :param format: Option request format
+        :return: HTTP response with the statistics of each group
+        """
+        params = request.query_params
+        group_names = [name.strip() for name in params.get('group_by', 'model,processor').split(',') if name.strip()]
+        unknown = [name for name in group_names if name not in stats.GROUP_FIELDS]
+        if unknown:
+            raise ValidationError({'group_by': 'Unknown field(s) %s, expected %s.' % (
+                ', '.join(unknown), ', '.join(stats.GROUP_FIELDS))})
+        bucket = params.get('bucket')
+        if bucket is not None and bucket not in stats.BUCKETS:
+            raise ValidationError({'bucket': 'Expected one of %s.' % ', '.join(stats.BUCKETS)})
+
+        queryset = filter_entries(self.get_queryset(), params)
+        group_by = [stats.GROUP_FIELDS[name] for name in group_names]
+        cache_key = '&'.join('%s=%s' % item for item in sorted(params.items()))
+        groups = stats.get_stats(queryset, group_by, bucket, cache_key)
+        return Response({'group_by': group_names, 'bucket': bucket, 'results': groups})
+
+
+class EntryExport(generics.GenericAPIView):
+    """
+    EntryExport class. Streams entries as a CSV or NDJSON file, gzip compressed if the query parameter gzip is 1.
+    Entries can be filtered with the same query parameters as the list.
+    """
+    queryset = Entry.objects.all()
+
+    def get(self, request, export_format, format=None):
+        """
+        Retrieves the export file.
+        :param request: HTTP Request
+        :param export_format: Export format, csv or ndjson
+        :param format: Option request format
+        :return: Streaming HTTP response with the exported entries
+        """
+        compress = request.query_params.get('gzip') == '1'
+        queryset = filter_entries(self.get_queryset(), request.query_params)
+        filename = 'entries.%s' % export_format
+        if compress:
+            content_type = 'application/gzip'
+            filename += '.gz'
+        else:
+            content_type = export.FORMATS[export_format][1]
+        response = StreamingHttpResponse(export.export_entries(queryset, export_format, compress),
+                                         content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        return response
+
+
 class EntryDetail(generics.RetrieveUpdateDestroyAPIView):
     """
     EntryDetail class. Uses DjangoRestFramework generics class to retrieve a list entry data objects.
@@ -38,4 +257,4 @@ class EntryDetail(generics.RetrieveUpdateDestroyAPIView):
         Retrieves all of the entry data objects
         :return: All of the entry data objects
         """
-        return Entry.objects.all()
\ No newline at end of file
+        return Entry.objects.select_related('environment')
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+#############
+pinning.py
+#############
+
+******
+About
+******
+
+pinning.py pins workload runs to a set of CPU cores, so that they don't float across every core and NUMA node of
+the machine and compete with the GUI, the data API or each other. CPU sets are written like Linux cpulists, for
+example "0-3,8". A NUMA node is pinned to the cores listed for it in /sys/devices/system/node; memory is then
+allocated on that node by Linux's default first-touch policy. Pinning needs os.sched_setaffinity, which is only
+available on Linux; elsewhere runs are not pinned
+
+**Authors:**
+    Jane Hiltz
+
+    Will James
+
+"""
+
+import os
+
+# Directory where Linux lists the CPU cores of each NUMA node
+NUMA_NODE_DIR = "/sys/devices/system/node"
+
+
+def parse_cpu_list(cpu_list):
+    """
+    Parses a CPU set
+
+    :param cpu_list: a string like "0-3,8", or a list of CPU numbers\n
+    :return: a sorted list of the CPU numbers, raises ValueError if cpu_list isn't a valid CPU set
+    """
+    if isinstance(cpu_list, (list, tuple)):
+        cpus = {int(cpu) for cpu in cpu_list}
+    else:
+        cpus = set()
+        for part in str(cpu_list).split(","):
+            part = part.strip()
+            if not part:
+                continue
+            first, dash, last = part.partition("-")
+            first = int(first)
+            last = int(last) if dash else first
+            if last < first:
+                raise ValueError(f"Invalid CPU set {cpu_list}")
+            cpus.update(range(first, last + 1))
+    if not cpus or min(cpus) < 0:
+        raise ValueError(f"Invalid CPU set {cpu_list}")
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus):
+    """
+    :param cpus: list of CPU numbers\n
+    :return: the CPU set as a string like "0-3,8"
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(f"{first}-{last}" if first != last else f"{first}" for first, last in ranges)
+
+
+def get_numa_node_cpus(numa_node):
+    """
+    :param numa_node: number of a NUMA node\n
+    :return: a sorted list of the node's CPU numbers, raises ValueError if the node doesn't exist
+    """
+    try:
+        with open(os.path.join(NUMA_NODE_DIR, f"node{int(numa_node)}", "cpulist")) as cpulist:
+            return parse_cpu_list(cpulist.read())
+    except OSError:
+        raise ValueError(f"NUMA node {numa_node} doesn't exist")
+
+
+def get_available_cpus():
+    """
+    :return: a sorted list of the CPU numbers this process may run on
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def can_pin():
+    """
+    :return: True if processes can be pinned to CPU cores on this system
+    """
+    return hasattr(os, "sched_setaffinity")
+
+
+def get_preexec_function(cpus):
+    """
+    Returns a function for subprocess.Popen's preexec_fn that pins the new process to CPU cores before it starts, so
+    every thread it creates is pinned as well
+
+    :param cpus: list of CPU numbers, or None to not pin the process\n
+    :return: the function, or None if there is nothing to pin or pinning isn't available
+    """
+    if cpus is None:
+        return None
+    if not can_pin():
+        print("CPU pinning isn't available on this system, the workload runs unpinned")
+        return None
+    cpus = set(cpus)
+    return lambda: os.sched_setaffinity(0, cpus)
@@ -0,0 +1,129 @@
+"""
+#############
+runner.py
+#############
+
+******
+About
+******
+
+runner.py keeps a long-lived TensorFlow worker process (TensorFlow/retrain_worker.py) running,
+so that workloads can be run over and over without paying for Python startup, the Tensorflow
+import and loading the Tensorflow Hub module on every iteration. The worker is pinned to the
+workload's CPU cores, and a new worker is started when they change
+
+**Authors:**
+    Jane Hiltz
+
+    Will James
+
+"""
+
+import atexit
+import json
+import subprocess
+import pinning
+
+# Command that starts the worker, run from the same directory as TensorFlow/retrain.py would be
+WORKER_COMMAND = ["python", "TensorFlow/retrain_worker.py"]
+
+# The worker shared by every workload run from this process
+worker = None
+
+
+class RetrainWorker(object):
+    """
+    A retrain_worker.py process that runs the retrain.py trainings it is sent
+
+    :param cpus: optional list of CPU numbers to pin the worker process to\n
+    :param inter_op_threads: optional number of Tensorflow ops that may run at the same time in the worker. Tensorflow
+        keeps this thread pool for the life of the process, so it can't change between trainings\n
+    """
+
+    def __init__(self, cpus=None, inter_op_threads=None):
+        """
+        Starts the worker process
+        """
+        self.pinning = (tuple(cpus) if cpus is not None else None, inter_op_threads)
+        self.process = subprocess.Popen(WORKER_COMMAND, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        universal_newlines=True, preexec_fn=pinning.get_preexec_function(cpus))
+
+    def is_alive(self):
+        """
+        :return: True if the worker process is still running
+        """
+        return self.process.poll() is None
+
+    def run(self, args):
+        """
+        Runs one training in the worker and waits for it to finish
+
+        :param args: list of command line arguments for retrain.py\n
+        :return: 0 if the training was successful, otherwise a non-zero status\n
+        """
+        try:
+            self.process.stdin.write(json.dumps({"args": args}) + "\n")
+            self.process.stdin.flush()
+            reply = self.process.stdout.readline()
+        except OSError:
+            reply = ""
+
+        if not reply:
+            print("The Tensorflow worker stopped unexpectedly")
+            return 1
+
+        reply = json.loads(reply)
+        if reply["status"] != 0:
+            print(f"Training failed: {reply.get('error', 'see the Tensorflow output')}")
+        return reply["status"]
+
+    def close(self):
+        """
+        Asks the worker to exit and waits for it
+        """
+        if self.is_alive():
+            self.process.stdin.close()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+def get_worker(cpus=None, inter_op_threads=None):
+    """
+    Returns the running worker, starting a new one if there isn't one or if it is pinned differently
+
+    :param cpus: optional list of CPU numbers the worker is pinned to\n
+    :param inter_op_threads: optional number of Tensorflow ops that may run at the same time in the worker\n
+    :return: a RetrainWorker object
+    """
+    global worker
+    if worker is not None and worker.pinning != (tuple(cpus) if cpus is not None else None, inter_op_threads):
+        worker.close()
+        worker = None
+    if worker is None or not worker.is_alive():
+        worker = RetrainWorker(cpus, inter_op_threads)
+    return worker
+
+
+def run_retrain(args, cpus=None, inter_op_threads=None):
+    """
+    Runs retrain.py with the given arguments in the warm worker
+
+    :param args: list of command line arguments for retrain.py\n
+    :param cpus: optional list of CPU numbers the worker is pinned to\n
+    :param inter_op_threads: optional number of Tensorflow ops that may run at the same time in the worker\n
+    :return: 0 if the training was successful, otherwise a non-zero status\n
+    """
+    return get_worker(cpus, inter_op_threads).run(args)
+
+
+def shutdown():
+    """
+    Stops the worker, if one is running
+    """
+    global worker
+    if worker is not None:
+        worker.close()
+        worker = None
+
+
+atexit.register(shutdown)
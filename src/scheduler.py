@@ -0,0 +1,193 @@
+"""
+#############
+scheduler.py
+#############
+
+******
+About
+******
+
+scheduler.py runs the workloads of a suite concurrently in a pool of processes. Each workload says how many CPU
+cores and how much memory it needs, and workloads are started in suite order whenever they fit in what is left of
+the CPU and memory budgets. Workloads that use the same Tensorflow Hub model share a bottleneck cache, so they are
+never run at the same time. An exclusive workload, for runs where timing matters most, waits until nothing else is
+running and nothing else starts until it finishes. When pinning, each workload is given CPU cores of its own, so
+workloads running at the same time never compete for a core
+
+**Authors:**
+    Jane Hiltz
+
+    Will James
+
+"""
+
+import collections
+import psutil
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import pinning
+import runner
+import store
+import uploader
+
+# CPU cores and GB of memory a workload is expected to use, unless its suite entry says otherwise
+DEFAULT_WORKLOAD_CPUS = 1
+DEFAULT_WORKLOAD_MEMORY_GB = 2
+
+# Fraction of the currently available memory used as the memory budget, unless one is given
+MEMORY_BUDGET_FRACTION = 0.8
+
+# A workload to run, with the resources it needs. Jobs with the same conflict key are never run at the same time.
+# A job with a CPU set is pinned to those CPU numbers, instead of being given cores by the scheduler
+Job = collections.namedtuple("Job", ["index", "args", "cpus", "memory_gb", "exclusive", "conflict", "cpu_set"],
+                             defaults=(None,))
+
+
+def get_cpu_budget():
+    """
+    :return: the number of CPU cores this process may run on
+    """
+    return len(pinning.get_available_cpus())
+
+
+def get_memory_budget_gb():
+    """
+    :return: the GB of memory that workloads may use, a fraction of the memory available now
+    """
+    return psutil.virtual_memory().available / 1000000000 * MEMORY_BUDGET_FRACTION
+
+
+def init_worker():
+    """
+    Runs in each new pool process. A forked process gets copies of the parent's Tensorflow worker, uploader and
+    store connection, which belong to the parent, so each pool process starts its own instead. Results are only
+    spooled, and the parent uploads them
+    """
+    runner.worker = None
+    uploader.uploader = None
+    uploader.upload_in_background = False
+    store.backend = None
+
+
+def call_job(function, args, kwargs=None):
+    """
+    Runs a job in a pool process
+
+    :param function: the function that runs the job\n
+    :param args: the arguments to call it with\n
+    :param kwargs: optional keyword arguments to call it with\n
+    :return: the function's result, or 1 if it raised an exception
+    """
+    try:
+        return function(*args, **(kwargs or {}))
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+
+class SuiteScheduler(object):
+    """
+    Runs jobs concurrently in a process pool within CPU and memory budgets
+
+    :param function: function that runs a job, called with the job's args in a pool process\n
+    :param cpu_budget: CPU cores the running jobs may use in total, all the cores this process may use by default\n
+    :param memory_budget_gb: GB of memory the running jobs may use in total, see MEMORY_BUDGET_FRACTION for the default\n
+    :param exclusive: True to run every job on its own, one after another\n
+    :param pin: True to give each job without a CPU set its own CPU cores, passed to the function as the cpu_set
+        keyword argument, like "0-3,8". Ignored where pinning isn't available\n
+    """
+
+    def __init__(self, function, cpu_budget=None, memory_budget_gb=None, exclusive=False, pin=False):
+        """
+        Documented above.
+        """
+        self.function = function
+        self.cpu_budget = cpu_budget or get_cpu_budget()
+        self.memory_budget_gb = memory_budget_gb or get_memory_budget_gb()
+        self.exclusive = exclusive
+        self.pin = pin and pinning.can_pin()
+        # The cores jobs are given when pinning, the first ones of the budget that this process may run on
+        self.cpu_pool = pinning.get_available_cpus()[:self.cpu_budget] if self.pin else []
+        if self.pin:
+            self.cpu_budget = len(self.cpu_pool)
+        self.running = {}
+        # The CPU numbers each running job is pinned to
+        self.pinned = {}
+
+    def needs(self, job):
+        """
+        :param job: a Job\n
+        :return: the CPU cores and GB of memory the job is given, at most the whole budgets so that any job can run
+        """
+        return min(job.cpus, self.cpu_budget), min(job.memory_gb, self.memory_budget_gb)
+
+    def fits(self, job):
+        """
+        :param job: a Job\n
+        :return: True if the job can be started alongside the jobs that are running now
+        """
+        if not self.running:
+            return True
+        if self.exclusive or job.exclusive or any(running.exclusive for running in self.running.values()):
+            return False
+        if job.conflict is not None and any(running.conflict == job.conflict for running in self.running.values()):
+            return False
+        cpus, memory_gb = self.needs(job)
+        used_memory_gb = sum(self.needs(running)[1] for running in self.running.values())
+        if used_memory_gb + memory_gb > self.memory_budget_gb:
+            return False
+        if self.pin:
+            return self.allot(job) is not None
+        used_cpus = sum(self.needs(running)[0] for running in self.running.values())
+        return used_cpus + cpus <= self.cpu_budget
+
+    def allot(self, job):
+        """
+        :param job: a Job\n
+        :return: the CPU numbers to pin the job to, none of which a running job is pinned to, or None if there aren't
+            enough of them free
+        """
+        used = set().union(*self.pinned.values())
+        if job.cpu_set is not None:
+            return None if used.intersection(job.cpu_set) else list(job.cpu_set)
+        free = [cpu for cpu in self.cpu_pool if cpu not in used]
+        cpus = self.needs(job)[0]
+        return free[:cpus] if len(free) >= cpus else None
+
+    def run(self, jobs):
+        """
+        Runs the jobs, starting them in order whenever they fit in the budgets, and waits for all of them to finish
+
+        :param jobs: list of Job objects\n
+        :return: a list of the result of each job, in the order of the jobs
+        """
+        results = [None] * len(jobs)
+        pending = list(jobs)
+        workers = max(1, min(len(jobs), self.cpu_budget))
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            while pending or self.running:
+                for job in list(pending):
+                    if not self.fits(job):
+                        # Nothing is started ahead of an exclusive job that is waiting to run
+                        if job.exclusive:
+                            break
+                        continue
+                    pending.remove(job)
+                    kwargs = {}
+                    if self.pin:
+                        cpus = self.allot(job)
+                        if job.cpu_set is None:
+                            kwargs['cpu_set'] = pinning.format_cpu_list(cpus)
+                    future = executor.submit(call_job, self.function, job.args, kwargs)
+                    self.running[future] = job
+                    if self.pin:
+                        self.pinned[future] = cpus
+
+                done, not_done = wait(self.running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = self.running.pop(future)
+                    self.pinned.pop(future, None)
+                    results[job.index] = future.result()
+                # The finished jobs' results were spooled by the pool process, so they are uploaded from here
+                uploader.get_uploader().notify()
+        return results
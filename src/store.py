@@ -0,0 +1,717 @@
+"""
+#############
+store.py
+#############
+
+******
+About
+******
+
+store.py stores workloads and suites. The backend is chosen with the AIXPRT_STORE environment variable:
+
+- "json" (the default) keeps them in workloads.json and suites.json. The parsed contents of each file, along with
+  objects built from them, are cached and only read and parsed again after the file changes. Whether a file has
+  changed is checked with a single os.stat call, comparing its modification time, size and inode
+- "sqlite" keeps them in a SQLite database in WAL mode (aixprt.db, or the path in AIXPRT_STORE_PATH), indexed by
+  workload and suite name, so each change is a small transaction instead of rewriting a whole file. A new database
+  imports the existing JSON files, and export_json writes it back out in the JSON format
+
+Cached data is shared by every caller, so it is returned as immutable FrozenDict and FrozenList snapshots
+
+**Authors:**
+    Jane Hiltz
+
+    Will James
+
+"""
+
+import abc
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+
+# Files the JSON backend stores workloads and suites in
+WORKLOADS_FILE = "workloads.json"
+SUITES_FILE = "suites.json"
+
+# Environment variable that selects the backend, "json" or "sqlite"
+STORE_ENV = "AIXPRT_STORE"
+
+# Environment variable with the path of the SQLite database, and the path used if it isn't set
+STORE_PATH_ENV = "AIXPRT_STORE_PATH"
+SQLITE_PATH = "aixprt.db"
+
+# The backend shared by everything in this process
+backend = None
+
+
+def _immutable(*args, **kwargs):
+    raise TypeError("Cached data can't be changed, use store.thaw to get a copy that can be")
+
+
+class FrozenDict(dict):
+    """
+    A dictionary that can't be changed. It is still a dict, so it compares equal to and serializes like one
+    """
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+class FrozenList(list):
+    """
+    A list that can't be changed. It is still a list, so it compares equal to and serializes like one
+    """
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = clear = extend = insert = pop = remove = reverse = sort = _immutable
+
+    def __reduce__(self):
+        return (FrozenList, (list(self),))
+
+
+def freeze(value):
+    """
+    :param value: parsed JSON data\n
+    :return: the data with every dictionary and list replaced by a FrozenDict or FrozenList
+    """
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """
+    :param value: data returned by the store\n
+    :return: a copy of the data with plain dictionaries and lists, which can be changed
+    """
+    if isinstance(value, dict):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [thaw(item) for item in value]
+    return value
+
+
+class FileCache(object):
+    """
+    Cache of parsed JSON files, and of objects built from them, that are kept until the file changes
+    """
+
+    def __init__(self):
+        """
+        Documented above.
+        """
+        self.lock = threading.Lock()
+        # Path -> (stat signature, parsed data, {name: built object})
+        self.entries = {}
+
+    def get_entry(self, path):
+        """
+        Returns the cache entry of a file, reading it again if it has changed since it was cached
+
+        :param path: path to the JSON file\n
+        :return: the file's (stat signature, parsed data, built objects) entry
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == signature:
+                return entry
+        with open(path) as json_file:
+            data = freeze(json.load(json_file))
+        entry = (signature, data, {})
+        with self.lock:
+            self.entries[path] = entry
+        return entry
+
+    def load_json(self, path):
+        """
+        :param path: path to the JSON file\n
+        :return: the file's parsed contents, as an immutable snapshot
+        """
+        return self.get_entry(path)[1]
+
+    def get_derived(self, path, name, build):
+        """
+        Returns an object built from a file's contents, only building it again after the file changes
+
+        :param path: path to the JSON file\n
+        :param name: name the object is cached under\n
+        :param build: function that builds the object from the file's parsed contents\n
+        :return: the built object
+        """
+        signature, data, derived = self.get_entry(path)
+        if name not in derived:
+            derived[name] = build(data)
+        return derived[name]
+
+    def invalidate(self, path=None):
+        """
+        Forgets a cached file, or every cached file
+
+        :param path: path to the JSON file, or None for all of them\n
+        """
+        with self.lock:
+            if path is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(os.path.abspath(path), None)
+
+
+# The cache shared by everything in this process
+cache = FileCache()
+
+
+def load_json(path):
+    """
+    :param path: path to the JSON file\n
+    :return: the file's parsed contents, as an immutable snapshot
+    """
+    return cache.load_json(path)
+
+
+def get_derived(path, name, build):
+    """
+    Returns an object built from a file's contents, only building it again after the file changes
+
+    :param path: path to the JSON file\n
+    :param name: name the object is cached under\n
+    :param build: function that builds the object from the file's parsed contents\n
+    :return: the built object
+    """
+    return cache.get_derived(path, name, build)
+
+
+def write_json(path, data):
+    """
+    Replaces a JSON file with new data. The data is written to a temporary file that is then renamed over the old
+    one, so the file is never left half written
+
+    :param path: path to the JSON file\n
+    :param data: data to write\n
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, 'w') as json_file:
+            json.dump(data, json_file, indent=4)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    cache.invalidate(path)
+
+
+class StoreBackend(abc.ABC):
+    """
+    Storage of workloads and suites. Workloads are dictionaries with the keys of a workloads.json entry, and
+    suites are lists of dictionaries with the name and iterations of each workload in them. Backends must implement
+    every method, or they can't be created
+    """
+
+    @abc.abstractmethod
+    def has_workloads(self):
+        """
+        :return: True if workloads have been stored
+        """
+
+    @abc.abstractmethod
+    def load_workloads(self):
+        """
+        :return: An immutable dictionary with the key workloads, a list of every workload
+        """
+
+    @abc.abstractmethod
+    def get_derived_workloads(self, build):
+        """
+        Returns an object built from the workloads, only building it again after they change
+
+        :param build: function that builds the object from the result of load_workloads\n
+        :return: the built object
+        """
+
+    @abc.abstractmethod
+    def add_workload(self, workload):
+        """
+        :param workload: dictionary of the new workload\n
+        :return: False if a workload with the same name already exists, otherwise True
+        """
+
+    @abc.abstractmethod
+    def update_workload(self, original_name, workload):
+        """
+        :param original_name: name of the workload being changed\n
+        :param workload: dictionary of the changed workload, which replaces the stored one, so keys left out of it
+            are removed\n
+        :return: False if the workload was renamed to the name of another workload, otherwise True
+        """
+
+    @abc.abstractmethod
+    def remove_workload(self, workload_name, cascade=False):
+        """
+        :param workload_name: name of the workload to remove\n
+        :param cascade: True to also remove the workload from every suite it is in, in the same change\n
+        :return: the removed workload, or None if there is no workload with that name
+        """
+
+    @abc.abstractmethod
+    def load_suites(self):
+        """
+        :return: An immutable dictionary of every suite by name
+        """
+
+    @abc.abstractmethod
+    def add_suite(self, suite_name, workloads):
+        """
+        :param suite_name: name of the new suite\n
+        :param workloads: list of the workloads in the suite\n
+        :return: False if a suite with the same name already exists, otherwise True
+        """
+
+    @abc.abstractmethod
+    def replace_suite(self, original_name, suite_name, workloads):
+        """
+        Replaces a suite, and any other suite with its new name
+
+        :param original_name: name of the suite being replaced\n
+        :param suite_name: new name of the suite\n
+        :param workloads: list of the workloads in the suite\n
+        :return: False if there is no suite with the original name, otherwise True
+        """
+
+    @abc.abstractmethod
+    def remove_suite(self, suite_name):
+        """
+        :param suite_name: name of the suite to remove\n
+        :return: the removed suite's workloads, raises KeyError if there is no suite with that name
+        """
+
+    @abc.abstractmethod
+    def set_suite_workload_iterations(self, suite_name, workload_index, iterations):
+        """
+        :param suite_name: name of the suite\n
+        :param workload_index: index of the workload in the suite\n
+        :param iterations: iterations the workload should run\n
+        """
+
+    @abc.abstractmethod
+    def remove_suite_workload(self, suite_name, workload_index):
+        """
+        :param suite_name: name of the suite\n
+        :param workload_index: index of the workload in the suite\n
+        :return: the removed workload
+        """
+
+    @abc.abstractmethod
+    def find_suite_workloads(self, workload_name):
+        """
+        :param workload_name: name of a workload\n
+        :return: A list of (suite name, index) pairs of every place the workload is in a suite, in suite order
+        """
+
+    @abc.abstractmethod
+    def remove_workload_from_suites(self, workload_name):
+        """
+        Removes a workload from every suite it is in, all in one change
+
+        :param workload_name: name of the workload\n
+        :return: how many times the workload was removed
+        """
+
+
+class JSONBackend(StoreBackend):
+    """
+    Stores workloads and suites in JSON files, rewriting a whole file on every change
+
+    :param workloads_path: path to the workloads file\n
+    :param suites_path: path to the suites file\n
+    """
+
+    def __init__(self, workloads_path=WORKLOADS_FILE, suites_path=SUITES_FILE):
+        """
+        Documented above.
+        """
+        self.workloads_path = workloads_path
+        self.suites_path = suites_path
+        self.lock = threading.RLock()
+
+    def has_workloads(self):
+        return os.path.isfile(self.workloads_path)
+
+    def load_workloads(self):
+        return load_json(self.workloads_path)
+
+    def get_derived_workloads(self, build):
+        return get_derived(self.workloads_path, "workloads", build)
+
+    def add_workload(self, workload):
+        with self.lock:
+            data = thaw(self.load_workloads()) if self.has_workloads() else {'workloads': []}
+            if any(x['name'] == workload['name'] for x in data['workloads']):
+                return False
+            data['workloads'].append(workload)
+            write_json(self.workloads_path, data)
+        return True
+
+    def update_workload(self, original_name, workload):
+        with self.lock:
+            data = thaw(self.load_workloads())
+            if workload['name'] != original_name and any(x['name'] == workload['name'] for x in data['workloads']):
+                return False
+            data['workloads'] = [workload if x['name'] == original_name else x for x in data['workloads']]
+            write_json(self.workloads_path, data)
+        return True
+
+    def remove_workload(self, workload_name, cascade=False):
+        with self.lock:
+            data = thaw(self.load_workloads())
+            for index, x in enumerate(data['workloads']):
+                if x['name'] == workload_name:
+                    removed = data['workloads'].pop(index)
+                    if cascade:
+                        # The two files can't change together, so the suites are written first. If the workloads file
+                        # isn't written after them, the workload is left in no suite rather than suites referring to
+                        # a workload that doesn't exist
+                        self.remove_workload_from_suites(workload_name)
+                    write_json(self.workloads_path, data)
+                    return removed
+        return None
+
+    def load_suites(self):
+        if not os.path.isfile(self.suites_path):
+            print(f"{self.suites_path} does not exist")
+            return FrozenDict()
+        return load_json(self.suites_path)
+
+    def add_suite(self, suite_name, workloads):
+        with self.lock:
+            suites_dict = thaw(self.load_suites())
+            if suite_name in suites_dict:
+                return False
+            suites_dict[suite_name] = workloads
+            write_json(self.suites_path, suites_dict)
+        return True
+
+    def replace_suite(self, original_name, suite_name, workloads):
+        with self.lock:
+            suites_dict = thaw(self.load_suites())
+            if original_name not in suites_dict:
+                return False
+            suites_dict.pop(original_name)
+            suites_dict.pop(suite_name, None)
+            suites_dict[suite_name] = workloads
+            write_json(self.suites_path, suites_dict)
+        return True
+
+    def remove_suite(self, suite_name):
+        with self.lock:
+            suites_dict = thaw(self.load_suites())
+            removed = suites_dict.pop(suite_name)
+            write_json(self.suites_path, suites_dict)
+        return removed
+
+    def set_suite_workload_iterations(self, suite_name, workload_index, iterations):
+        with self.lock:
+            suites_dict = thaw(self.load_suites())
+            suites_dict[suite_name][workload_index]['iterations'] = iterations
+            write_json(self.suites_path, suites_dict)
+
+    def remove_suite_workload(self, suite_name, workload_index):
+        with self.lock:
+            suites_dict = thaw(self.load_suites())
+            removed = suites_dict[suite_name].pop(workload_index)
+            write_json(self.suites_path, suites_dict)
+        return removed
+
+    def find_suite_workloads(self, workload_name):
+        if not os.path.isfile(self.suites_path):
+            return FrozenList()
+        # The index is only built again after suites.json changes
+        return get_derived(self.suites_path, "suite index", build_suite_index).get(workload_name, FrozenList())
+
+    def remove_workload_from_suites(self, workload_name):
+        with self.lock:
+            if not self.find_suite_workloads(workload_name):
+                return 0
+            suites_dict = thaw(self.load_suites())
+            removed = 0
+            for suite_name, workloads in suites_dict.items():
+                kept = [workload for workload in workloads if workload['name'] != workload_name]
+                removed += len(workloads) - len(kept)
+                suites_dict[suite_name] = kept
+            write_json(self.suites_path, suites_dict)
+        return removed
+
+
+class SQLiteBackend(StoreBackend):
+    """
+    Stores workloads and suites in a SQLite database in WAL mode. Workloads and the workloads of suites are rows
+    indexed by name, so each change only touches the rows it changes, in one transaction
+
+    :param path: path to the database\n
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        """
+        Documented above.
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.database = sqlite3.connect(path, check_same_thread=False)
+        # Changes made through this connection, which PRAGMA data_version doesn't count
+        self.writes = 0
+        # Name -> (version, cached value)
+        self.cache = {}
+        with self.lock, self.database:
+            self.database.execute("PRAGMA journal_mode=WAL")
+            self.database.execute("CREATE TABLE IF NOT EXISTS workloads (position INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                  "name TEXT NOT NULL UNIQUE, workload TEXT NOT NULL)")
+            self.database.execute("CREATE TABLE IF NOT EXISTS suites (position INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                  "name TEXT NOT NULL UNIQUE)")
+            self.database.execute("CREATE TABLE IF NOT EXISTS suite_workloads (suite TEXT NOT NULL, "
+                                  "position INTEGER NOT NULL, name TEXT NOT NULL, workload TEXT NOT NULL)")
+            self.database.execute("CREATE INDEX IF NOT EXISTS suite_workloads_suite "
+                                  "ON suite_workloads (suite, position)")
+            self.database.execute("CREATE INDEX IF NOT EXISTS suite_workloads_name ON suite_workloads (name)")
+
+    def version(self):
+        """
+        :return: a value that changes whenever this or another connection changes the database
+        """
+        return self.database.execute("PRAGMA data_version").fetchone()[0], self.writes
+
+    def cached(self, name, build):
+        """
+        Returns a cached value, building it again if the database has changed since it was cached
+
+        :param name: name the value is cached under\n
+        :param build: function that builds the value\n
+        :return: the value
+        """
+        with self.lock:
+            version = self.version()
+            entry = self.cache.get(name)
+            if entry is None or entry[0] != version:
+                entry = (version, build())
+                self.cache[name] = entry
+            return entry[1]
+
+    def write(self, *statements):
+        """
+        Runs statements in one transaction
+
+        :param statements: (sql, parameters) pairs\n
+        :return: the cursor of each statement
+        """
+        with self.lock, self.database:
+            self.writes += 1
+            return [self.database.execute(sql, parameters) for sql, parameters in statements]
+
+    def has_workloads(self):
+        return True
+
+    def load_workloads(self):
+        def build():
+            rows = self.database.execute("SELECT workload FROM workloads ORDER BY position")
+            return freeze({'workloads': [json.loads(workload) for workload, in rows]})
+        return self.cached("workloads", build)
+
+    def get_derived_workloads(self, build):
+        return self.cached("derived workloads", lambda: build(self.load_workloads()))
+
+    def add_workload(self, workload):
+        try:
+            self.write(("INSERT INTO workloads (name, workload) VALUES (?, ?)",
+                        (workload['name'], json.dumps(workload))))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def update_workload(self, original_name, workload):
+        with self.lock:
+            row = self.database.execute("SELECT workload FROM workloads WHERE name = ?", (original_name,)).fetchone()
+            if row is None:
+                return True
+            try:
+                self.write(("UPDATE workloads SET name = ?, workload = ? WHERE name = ?",
+                            (workload['name'], json.dumps(workload), original_name)))
+            except sqlite3.IntegrityError:
+                return False
+        return True
+
+    def remove_workload(self, workload_name, cascade=False):
+        with self.lock:
+            row = self.database.execute("SELECT workload FROM workloads WHERE name = ?", (workload_name,)).fetchone()
+            if row is None:
+                return None
+            statements = [("DELETE FROM workloads WHERE name = ?", (workload_name,))]
+            if cascade:
+                statements += self.suite_removal_statements(workload_name)
+            self.write(*statements)
+        return json.loads(row[0])
+
+    def load_suites(self):
+        def build():
+            suites_dict = {}
+            rows = self.database.execute("SELECT suites.name, suite_workloads.workload FROM suites "
+                                         "LEFT JOIN suite_workloads ON suite_workloads.suite = suites.name "
+                                         "ORDER BY suites.position, suite_workloads.position")
+            for suite_name, workload in rows:
+                workloads = suites_dict.setdefault(suite_name, [])
+                if workload is not None:
+                    workloads.append(json.loads(workload))
+            return freeze(suites_dict)
+        return self.cached("suites", build)
+
+    def suite_workload_rows(self, suite_name, workloads):
+        """
+        :param suite_name: name of a suite\n
+        :param workloads: list of the workloads in the suite\n
+        :return: the statements that insert the workloads of the suite
+        """
+        return [("INSERT INTO suite_workloads (suite, position, name, workload) VALUES (?, ?, ?, ?)",
+                 (suite_name, index, workload['name'], json.dumps(workload)))
+                for index, workload in enumerate(workloads)]
+
+    def add_suite(self, suite_name, workloads):
+        with self.lock:
+            if self.database.execute("SELECT 1 FROM suites WHERE name = ?", (suite_name,)).fetchone():
+                return False
+            self.write(("INSERT INTO suites (name) VALUES (?)", (suite_name,)),
+                       *self.suite_workload_rows(suite_name, workloads))
+        return True
+
+    def replace_suite(self, original_name, suite_name, workloads):
+        with self.lock:
+            if not self.database.execute("SELECT 1 FROM suites WHERE name = ?", (original_name,)).fetchone():
+                return False
+            names = (original_name, suite_name)
+            self.write(("DELETE FROM suites WHERE name IN (?, ?)", names),
+                       ("DELETE FROM suite_workloads WHERE suite IN (?, ?)", names),
+                       ("INSERT INTO suites (name) VALUES (?)", (suite_name,)),
+                       *self.suite_workload_rows(suite_name, workloads))
+        return True
+
+    def remove_suite(self, suite_name):
+        with self.lock:
+            removed = self.load_suites()[suite_name]
+            self.write(("DELETE FROM suites WHERE name = ?", (suite_name,)),
+                       ("DELETE FROM suite_workloads WHERE suite = ?", (suite_name,)))
+        return thaw(removed)
+
+    def set_suite_workload_iterations(self, suite_name, workload_index, iterations):
+        with self.lock:
+            workload = thaw(self.load_suites()[suite_name][workload_index])
+            workload['iterations'] = iterations
+            self.write(("UPDATE suite_workloads SET workload = ? WHERE suite = ? AND position = ?",
+                        (json.dumps(workload), suite_name, workload_index)))
+
+    def remove_suite_workload(self, suite_name, workload_index):
+        with self.lock:
+            removed = thaw(self.load_suites()[suite_name][workload_index])
+            self.write(("DELETE FROM suite_workloads WHERE suite = ? AND position = ?", (suite_name, workload_index)),
+                       ("UPDATE suite_workloads SET position = position - 1 WHERE suite = ? AND position > ?",
+                        (suite_name, workload_index)))
+        return removed
+
+    def find_suite_workloads(self, workload_name):
+        rows = self.database.execute("SELECT suite_workloads.suite, suite_workloads.position FROM suite_workloads "
+                                     "JOIN suites ON suites.name = suite_workloads.suite "
+                                     "WHERE suite_workloads.name = ? "
+                                     "ORDER BY suites.position, suite_workloads.position", (workload_name,))
+        return FrozenList(tuple(row) for row in rows)
+
+    def remove_workload_from_suites(self, workload_name):
+        with self.lock:
+            statements = self.suite_removal_statements(workload_name)
+            if not statements:
+                return 0
+            deleted, renumbered = self.write(*statements)
+        return deleted.rowcount
+
+    def suite_removal_statements(self, workload_name):
+        """
+        :param workload_name: name of a workload\n
+        :return: the statements that remove the workload from every suite it is in, none if it isn't in a suite
+        """
+        suite_names = {suite_name for suite_name, index in self.find_suite_workloads(workload_name)}
+        if not suite_names:
+            return []
+        placeholders = ", ".join("?" * len(suite_names))
+        # The positions left in each suite are numbered from 0 again, counting the rows before each one
+        return [("DELETE FROM suite_workloads WHERE name = ?", (workload_name,)),
+                ("UPDATE suite_workloads SET position = (SELECT COUNT(*) FROM suite_workloads AS earlier "
+                 "WHERE earlier.suite = suite_workloads.suite AND earlier.position < suite_workloads.position) "
+                 f"WHERE suite IN ({placeholders})", tuple(suite_names))]
+
+
+def build_suite_index(suites_dict):
+    """
+    Builds the reverse index of the workloads in suites
+
+    :param suites_dict: dictionary of every suite by name\n
+    :return: An immutable dictionary of the (suite name, index) pairs of each workload, by workload name
+    """
+    index = {}
+    for suite_name, workloads in suites_dict.items():
+        for workload_index, workload in enumerate(workloads):
+            index.setdefault(workload['name'], []).append((suite_name, workload_index))
+    return FrozenDict((name, FrozenList(places)) for name, places in index.items())
+
+
+def import_json(target, workloads_path=WORKLOADS_FILE, suites_path=SUITES_FILE):
+    """
+    Copies the workloads and suites in JSON files into a backend
+
+    :param target: the backend to copy them into\n
+    :param workloads_path: path to the workloads file\n
+    :param suites_path: path to the suites file\n
+    """
+    source = JSONBackend(workloads_path, suites_path)
+    if source.has_workloads():
+        for workload in source.load_workloads()['workloads']:
+            if not target.add_workload(thaw(workload)):
+                print(f"Workload {workload['name']} already exists.")
+    for suite_name, workloads in source.load_suites().items():
+        if not target.add_suite(suite_name, thaw(workloads)):
+            print(f"A suite named {suite_name} already exists")
+
+
+def export_json(source, workloads_path=WORKLOADS_FILE, suites_path=SUITES_FILE):
+    """
+    Writes the workloads and suites in a backend to JSON files, in the format the JSON backend uses
+
+    :param source: the backend to copy them from\n
+    :param workloads_path: path to the workloads file\n
+    :param suites_path: path to the suites file\n
+    """
+    write_json(workloads_path, thaw(source.load_workloads()))
+    write_json(suites_path, thaw(source.load_suites()))
+
+
+def get_backend():
+    """
+    Returns the backend selected by the AIXPRT_STORE environment variable, creating it if it hasn't been yet
+
+    :return: a StoreBackend object
+    """
+    global backend
+    if backend is None:
+        kind = os.environ.get(STORE_ENV, "json")
+        if kind == "json":
+            backend = JSONBackend()
+        elif kind == "sqlite":
+            path = os.environ.get(STORE_PATH_ENV, SQLITE_PATH)
+            is_new = not os.path.isfile(path)
+            backend = SQLiteBackend(path)
+            if is_new:
+                import_json(backend)
+        else:
+            raise ValueError(f"Unknown {STORE_ENV} {kind}, expected json or sqlite")
+    return backend
@@ -9,8 +9,30 @@ import datetime
 import json
 from pathlib import Path
 import aixprt
+import uploader
+import workload
 from workload import Workload
 
+# Packages listed by the stand-in for conda list --json
+CONDA_PACKAGES = [{'name': "python", 'version': "3.7.1"}, {'name': "tensorflow", 'version': "1.12.0"}]
+
+
+def conda_list(args, **kwargs):
+    return subprocess.CompletedProcess(args, 0, stdout=json.dumps(CONDA_PACKAGES))
+
+
+@pytest.fixture(autouse=True)
+def runtime_files(tmp_path, monkeypatch):
+    # Files written while workloads run are kept out of the working directory, and conda isn't run
+    monkeypatch.setattr(aixprt, "FINGERPRINT_DIR", str(tmp_path / "fingerprints"))
+    monkeypatch.setattr(aixprt, "RUN_LOG", str(tmp_path / "runs.jsonl"))
+    monkeypatch.setattr(aixprt, "fingerprint_cache", None)
+    monkeypatch.setattr(aixprt, "run_statistics", None)
+    monkeypatch.setattr(aixprt.subprocess, "run", conda_list)
+    monkeypatch.setattr(uploader, "SPOOL_PATH", str(tmp_path / "upload_spool.db"))
+    monkeypatch.setattr(uploader, "upload_in_background", False)
+    monkeypatch.setattr(uploader, "uploader", None)
+
 # Setup and Teardown
 def setup():
     # Setting up workloads.json for testing
@@ -24,10 +46,6 @@ def setup():
         os.system('move suites.json backup_suites.json')
         os.system('copy tests\\test_suites.json test_backup_suites.json')
         os.system('move tests\\test_suites.json suites.json')
-        # For Statistics
-        os.system('move statistics.json backup_statistics.json')
-        os.system('copy tests\\test_statistics.json test_backup_statistics.json')
-        os.system('move tests\\test_statistics.json statistics.json')
     if platform.system() == "Linux":
         print("im on linux")
         # For Workloads
@@ -38,10 +56,6 @@ def setup():
         os.system('mv suites.json backup_suites.json')
         os.system('cp tests/test_suites.json test_backup_suites.json')
         os.system('mv tests/test_suites.json suites.json')
-        # For Statistics
-        os.system('mv statistics.json backup_statistics.json')
-        os.system('cp tests/test_statistics.json test_backup_statistics.json')
-        os.system('mv tests/test_statistics.json statistics.json')
     
     print("Setup!")
 
@@ -55,9 +69,6 @@ def teardown():
         # For Suites
         os.system('move test_backup_suites.json tests\\test_suites.json')
         os.system('move backup_suites.json suites.json')   
-        # For Statistics
-        os.system('move test_backup_statistics.json tests\\test_statistics.json')
-        os.system('move backup_statistics.json statistics.json')
         # For output files
         os.system('del tests\\test_results\\2009-10-13_3-2-1')
     if platform.system() == "Linux":
@@ -68,9 +79,6 @@ def teardown():
         # For Suites
         os.system('mv test_backup_suites.json tests/test_suites.json')
         os.system('mv backup_suites.json suites.json')
-        # For Statistics
-        os.system('mv test_backup_statistics.json tests/test_statistics.json')
-        os.system('mv backup_statistics.json statistics.json')
         # For output files
         os.system('rm tests/test_results/2009-10-13_3-2-1')   
     print("Teardown!") 
@@ -110,7 +118,31 @@ def test_record_data():
     assert file_1_list[10] == "Comments: This is a test\n"
     assert file_1_list[11] == "Command Line: python TensorFlow/retrain.py --image_dir ../../flower_photos --how_many_training_steps 10 --learning_rate 0.01 --testing_percentage 10 --validation_percentage 10 --eval_step_interval 10 --train_batch_size 100 --test_batch_size -1 --validation_batch_size 100 --tfhub_module https://tfhub.dev/google/imagenet/inception_v3/feature_vector/1\n"
 
-def test_record_workload():
+def test_get_fingerprint():
+    # Collect the fingerprint
+    fingerprint_1 = aixprt.get_fingerprint()
+    for key in ['id', 'processor', 'memory', 'os_version', 'disk_storage', 'package_versions']:
+        assert key in fingerprint_1
+    # Ensure it was stored under its id
+    assert Path(f"{aixprt.FINGERPRINT_DIR}/{fingerprint_1['id']}.json").is_file()
+    # Ensure a new session reuses the stored fingerprint while the environment is unchanged
+    aixprt.fingerprint_cache = None
+    fingerprint_2 = aixprt.get_fingerprint()
+    assert fingerprint_1 == fingerprint_2
+    assert fingerprint_1['package_versions'] == "python 3.7.1, tensorflow 1.12.0"
+
+
+def test_get_fingerprint_conda_failed(monkeypatch):
+    # A failed conda list isn't cached as the environment's fingerprint
+    monkeypatch.setattr(aixprt.subprocess, "run", lambda args, **kwargs: subprocess.CompletedProcess(args, 1, stdout=""))
+    assert aixprt.get_fingerprint()['package_versions'] == "Not Available"
+    assert not Path(aixprt.FINGERPRINT_DIR).exists()
+    monkeypatch.setattr(aixprt.subprocess, "run", conda_list)
+    assert aixprt.get_fingerprint()['package_versions'] == "python 3.7.1, tensorflow 1.12.0"
+
+def test_record_workload(tmp_path, monkeypatch):
+    # Record runs to a new run log
+    monkeypatch.setattr(aixprt, "RUN_LOG", str(tmp_path / "runs.jsonl"))
     # data for tests
     workload_name = "test_workload1"
     runtime = 123456789
@@ -119,47 +151,32 @@ def test_record_workload():
     # Record the test workload
     aixprt.record_workload(workload_name, runtime, start_time_1)
 
-    # Ensure Statistics file is created
-    file_path = Path("statistics.json")
+    # Ensure the run log is created
+    file_path = Path(aixprt.RUN_LOG)
     assert file_path.is_file()
 
-    # Read in statistics data
-    test_data = {}
-    if file_path.is_file():
-        with open('statistics.json') as json_file:
-            test_data = json.load(json_file)
-            json_file.close()
-
-    # Test Statistics data is accurate
-    assert test_data['workload_count'] == 1
-    assert test_data['total_workload_runtime'] == 123456790
-    assert test_data['longest_workload_runtime'] == 123456789
-    assert test_data['shortest_workload_runtime'] == 123456789
-    assert len(test_data['recent_workloads']) == 1
-    assert test_data['recent_workloads'][0]['name'] == workload_name
-    assert test_data['recent_workloads'][0]['runtime'] == runtime
-    assert test_data['recent_workloads'][0]['date/time'] == "10/13/2009 3:2:1"
-
-    # Test no more than nine recent workloads are recorded at one time
-    aixprt.record_workload(workload_name, runtime, start_time_1)
-    aixprt.record_workload(workload_name, runtime, start_time_1)
-    aixprt.record_workload(workload_name, runtime, start_time_1)
-    aixprt.record_workload(workload_name, runtime, start_time_1)
-    aixprt.record_workload(workload_name, runtime, start_time_1)
-    aixprt.record_workload(workload_name, runtime, start_time_1)
-    aixprt.record_workload(workload_name, runtime, start_time_1)
-    aixprt.record_workload(workload_name, runtime, start_time_1)
-    aixprt.record_workload(workload_name, runtime, start_time_1)
-    aixprt.record_workload(workload_name, runtime, start_time_1)
+    # Read in the run log
+    with open(aixprt.RUN_LOG) as run_log:
+        test_runs = [json.loads(line) for line in run_log]
+
+    # Test the run is accurate
+    assert len(test_runs) == 1
+    assert test_runs[0]['name'] == workload_name
+    assert test_runs[0]['runtime'] == runtime
+    assert test_runs[0]['date/time'] == "10/13/2009 3:2:1"
+
+    # Test every run is appended to the log
+    for i in range(10):
+        aixprt.record_workload(workload_name, runtime, start_time_1)
 
-    if file_path.is_file():
-        with open('statistics.json') as json_file:
-            test_data = json.load(json_file)
-            json_file.close()
+    with open(aixprt.RUN_LOG) as run_log:
+        test_runs = [json.loads(line) for line in run_log]
 
-    assert len(test_data['recent_workloads']) == 10
+    assert len(test_runs) == 11
 
-def test_get_statistics():
+def test_get_statistics(tmp_path, monkeypatch):
+    # Record runs to a new run log
+    monkeypatch.setattr(aixprt, "RUN_LOG", str(tmp_path / "runs.jsonl"))
     # data for tests
     workload_name = "test_workload1"
     runtime = 123456789
@@ -170,8 +187,8 @@ def test_get_statistics():
 
     # Test statistcs data is accurate when zero workloads have been recorded
     assert test_stats['average_workload_runtime'] == "Not Available"
-    assert test_stats['longest_workload_runtime'] == 0
-    assert test_stats['shortest_workload_runtime'] == 999999999999999
+    assert test_stats['longest_workload_runtime'] == "Not Available"
+    assert test_stats['shortest_workload_runtime'] == "Not Available"
     assert len(test_stats['recent_workloads']) == 0
 
     # Record one test workload and get the new statistics data
@@ -179,7 +196,7 @@ def test_get_statistics():
     test_stats = aixprt.get_statistics()
 
     # Test that the statistics data is accurate
-    assert test_stats['average_workload_runtime'] == 123456790
+    assert test_stats['average_workload_runtime'] == 123456789
     assert test_stats['longest_workload_runtime'] == 123456789
     assert test_stats['shortest_workload_runtime'] == 123456789
     assert len(test_stats['recent_workloads']) == 1
@@ -187,6 +204,32 @@ def test_get_statistics():
     assert test_stats['recent_workloads'][0]['runtime'] == runtime
     assert test_stats['recent_workloads'][0]['date/time'] == "10/13/2009 3:2:1"
 
+    # Record more runs and test the per-workload statistics and that only the ten most recent are shown
+    for i in range(1, 11):
+        aixprt.record_workload(workload_name, runtime + i, start_time_1)
+    test_stats = aixprt.get_statistics()
+
+    assert len(test_stats['recent_workloads']) == 10
+    assert test_stats['recent_workloads'][-1]['runtime'] == runtime + 10
+    assert test_stats['workloads'][workload_name]['count'] == 11
+    assert test_stats['workloads'][workload_name]['p50_runtime'] == runtime + 5
+    assert test_stats['workloads'][workload_name]['longest_runtime'] == runtime + 10
+
+
+def test_runtime_summary(monkeypatch):
+    # The summary keeps a bounded sample, while the count, mean, spread and extremes stay exact
+    monkeypatch.setattr(aixprt, "RUNTIME_SAMPLE_SIZE", 100)
+    summary = aixprt.RuntimeSummary("test_workload1")
+    for runtime in range(1, 1001):
+        summary.add(runtime)
+    stats = summary.statistics()
+    assert len(summary.sample) == 100
+    assert stats['count'] == 1000
+    assert stats['average_runtime'] == 500.5
+    assert abs(stats['stddev_runtime'] - 288.67499) < 0.001
+    assert stats['shortest_runtime'] == 1 and stats['longest_runtime'] == 1000
+    assert 300 < stats['p50_runtime'] < 700
+
 ###########################
 ##### Workload Tests ######
 ###########################
@@ -209,6 +252,27 @@ def test_run_workload():
     pass
 
 
+def test_run_workload_timing(tmp_path, monkeypatch):
+    # retrain.py is stood in for by writing the timings it would write
+    def call(args, **kwargs):
+        with open(args[args.index("--timing_output") + 1], 'w') as timing_file:
+            json.dump({'total': 1.0}, timing_file)
+        return 0
+    recorded = []
+    wl = Workload("WL", "", 'https://tfhub.dev/google/imagenet/inception_v3/feature_vector/1', "10", "0.02", "10", "20", "10", "100", "-1", "100", "False", "0", "0", "0", "")
+    wl.validate_parameters()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(aixprt, "get_workloads", lambda: {"WL": wl})
+    monkeypatch.setattr(workload.subprocess, "call", call)
+    monkeypatch.setattr(aixprt, "record_data", lambda *args: recorded.append(args))
+    assert aixprt.run_workload(2, "WL", run_mode="startup") == 0
+
+    # Every run records the same command and its own timings, and no timing file is left behind
+    assert recorded[0][2][2] == recorded[1][2][2] and "timing" not in recorded[0][2][2]
+    assert recorded[0][5] == recorded[1][5] == {'total': 1.0}
+    assert list(tmp_path.iterdir()) == []
+
+
 def test_load_workloads():
     # Workloads.json copy to test against 
     test_WL_dict = {
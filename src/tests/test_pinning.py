@@ -0,0 +1,40 @@
+"""
+Tests the functionality of pinning.py
+"""
+
+import pytest
+import pinning
+
+
+def test_parse_cpu_list():
+    assert pinning.parse_cpu_list("0-3,8") == [0, 1, 2, 3, 8]
+    assert pinning.parse_cpu_list(" 5, 2-3 ,2\n") == [2, 3, 5]
+    assert pinning.parse_cpu_list([3, "1", 1]) == [1, 3]
+    for cpu_list in ("", "a", "3-1", "-1", "0-", "1,,x", []):
+        with pytest.raises(ValueError):
+            pinning.parse_cpu_list(cpu_list)
+
+
+def test_format_cpu_list():
+    assert pinning.format_cpu_list([8, 0, 1, 2, 3]) == "0-3,8"
+    assert pinning.format_cpu_list([1, 3, 5]) == "1,3,5"
+    assert pinning.format_cpu_list([4]) == "4"
+    assert pinning.parse_cpu_list(pinning.format_cpu_list([0, 2, 3, 4, 9])) == [0, 2, 3, 4, 9]
+
+
+def test_get_numa_node_cpus(tmp_path, monkeypatch):
+    # A machine with two NUMA nodes of two cores each
+    for node, cpulist in enumerate(["0-1", "2-3"]):
+        (tmp_path / f"node{node}").mkdir()
+        (tmp_path / f"node{node}" / "cpulist").write_text(cpulist + "\n")
+    monkeypatch.setattr(pinning, "NUMA_NODE_DIR", str(tmp_path))
+    assert pinning.get_numa_node_cpus(1) == [2, 3]
+    assert pinning.get_numa_node_cpus("0") == [0, 1]
+    with pytest.raises(ValueError):
+        pinning.get_numa_node_cpus(2)
+
+
+def test_get_preexec_function():
+    assert pinning.get_preexec_function(None) is None
+    if pinning.can_pin():
+        assert callable(pinning.get_preexec_function([0]))
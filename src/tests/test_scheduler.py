@@ -0,0 +1,105 @@
+"""
+Tests the functionality of scheduler.py
+"""
+import os
+import time
+import pytest
+import pinning
+import scheduler
+import uploader
+
+
+@pytest.fixture(autouse=True)
+def spool(tmp_path, monkeypatch):
+    # The scheduler wakes this process's uploader, whose spool is kept out of the working directory
+    monkeypatch.setattr(uploader, "SPOOL_PATH", str(tmp_path / "upload_spool.db"))
+    monkeypatch.setattr(uploader, "upload_in_background", False)
+    monkeypatch.setattr(uploader, "uploader", None)
+
+
+def record_job(path, seconds):
+    # Records when the job ran, in its own file
+    start = time.monotonic()
+    time.sleep(seconds)
+    with open(path, 'w') as job_file:
+        job_file.write(f"{start} {time.monotonic()} {os.getpid()}")
+    return 0
+
+
+def read_spans(paths):
+    spans = []
+    for path in paths:
+        with open(path) as job_file:
+            start, end, pid = job_file.read().split()
+        spans.append((float(start), float(end)))
+    return spans
+
+
+def overlaps(span_1, span_2):
+    return span_1[0] < span_2[1] and span_2[0] < span_1[1]
+
+
+def test_run(tmp_path):
+    paths = [str(tmp_path / f"job_{index}") for index in range(4)]
+    # Two CPUs fit two of the single CPU jobs at a time, the last job conflicts with the first
+    jobs = [scheduler.Job(0, (paths[0], 0.5), 1, 1, False, "model"),
+            scheduler.Job(1, (paths[1], 0.5), 1, 1, False, None),
+            scheduler.Job(2, (paths[2], 0.5), 1, 1, False, None),
+            scheduler.Job(3, (paths[3], 0.1), 1, 1, False, "model")]
+    results = scheduler.SuiteScheduler(record_job, cpu_budget=2, memory_budget_gb=8).run(jobs)
+    assert results == [0, 0, 0, 0]
+
+    spans = read_spans(paths)
+    assert overlaps(spans[0], spans[1])
+    assert not overlaps(spans[0], spans[3])
+    # No more than two jobs ran at once
+    for span in spans:
+        assert sum(overlaps(span, other) for other in spans) <= 2
+
+
+def test_run_exclusive(tmp_path):
+    paths = [str(tmp_path / f"job_{index}") for index in range(3)]
+    jobs = [scheduler.Job(0, (paths[0], 0.3), 1, 1, False, None),
+            scheduler.Job(1, (paths[1], 0.3), 1, 1, True, None),
+            scheduler.Job(2, (paths[2], 0.3), 1, 1, False, None)]
+    results = scheduler.SuiteScheduler(record_job, cpu_budget=4, memory_budget_gb=8).run(jobs)
+    assert results == [0, 0, 0]
+
+    # The exclusive job ran on its own
+    spans = read_spans(paths)
+    assert not overlaps(spans[1], spans[0])
+    assert not overlaps(spans[1], spans[2])
+
+
+def record_affinity(path, seconds, cpu_set=None):
+    # Records the cores the job was given, and when it ran
+    start = time.monotonic()
+    time.sleep(seconds)
+    with open(path, 'w') as job_file:
+        job_file.write(f"{start} {time.monotonic()} {cpu_set}")
+    return 0
+
+
+def test_run_pinned(tmp_path, monkeypatch):
+    # The jobs aren't really pinned, only given cores, so any machine can pretend to have two
+    cpus = [0, 1]
+    monkeypatch.setattr(pinning, "can_pin", lambda: True)
+    monkeypatch.setattr(pinning, "get_available_cpus", lambda: cpus)
+    paths = [str(tmp_path / f"job_{index}") for index in range(3)]
+    # The third job is pinned to the first job's core, so it waits for the first job
+    jobs = [scheduler.Job(0, (paths[0], 0.5), 1, 1, False, None),
+            scheduler.Job(1, (paths[1], 0.5), 1, 1, False, None),
+            scheduler.Job(2, (paths[2], 0.1), 1, 1, False, None, [cpus[0]])]
+    results = scheduler.SuiteScheduler(record_affinity, cpu_budget=2, memory_budget_gb=8, pin=True).run(jobs)
+    assert results == [0, 0, 0]
+
+    runs = []
+    for path in paths:
+        with open(path) as job_file:
+            start, end, cpu_set = job_file.read().split()
+        runs.append(((float(start), float(end)), cpu_set))
+    # The jobs running at the same time were given different cores, and the pinned job kept its own CPU set
+    assert runs[0][1] == str(cpus[0]) and runs[1][1] == str(cpus[1])
+    assert runs[2][1] == "None"
+    assert overlaps(runs[0][0], runs[1][0])
+    assert not overlaps(runs[0][0], runs[2][0])
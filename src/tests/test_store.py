@@ -0,0 +1,131 @@
+"""
+Tests the functionality of store.py
+"""
+import json
+import pytest
+import aixprt
+import store
+
+WORKLOAD_ARGS = ['https://tfhub.dev/google/imagenet/inception_v3/feature_vector/1', "10", "0.02", "10", "20", "10",
+                 "100", "-1", "100", "True", "0", "0", "0", ""]
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend(request, tmp_path, monkeypatch):
+    # Store workloads and suites in a new backend of each kind
+    if request.param == "json":
+        test_backend = store.JSONBackend(str(tmp_path / "workloads.json"), str(tmp_path / "suites.json"))
+    else:
+        test_backend = store.SQLiteBackend(str(tmp_path / "aixprt.db"))
+    monkeypatch.setattr(store, "backend", test_backend)
+    return test_backend
+
+
+def test_incomplete_backend():
+    class IncompleteBackend(store.StoreBackend):
+        def has_workloads(self):
+            return False
+    # A backend that doesn't implement every method fails when it is created, not when the method is called
+    with pytest.raises(TypeError):
+        IncompleteBackend()
+
+
+def test_frozen_data(tmp_path):
+    json_path = tmp_path / "data.json"
+    json_path.write_text(json.dumps({'workloads': [{'name': "WL"}]}))
+    data = store.load_json(str(json_path))
+    # Ensure cached data can't be changed, but a thawed copy can
+    with pytest.raises(TypeError):
+        data['workloads'].append({})
+    data_copy = store.thaw(data)
+    data_copy['workloads'].append({})
+    assert data == {'workloads': [{'name': "WL"}]}
+    # Ensure unchanged files aren't parsed again, and changed files are
+    assert store.load_json(str(json_path)) is data
+    json_path.write_text(json.dumps({'workloads': []}))
+    assert store.load_json(str(json_path)) == {'workloads': []}
+
+
+def test_workloads(backend):
+    assert aixprt.add_workload("test_workload1", "test comment", *WORKLOAD_ARGS) == 0
+    assert aixprt.add_workload("test_workload2", "", *WORKLOAD_ARGS) == 0
+    assert aixprt.add_workload("test_workload1", "", *WORKLOAD_ARGS) == 1
+    assert list(aixprt.get_workloads()) == ["test_workload1", "test_workload2"]
+
+    # Rename a workload, but not to the name of another one
+    assert aixprt.edit_workload("test_workload1", "test_workload3", "edited", *WORKLOAD_ARGS) == 0
+    assert aixprt.edit_workload("test_workload3", "test_workload2", "edited", *WORKLOAD_ARGS) == 1
+    assert aixprt.get_workloads()["test_workload3"].comment == "edited"
+
+    assert aixprt.remove_workload("test_workload3").name == "test_workload3"
+    assert aixprt.remove_workload("test_workload3") == 0
+    assert list(aixprt.get_workloads()) == ["test_workload2"]
+
+
+def test_clear_pinning(backend, tmp_path, monkeypatch):
+    assert aixprt.add_workload("test_workload1", "", *WORKLOAD_ARGS, cpu_set="0-1", numa_node="0",
+                               intra_op_threads="2", inter_op_threads="1") == 0
+    assert aixprt.get_workloads()["test_workload1"].cpu_set == "0-1"
+    # Editing without the pinning removes it from the stored workload
+    assert aixprt.edit_workload("test_workload1", "test_workload1", "", *WORKLOAD_ARGS) == 0
+
+    # A new backend reads the workload back from the database or file
+    if isinstance(backend, store.JSONBackend):
+        monkeypatch.setattr(store, "backend", store.JSONBackend(backend.workloads_path, backend.suites_path))
+    else:
+        monkeypatch.setattr(store, "backend", store.SQLiteBackend(str(tmp_path / "aixprt.db")))
+    reloaded = aixprt.get_workloads()["test_workload1"]
+    assert reloaded.get_pinning() == {'cpus': None, 'numa_node': None, 'intra_op_threads': None,
+                                      'inter_op_threads': None}
+    assert "cpu set" not in aixprt.load_workloads()['workloads'][0]
+
+
+def test_suites(backend):
+    suite = [{'name': "test_workload1", 'iterations': 1}, {'name': "test_workload2", 'iterations': 2}]
+    assert aixprt.add_suite({"Test_Suite": suite}) == 0
+    assert aixprt.add_suite({"Test_Suite": suite}) == 1
+    assert aixprt.edit_workload_in_suite(1, 5, "Test_Suite") is None
+    assert aixprt.get_suite("Test_Suite")[1]['iterations'] == 5
+
+    assert aixprt.remove_workload_from_suite(0, "Test_Suite") == suite[0]
+    assert aixprt.get_suite("Test_Suite") == [{'name': "test_workload2", 'iterations': 5}]
+
+    assert aixprt.edit_suite("Test_Suite", {"Renamed_Suite": suite}) == 0
+    assert list(aixprt.load_suites()) == ["Renamed_Suite"]
+    assert aixprt.remove_suite({"Renamed_Suite": suite}) == suite
+    assert aixprt.load_suites() == {}
+
+
+def test_import_export(tmp_path):
+    suites = {"Test_Suite": [{'name': "WL", 'iterations': 3}], "Empty_Suite": []}
+    (tmp_path / "workloads.json").write_text(json.dumps({'workloads': [{'name': "WL", 'comment': ""}]}))
+    (tmp_path / "suites.json").write_text(json.dumps(suites))
+
+    # Import the JSON files into a database, then export it again
+    database = store.SQLiteBackend(str(tmp_path / "aixprt.db"))
+    store.import_json(database, str(tmp_path / "workloads.json"), str(tmp_path / "suites.json"))
+    store.export_json(database, str(tmp_path / "workloads_2.json"), str(tmp_path / "suites_2.json"))
+
+    assert json.loads((tmp_path / "workloads_2.json").read_text()) == {'workloads': [{'name': "WL", 'comment': ""}]}
+    assert json.loads((tmp_path / "suites_2.json").read_text()) == suites
+
+
+def test_remove_workload_from_suites(backend):
+    aixprt.add_workload("WL", "", *WORKLOAD_ARGS)
+    suite_1 = [{'name': "WL", 'iterations': 1}, {'name': "WL_2", 'iterations': 1}, {'name': "WL", 'iterations': 2}]
+    suite_2 = [{'name': "WL_2", 'iterations': 3}]
+    aixprt.add_suite({"Suite_1": suite_1})
+    aixprt.add_suite({"Suite_2": suite_2})
+    # Ensure only exact names are found
+    assert aixprt.is_workload_in_suites("WL") == [["Suite_1", 0], ["Suite_1", 2]]
+    assert aixprt.is_workload_in_suites("W") == 1
+
+    # Removing the workload removes it from every suite, and the rest keep their order
+    writes = getattr(backend, "writes", 0)
+    aixprt.remove_workload("WL")
+    if isinstance(backend, store.SQLiteBackend):
+        # The workload and its suite references are deleted in one transaction
+        assert backend.writes == writes + 1
+    assert aixprt.is_workload_in_suites("WL") == 1
+    assert aixprt.load_suites() == {"Suite_1": [{'name': "WL_2", 'iterations': 1}], "Suite_2": suite_2}
+    assert aixprt.is_workload_in_suites("WL_2") == [["Suite_1", 0], ["Suite_2", 0]]
@@ -0,0 +1,49 @@
+"""
+Tests the functionality of uploader.py
+"""
+import json
+
+import uploader
+
+# Nothing listens on this port, so uploads fail and results stay spooled
+UNREACHABLE_URL = "http://127.0.0.1:9/entries/"
+
+
+def test_enqueue(tmp_path):
+    spool_path = str(tmp_path / "spool.db")
+    uploader_1 = uploader.ResultUploader(UNREACHABLE_URL, spool_path)
+    # Queue results while the server is down
+    for runtime in range(3):
+        uploader_1.enqueue({'workload_model': "WL_model", 'runtime': runtime})
+    uploader_1.stop()
+    assert uploader_1.pending() == 3
+
+    # Ensure the results are still spooled for the next session
+    uploader_2 = uploader.ResultUploader(UNREACHABLE_URL, spool_path)
+    assert uploader_2.pending() == 3
+    uploader_2.stop()
+
+
+def test_upload_rejected(tmp_path, monkeypatch, capsys):
+    result_uploader = uploader.ResultUploader(UNREACHABLE_URL, str(tmp_path / "spool.db"), background=False)
+    result_uploader.enqueue({'workload_model': "WL_model", 'runtime': 1})
+    response = {"results": [{"status": "invalid", "errors": {"runtime": ["A valid number is required."]}}]}
+    monkeypatch.setattr(result_uploader, "post", lambda body, content_type: (400, json.dumps(response)))
+    result_uploader.upload_batch()
+    # Rejected results are set aside with the server's reason
+    assert result_uploader.pending() == 0
+    assert "A valid number is required." in capsys.readouterr().out
+    result_uploader.stop()
+
+
+def test_upload_batch_rejected(tmp_path, monkeypatch, capsys):
+    result_uploader = uploader.ResultUploader(UNREACHABLE_URL, str(tmp_path / "spool.db"), background=False)
+    result_uploader.enqueue({'workload_model': "WL_model", 'runtime': 1})
+    response = {"detail": "JSON parse error - Expecting value: line 1 column 1 (char 0)"}
+    monkeypatch.setattr(result_uploader, "post", lambda body, content_type: (400, json.dumps(response).encode()))
+    result_uploader.upload_batch()
+    # A batch the server refuses as a whole is set aside too, instead of blocking the results behind it
+    assert result_uploader.pending() == 0
+    assert result_uploader.backoff == 0
+    assert "JSON parse error" in capsys.readouterr().out
+    result_uploader.stop()
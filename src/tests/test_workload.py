@@ -83,3 +83,44 @@ def test_validate_parameters():
     invalid_2 = invalid_WL_2.validate_parameters()
     expected_invalid_2 = ["name", "tfhub_model", "training_steps", "learning_rate", "testing_percentage", "validation_percentage", "eval_step_interval", "train_batch_size", "test_batch_size", "validation_batch_size", "flip_left_right", "random_crop", "random_scale", "random_brightness"]
     assert invalid_2 == expected_invalid_2    
+
+
+def test_validate_pinning(tmp_path, monkeypatch):
+    # Pinning parameters are optional and are cast when they are given
+    workloadA = workload.Workload("Test_Workload", "", "https://tfhub.dev/google/imagenet/inception_v3/feature_vector/1", "200", "0.01", "10", "10", "10", "100", "-1", "100", "False", "0", "0", "0", "", "3,0-1", "1", "4", "2")
+    assert workloadA.validate_parameters() == []
+    assert workloadA.cpu_set == "0-1,3"
+    assert workloadA.numa_node == 1 and workloadA.intra_op_threads == 4 and workloadA.inter_op_threads == 2
+    assert workloadA.get_retrain_args()[-4:] == ["--intra_op_parallelism_threads", "4", "--inter_op_parallelism_threads", "2"]
+
+    # Only the cores of the CPU set that are on the NUMA node are used
+    (tmp_path / "node1").mkdir()
+    (tmp_path / "node1" / "cpulist").write_text("2-3\n")
+    monkeypatch.setattr(workload.pinning, "NUMA_NODE_DIR", str(tmp_path))
+    assert workloadA.get_cpu_set() == [3]
+    workloadA.cpu_set = None
+    assert workloadA.get_cpu_set() == [2, 3]
+    workloadA.numa_node = 0
+    with pytest.raises(ValueError):
+        workloadA.get_cpu_set()
+
+    workloadB = workload.Workload("Test_Workload", "", "https://tfhub.dev/google/imagenet/inception_v3/feature_vector/1", "200", "0.01", "10", "10", "10", "100", "-1", "100", "False", "0", "0", "0", "", "", "", "", "")
+    assert workloadB.validate_parameters() == []
+    assert workloadB.get_cpu_set() is None
+    assert workloadB.get_pinning() == {'cpus': None, 'numa_node': None, 'intra_op_threads': None, 'inter_op_threads': None}
+
+    invalid_WL = workload.Workload("Test_Workload", "", "https://tfhub.dev/google/imagenet/inception_v3/feature_vector/1", "200", "0.01", "10", "10", "10", "100", "-1", "100", "False", "0", "0", "0", "", "1-a", "-1", "two", "1.5")
+    assert invalid_WL.validate_parameters() == ["cpu_set", "numa_node", "intra_op_threads", "inter_op_threads"]
+
+
+def test_run_command(monkeypatch):
+    # The timing file is passed to retrain.py but isn't part of the recorded command
+    calls = []
+    monkeypatch.setattr(workload.subprocess, "call", lambda args, **kwargs: calls.append(args) or 0)
+    workloadA = workload.Workload("Test_Workload", "", "https://tfhub.dev/google/imagenet/inception_v3/feature_vector/1", "200", "0.01", "10", "10", "10", "100", "-1", "100", "False", "0", "0", "0", "")
+    assert workloadA.validate_parameters() == []
+    assert workloadA.run("warm", "startup", "/tmp/timing_1.json") == 0
+    assert calls[0][-2:] == ["--timing_output", "/tmp/timing_1.json"]
+    assert "timing" not in workloadA.command
+    workloadA.run("warm", "startup", "/tmp/timing_2.json")
+    assert calls[1][-1] == "/tmp/timing_2.json" and "timing" not in workloadA.command
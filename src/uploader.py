@@ -0,0 +1,305 @@
+"""
+#############
+uploader.py
+#############
+
+******
+About
+******
+
+uploader.py sends recorded workload results to the data API without holding up the benchmark.
+Results are first written to a local SQLite spool, so they survive the server being down or the
+program closing, and a background thread uploads them in batches to the bulk entries endpoint,
+one request per batch, over a kept-alive HTTP connection, retrying with exponential backoff when
+the server can't be reached. Once the server has the package versions of an environment, later
+results only send its hash
+
+**Authors:**
+    Jane Hiltz
+
+    Will James
+
+"""
+
+import atexit
+import hashlib
+import http.client
+import json
+import sqlite3
+import threading
+import traceback
+import urllib.parse
+
+# URL where batches of recorded runtime data are sent to
+UPLOAD_URL = "http://127.0.0.1:8000/entries/bulk/"
+
+# SQLite database that results wait in until they are uploaded
+SPOOL_PATH = "upload_spool.db"
+
+# Most results uploaded in one batch
+BATCH_SIZE = 100
+
+# Seconds to wait before retrying after a failed upload, doubling up to the maximum
+MIN_BACKOFF = 1
+MAX_BACKOFF = 300
+
+# The uploader shared by every result recorded from this process
+uploader = None
+
+# Whether this process uploads its results. Processes that run workloads for another process only spool them,
+# and the other process uploads them
+upload_in_background = True
+
+
+class ResultUploader(object):
+    """
+    Uploads queued results to the data API on a background thread
+
+    :param url: URL of the data API's bulk entries endpoint\n
+    :param spool_path: path to the SQLite database that queued results are kept in\n
+    :param background: False to only spool results, without starting the thread that uploads them\n
+    """
+
+    def __init__(self, url=UPLOAD_URL, spool_path=SPOOL_PATH, background=True):
+        """
+        Documented above.
+        """
+        self.url = urllib.parse.urlsplit(url)
+        self.spool_path = spool_path
+        self.lock = threading.Lock()
+        self.database = sqlite3.connect(spool_path, check_same_thread=False)
+        with self.lock, self.database:
+            self.database.execute("PRAGMA journal_mode=WAL")
+            self.database.execute("CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                  "entry TEXT NOT NULL, failed INTEGER NOT NULL DEFAULT 0)")
+            # Hashes of the environments that the server has the package versions of
+            self.database.execute("CREATE TABLE IF NOT EXISTS environments (hash TEXT PRIMARY KEY)")
+        self.environments = {row[0] for row in self.database.execute("SELECT hash FROM environments")}
+        self.connection = None
+        self.backoff = 0
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        if background:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def enqueue(self, entry):
+        """
+        Adds a result to the spool and returns straight away; it is uploaded in the background
+
+        :param entry: dictionary of the entry's fields\n
+        """
+        with self.lock, self.database:
+            self.database.execute("INSERT INTO spool (entry) VALUES (?)", (json.dumps(entry),))
+        self.wake.set()
+
+    def pending(self):
+        """
+        :return: the number of results waiting to be uploaded
+        """
+        with self.lock:
+            return self.database.execute("SELECT COUNT(*) FROM spool WHERE failed = 0").fetchone()[0]
+
+    def run(self):
+        """
+        Background thread that uploads the spool until the uploader is stopped
+        """
+        while not self.stopping.is_set():
+            self.wake.clear()
+            if self.upload_next():
+                # More results may be waiting, so the next batch is sent straight away
+                continue
+            if self.backoff:
+                # New results don't cut the backoff short, only stopping does
+                self.stopping.wait(self.backoff)
+            else:
+                self.wake.wait()
+        # Last chance to send what is queued before the program exits; anything left stays spooled
+        while self.backoff == 0 and self.upload_next():
+            pass
+        if self.connection is not None:
+            self.connection.close()
+
+    def upload_next(self):
+        """
+        Uploads the next batch of spooled results, backing off instead of ending the background thread if it fails
+
+        :return: True if more results may be waiting, see upload_batch
+        """
+        try:
+            return self.upload_batch()
+        except Exception:
+            traceback.print_exc()
+            self.back_off()
+            return False
+
+    def back_off(self):
+        """
+        Doubles the time to wait before the next upload, up to MAX_BACKOFF
+        """
+        self.backoff = min(max(self.backoff * 2, MIN_BACKOFF), MAX_BACKOFF)
+
+    def upload_batch(self):
+        """
+        Uploads the next batch of spooled results
+
+        :return: True if a full batch was uploaded or some results need sending again, so more may be waiting
+        """
+        with self.lock:
+            rows = self.database.execute("SELECT id, entry FROM spool WHERE failed = 0 ORDER BY id LIMIT ?",
+                                         (BATCH_SIZE,)).fetchall()
+        if not rows:
+            return False
+
+        uploaded = []
+        rejected = []
+        acknowledged = []
+        forgotten = []
+        entries = [self.strip_environment(json.loads(entry)) for row_id, entry in rows]
+        try:
+            status, body = self.post("\n".join(json.dumps(entry) for entry in entries), "application/x-ndjson")
+            results = self.row_results(body) if status < 500 else None
+            if status >= 500 or status < 400 and results is None:
+                # The server failed or answered without the status of each row, so the batch is sent again later
+                raise http.client.HTTPException(f"HTTP {status}")
+            if results is None:
+                # The server refused the whole batch, e.g. as unparseable or too large, so retrying it can't help
+                rejected = [row_id for row_id, entry in rows]
+                print(f"The data API rejected a batch of {len(rejected)} result(s) with HTTP {status}: "
+                      f"{body.decode('utf-8', 'replace')}")
+            else:
+                # The response has the status of each row, in the order they were sent
+                for (row_id, entry), sent, result in zip(rows, entries, results):
+                    if result["status"] == "created":
+                        uploaded.append(row_id)
+                        if result.get("environment_hash"):
+                            acknowledged.append(result["environment_hash"])
+                    elif "environment_hash" in result.get("errors", {}) and "package_versions" not in sent:
+                        # The server no longer has the environment, so the result is sent again with it
+                        forgotten.append(sent["environment_hash"])
+                    else:
+                        rejected.append(row_id)
+                        print(f"The data API rejected the {sent.get('workload_model')} result {row_id}: "
+                              f"{json.dumps(result.get('errors', {}))}")
+            if rejected:
+                # The server won't ever accept these results, so they are kept aside instead of retried
+                print(f"The data API rejected {len(rejected)} result(s), they are kept in {self.spool_path}")
+            self.backoff = 0
+        except (http.client.HTTPException, OSError):
+            self.back_off()
+        finally:
+            with self.lock, self.database:
+                self.database.executemany("DELETE FROM spool WHERE id = ?", [(row_id,) for row_id in uploaded])
+                self.database.executemany("UPDATE spool SET failed = 1 WHERE id = ?",
+                                          [(row_id,) for row_id in rejected])
+                self.database.executemany("INSERT OR IGNORE INTO environments (hash) VALUES (?)",
+                                          [(content_hash,) for content_hash in acknowledged])
+                self.database.executemany("DELETE FROM environments WHERE hash = ?",
+                                          [(content_hash,) for content_hash in forgotten])
+            self.environments.update(acknowledged)
+            self.environments.difference_update(forgotten)
+        return self.backoff == 0 and (len(rows) == BATCH_SIZE or bool(forgotten))
+
+    @staticmethod
+    def row_results(body):
+        """
+        Reads the status of each row from a bulk upload response
+
+        :param body: the response body
+
+        :return: the list of row results, or None if the response doesn't have one
+        """
+        try:
+            results = json.loads(body)["results"]
+        except (ValueError, KeyError, TypeError):
+            return None
+        return results if isinstance(results, list) else None
+
+    def strip_environment(self, entry):
+        """
+        Adds the hash of the entry's package versions, and leaves the package versions out if the server already
+        has them
+
+        :param entry: dictionary of the entry's fields\n
+        :return: the entry to send
+        """
+        if "package_versions" in entry:
+            entry["environment_hash"] = hashlib.sha1(entry["package_versions"].encode("utf-8")).hexdigest()
+            if entry["environment_hash"] in self.environments:
+                del entry["package_versions"]
+        return entry
+
+    def post(self, body, content_type="application/json"):
+        """
+        Posts a request body to the data API, reusing the open connection if the server kept it alive
+
+        :param body: the encoded request body\n
+        :param content_type: the body's content type\n
+        :return: the HTTP status and body of the response
+        """
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.url.hostname, self.url.port, timeout=30)
+            try:
+                self.connection.request("POST", self.url.path or "/", body.encode("utf-8"),
+                                        {"Content-Type": content_type})
+                response = self.connection.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                self.connection = None
+                # The server may have closed a kept-alive connection, so one new connection is tried
+                if attempt:
+                    raise
+
+    def stop(self, timeout=5):
+        """
+        Stops the background thread, giving it up to timeout seconds to upload what is queued
+
+        :param timeout: seconds to wait for the background thread\n
+        """
+        self.stopping.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def notify(self):
+        """
+        Wakes the background thread to upload results that another process has spooled
+        """
+        self.wake.set()
+
+
+def get_uploader():
+    """
+    Returns the running uploader, starting one if there isn't one
+
+    :return: a ResultUploader object
+    """
+    global uploader
+    if uploader is None:
+        uploader = ResultUploader(UPLOAD_URL, SPOOL_PATH, background=upload_in_background)
+    return uploader
+
+
+def upload(entry):
+    """
+    Queues a result to be uploaded to the data API in the background
+
+    :param entry: dictionary of the entry's fields\n
+    """
+    get_uploader().enqueue(entry)
+
+
+def shutdown():
+    """
+    Stops the uploader, if one is running
+    """
+    global uploader
+    if uploader is not None:
+        uploader.stop()
+        uploader = None
+
+
+atexit.register(shutdown)
@@ -9,7 +9,8 @@ About
 
 workload.py is a class representation of a workload. A workload object
 will contain all of its customizable parameters, be able to validate its
-parameters, and be able to run themselves using Tensorflow
+parameters, and be able to run themselves using Tensorflow. A workload can
+be pinned to a set of CPU cores or a NUMA node, see pinning.py
 
 **Authors:**
     Jane Hiltz
@@ -20,6 +21,8 @@ parameters, and be able to run themselves using Tensorflow
 
 import subprocess
 import re
+import pinning
+import runner
 
 
 class Workload(object):
@@ -42,11 +45,16 @@ class Workload(object):
     :param random_scale: Percentage determining how much to randomly scale the size of the training images by\n
     :param random_brightness: Percentage determining how much to randomly multiply the training image input pixels up or down by\n
     :param command: Optional console command to be run upon running this workload\n
+    :param cpu_set: Optional CPU cores to pin the workload to, like "0-3,8"\n
+    :param numa_node: Optional NUMA node to pin the workload to. With a CPU set, only the set's cores on the node are used\n
+    :param intra_op_threads: Optional number of threads a single Tensorflow op may use\n
+    :param inter_op_threads: Optional number of Tensorflow ops that may run at the same time\n
     """
 
     def __init__(self, name, comment, tfhub_model, training_steps, learning_rate, testing_percentage,
                  validation_percentage, eval_step_interval, train_batch_size, test_batch_size, validation_batch_size,
-                 flip_left_right, random_crop, random_scale, random_brightness, command):
+                 flip_left_right, random_crop, random_scale, random_brightness, command, cpu_set=None, numa_node=None,
+                 intra_op_threads=None, inter_op_threads=None):
         """
         Documented above.
         """
@@ -67,6 +75,12 @@ class Workload(object):
         self.random_scale = random_scale
         self.random_brightness = random_brightness
         self.command = command
+        self.cpu_set = cpu_set
+        self.numa_node = numa_node
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        # Set once run() has filled in command with the retrain.py command line
+        self.is_retrain_command = False
 
     def validate_parameters(self):
         """
@@ -161,6 +175,25 @@ class Workload(object):
             else:
                 invalid.append("random_brightness")
 
+        # Pinning is optional, and applies to custom commands as well
+        # CPU Set should be a list of CPU cores like "0-3,8"
+        if self.cpu_set == "" or self.cpu_set is None:
+            self.cpu_set = None
+        else:
+            try:
+                self.cpu_set = pinning.format_cpu_list(pinning.parse_cpu_list(self.cpu_set))
+            except ValueError:
+                invalid.append("cpu_set")
+        # NUMA Node and the thread counts should be ints
+        for parameter in ("numa_node", "intra_op_threads", "inter_op_threads"):
+            value = getattr(self, parameter)
+            if value == "" or value is None:
+                setattr(self, parameter, None)
+            elif re.match(pattern_int, str(value)):
+                setattr(self, parameter, int(value))
+            else:
+                invalid.append(parameter)
+
         #Printing for testing
         if len(invalid) > 0:
             print("Invalid Parameters:")
@@ -168,43 +201,83 @@ class Workload(object):
 
         return invalid
 
-    def run(self):
+    def get_retrain_args(self, cache_mode="warm"):
+        """
+        Builds the command line arguments that run this workload with Tensorflow's retrain.py script
+
+        :param cache_mode: "warm" to reuse bottlenecks cached by earlier runs, "cold" to recalculate all of them\n
+        :return: a list of command line arguments for retrain.py
+        """
+        args = ["--image_dir", "../../flower_photos", "--how_many_training_steps", f"{self.training_steps}",
+                "--learning_rate", f"{self.learning_rate}", "--testing_percentage", f"{self.testing_percentage}",
+                "--validation_percentage", f"{self.validation_percentage}", "--eval_step_interval",
+                f"{self.eval_step_interval}", "--train_batch_size", f"{self.train_batch_size}", "--test_batch_size",
+                f"{self.test_batch_size}", "--validation_batch_size", f"{self.validation_batch_size}"]
+        # Checking if the variables that drastically increase runtime have been changed from the default values
+        if self.flip_left_right or self.random_brightness != 0 or self.random_crop != 0 or self.random_scale != 0:
+            args += ["--flip_left_right", f"{self.flip_left_right}", "--random_crop", f"{self.random_crop}",
+                     "--random_scale", f"{self.random_scale}", "--random_brightness", f"{self.random_brightness}"]
+        # If the previously checked variables are the same as the default values, exludes them to avoid bogging down performance
+        args += ["--tfhub_module", f"{self.tfhub_model}", "--bottleneck_cache_mode", cache_mode]
+        if self.intra_op_threads:
+            args += ["--intra_op_parallelism_threads", f"{self.intra_op_threads}"]
+        if self.inter_op_threads:
+            args += ["--inter_op_parallelism_threads", f"{self.inter_op_threads}"]
+        return args
+
+    def get_cpu_set(self):
+        """
+        Works out the CPU cores the workload is pinned to from its CPU set and NUMA node
+
+        :return: a sorted list of CPU numbers, or None if the workload isn't pinned. Raises ValueError if the NUMA node
+            doesn't exist or has none of the cores in the CPU set
+        """
+        cpus = None
+        if self.cpu_set is not None:
+            cpus = pinning.parse_cpu_list(self.cpu_set)
+        if self.numa_node is not None:
+            node_cpus = pinning.get_numa_node_cpus(self.numa_node)
+            cpus = node_cpus if cpus is None else sorted(set(cpus) & set(node_cpus))
+            if not cpus:
+                raise ValueError(f"NUMA node {self.numa_node} has none of the CPU cores {self.cpu_set}")
+        return cpus
+
+    def get_pinning(self):
+        """
+        :return: a dictionary of the CPU cores, NUMA node and Tensorflow thread counts the workload runs with, to be
+            recorded with its results. Values that aren't set, or that don't apply to a custom command, are None
+        """
+        cpus = self.get_cpu_set()
+        is_retrain = self.command == "" or self.command is None or self.is_retrain_command
+        return {
+            'cpus': pinning.format_cpu_list(cpus) if cpus is not None and pinning.can_pin() else None,
+            'numa_node': self.numa_node,
+            'intra_op_threads': self.intra_op_threads if is_retrain else None,
+            'inter_op_threads': self.inter_op_threads if is_retrain else None
+        }
+
+    def run(self, cache_mode="warm", run_mode="startup", timing_output=None):
         """
         Runs the workload by calling Tensorflow's retrain.py script or by calling the workload's custom command argument
+
+        :param cache_mode: "warm" to reuse bottlenecks cached by earlier runs, "cold" to recalculate all of them\n
+        :param run_mode: "startup" to start a new retrain.py process, so Python and Tensorflow startup is included in
+            the run, or "warm" to run it in the long-lived worker kept by runner.py\n
+        :param timing_output: optional path where retrain.py writes the timings of each phase of the run\n
+        :return: 0 if the workload ran successfully, otherwise a non-zero status
         """
-        if self.command == "" or self.command is None:
-            # Checking if the variables that drastically increase runtime have been changed from the default values
-            if self.flip_left_right or self.random_brightness != 0 or self.random_crop != 0 or self.random_scale != 0:
-                self.command = f"python TensorFlow/retrain.py --image_dir ../../flower_photos --how_many_training_steps {self.training_steps} --learning_rate " +\
-                f"{self.learning_rate} --testing_percentage {self.testing_percentage} --validation_percentage {self.validation_percentage} --eval_step_interval " +\
-                f"{self.eval_step_interval} --train_batch_size {self.train_batch_size} --test_batch_size {self.test_batch_size} --validation_batch_size " +\
-                f"{self.validation_batch_size} --flip_left_right {self.flip_left_right} --random_crop {self.random_crop} --random_scale {self.random_scale} --random_brightness " +\
-                f"{self.random_brightness} --tfhub_module {self.tfhub_model}"
-                
-                subprocess.call(["python", "TensorFlow/retrain.py", "--image_dir", "../../flower_photos", "--how_many_training_steps",
-                     f"{self.training_steps}", "--learning_rate",
-                     f"{self.learning_rate}", "--testing_percentage", f"{self.testing_percentage}",
-                     "--validation_percentage", f"{self.validation_percentage}", "--eval_step_interval",
-                     f"{self.eval_step_interval}", "--train_batch_size", f"{self.train_batch_size}", "--test_batch_size",
-                     f"{self.test_batch_size}", "--validation_batch_size",
-                     f"{self.validation_batch_size}", "--flip_left_right", f"{self.flip_left_right}", "--random_crop",
-                     f"{self.random_crop}", "--random_scale", f"{self.random_scale}",
-                     "--random_brightness", f"{self.random_brightness}", "--tfhub_module", f"{self.tfhub_model}"])
-            # If the previously checked variables are the same as the default values, exludes them from the subprocess call to avoid bogging down performance
-            else:
-                self.command = (f"python TensorFlow/retrain.py --image_dir ../../flower_photos --how_many_training_steps {self.training_steps} --learning_rate " +\
-                f"{self.learning_rate} --testing_percentage {self.testing_percentage} --validation_percentage {self.validation_percentage} --eval_step_interval " +\
-                f"{self.eval_step_interval} --train_batch_size {self.train_batch_size} --test_batch_size {self.test_batch_size} --validation_batch_size " +\
-                f"{self.validation_batch_size} --tfhub_module {self.tfhub_model}")
-
-                subprocess.call(
-                    ["python", "TensorFlow/retrain.py", "--image_dir", "../../flower_photos", "--how_many_training_steps",
-                     f"{self.training_steps}", "--learning_rate",
-                     f"{self.learning_rate}", "--testing_percentage", f"{self.testing_percentage}",
-                     "--validation_percentage", f"{self.validation_percentage}", "--eval_step_interval",
-                     f"{self.eval_step_interval}", "--train_batch_size", f"{self.train_batch_size}", "--test_batch_size",
-                     f"{self.test_batch_size}", "--validation_batch_size",
-                     f"{self.validation_batch_size}", "--tfhub_module", f"{self.tfhub_model}"])
+        # The process is pinned as it starts, so none of its threads ever run on other cores
+        cpus = self.get_cpu_set()
+        if self.command == "" or self.command is None or self.is_retrain_command:
+            args = self.get_retrain_args(cache_mode)
+            self.command = "python TensorFlow/retrain.py " + " ".join(args)
+            self.is_retrain_command = True
+            # The timing file is left out of the recorded command, so every run of the workload records the same one
+            if timing_output:
+                args += ["--timing_output", timing_output]
+            if run_mode == "warm":
+                return runner.run_retrain(args, cpus, self.inter_op_threads)
+            return subprocess.call(["python", "TensorFlow/retrain.py"] + args,
+                                   preexec_fn=pinning.get_preexec_function(cpus))
         else:
-            subprocess.call(self.command, shell=True)
-        
+            return subprocess.call(self.command, shell=True, preexec_fn=pinning.get_preexec_function(cpus))